@@ -1,9 +1,21 @@
+import asyncio
+import logging
 from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends
-from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Tuple, AsyncIterator
 from app.core.config import settings
-from app.models.analysis import AnalysisResponse
-from app.services.excel_service import ExcelProcessor
+from app.models.analysis import AnalysisResponse, AnalysisEstimate
+from app.services.checks import CheckReport, check_engine
+from app.services.excel_service import ExcelProcessor, SpooledUpload
+from app.services.session_service import session_service
 from app.dependencies import get_ai_service
+from app.utils.cache import TieredCache
+from app.utils.executor import parse_executor
+from app.utils.metrics import metrics
+from app.utils.singleflight import parse_flight, analysis_flight
+from app.utils.streaming import STREAM_HEADERS, sse_event, ndjson_event
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -15,77 +27,289 @@ excel_processor = ExcelProcessor()
 async def analyze_accounting_files(
     files: List[UploadFile] = File(..., description="Archivos Excel para analizar"),
     prompt: Optional[str] = Form(None, description="Prompt personalizado para el análisis"),
+    use_cache: bool = Form(True, description="Usar respuestas de análisis previos idénticos"),
+    encoding: Optional[str] = Form(None, description="Codificación de las filas en el prompt: rows o compact"),
     ai_svc = Depends(get_ai_service)
 ):
     """
     Analizar archivos contables de Excel para detectar errores en cuadres contables.
     
-    - **files**: Uno o más archivos Excel (.xlsx, .xls)
+    - **files**: Uno o más archivos Excel (.xlsx, .xlsm, .xlsb, .xls) o CSV
     - **prompt**: Prompt personalizado opcional para el análisis
+    - **use_cache**: `false` para forzar un análisis nuevo aunque exista uno en caché
+    - **encoding**: `rows` (etiqueta por celda) o `compact` (encabezado y filas delimitadas, menos tokens)
     
-    Retorna un análisis estructurado con hallazgos y recomendaciones.
+    Retorna un análisis estructurado con hallazgos y recomendaciones. Los
+    hallazgos de la verificación local (cuadres, saldos, totales, duplicados)
+    van primero; el modelo solo recibe las filas que esta señala, y no se
+    consulta cuando la verificación local resuelve el análisis.
+    Responde 413 si el análisis supera los límites de tokens o de costo.
     """
+    excel_data, file_names, report = await _read_and_extract(files, encoding)
+    
+    if not report.model_needed:
+        metrics.increment("analysis.settled_locally")
+        analysis_result = report.local_response()
+        analysis_result.session_id = await _create_session(analysis_result, excel_data, file_names)
+        return analysis_result
+    
+    model_data = report.model_view(excel_data)
+    model_prompt = report.model_prompt(prompt or "")
+    estimate = await _check_estimate(ai_svc, model_data, model_prompt)
+    
+    try:
+        # Analyze with AI service, sharing the call with identical concurrent requests
+        analysis_result = await analysis_flight.do(
+            TieredCache.hash_key("analysis", model_data, model_prompt, use_cache),
+            ai_svc.analyze_accounting_data_async,
+            model_data,
+            model_prompt,
+            use_cache=use_cache
+        )
+        
+        # Each request gets its own copy and chat session
+        analysis_result = report.merge_into(analysis_result.model_copy(deep=True))
+        analysis_result.metadata = {
+            **(analysis_result.metadata or {}),
+            "estimated_input_tokens": estimate.input_tokens,
+            "projected_cost_usd": estimate.projected_cost_usd
+        }
+        
+        # Create session for chat
+        analysis_result.session_id = await _create_session(analysis_result, excel_data, file_names)
+        
+        return analysis_result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al analizar los archivos: {str(e)}"
+        )
+
+
+@router.post("/estimate", response_model=AnalysisEstimate)
+async def estimate_analysis(
+    files: List[UploadFile] = File(..., description="Archivos Excel para estimar"),
+    prompt: Optional[str] = Form(None, description="Prompt personalizado para el análisis"),
+    encoding: Optional[str] = Form(None, description="Codificación de las filas en el prompt: rows o compact"),
+    ai_svc = Depends(get_ai_service)
+):
+    """
+    Estimar el análisis de archivos contables sin llamar a OpenAI.
+    
+    - **files**: Uno o más archivos Excel (.xlsx, .xlsm, .xlsb, .xls) o CSV
+    - **prompt**: Prompt personalizado opcional para el análisis
+    - **encoding**: `rows` o `compact`, como en `/analyze`
+    
+    Retorna los tokens de entrada, el costo proyectado, el plan de partes
+    (`chunk_tokens`) y si el análisis está dentro de los límites (`allowed`).
+    Cuenta solo lo que el modelo recibiría tras la verificación local; la
+    estrategia es `local` cuando no hace falta consultarlo.
+    """
+    excel_data, _, report = await _read_and_extract(files, encoding)
+    estimate = await parse_executor.run(
+        ai_svc.estimate_analysis, report.model_view(excel_data), report.model_prompt(prompt or "")
+    )
+    if not report.model_needed:
+        return estimate.model_copy(update={
+            "strategy": "local", "calls": 0, "chunk_tokens": [], "input_tokens": 0, "projected_cost_usd": 0.0
+        })
+    return estimate
+
+
+@router.post("/stream")
+async def stream_accounting_analysis(
+    files: List[UploadFile] = File(..., description="Archivos Excel para analizar"),
+    prompt: Optional[str] = Form(None, description="Prompt personalizado para el análisis"),
+    use_cache: bool = Form(True, description="Usar respuestas de análisis previos idénticos"),
+    encoding: Optional[str] = Form(None, description="Codificación de las filas en el prompt: rows o compact"),
+    stream_format: str = Form("ndjson", description="Formato del stream: ndjson o sse"),
+    ai_svc = Depends(get_ai_service)
+):
+    """
+    Analizar archivos contables emitiendo cada hallazgo y recomendación en
+    cuanto el modelo lo termina de generar.
+    
+    - **files**: Uno o más archivos Excel (.xlsx, .xlsm, .xlsb, .xls) o CSV
+    - **prompt**: Prompt personalizado opcional para el análisis
+    - **use_cache**: `false` para forzar un análisis nuevo aunque exista uno en caché
+    - **encoding**: `rows` (etiqueta por celda) o `compact` (encabezado y filas delimitadas, menos tokens)
+    - **stream_format**: `ndjson` (una línea JSON por evento) o `sse`
+    
+    Emite eventos `finding` y `recommendation`, y al final un evento `summary`
+    con el resumen, los metadatos y el `session_id` para el chat. Los
+    hallazgos de la verificación local se emiten primero.
+    """
+    if stream_format not in ("ndjson", "sse"):
+        raise HTTPException(
+            status_code=400,
+            detail="Formato de stream no soportado. Formatos permitidos: ndjson, sse"
+        )
+    
+    excel_data, file_names, report = await _read_and_extract(files, encoding)
+    if report.model_needed:
+        await _check_estimate(ai_svc, report.model_view(excel_data), report.model_prompt(prompt or ""))
+    format_event = sse_event if stream_format == "sse" else ndjson_event
+    
+    return StreamingResponse(
+        _analysis_events(ai_svc, excel_data, file_names, report, prompt or "", use_cache, format_event),
+        media_type="text/event-stream" if stream_format == "sse" else "application/x-ndjson",
+        headers=STREAM_HEADERS
+    )
+
+
+async def _analysis_events(ai_svc, excel_data: str, file_names: List[str], report: CheckReport, prompt: str, use_cache: bool, format_event) -> AsyncIterator[str]:
+    """Format the local findings and the streamed analysis items, ending with the summary and session"""
+    for finding in report.findings:
+        yield format_event("finding", finding.model_dump())
+    
+    if not report.model_needed:
+        metrics.increment("analysis.settled_locally")
+        result = report.local_response()
+        yield format_event("summary", {
+            "success": result.success,
+            "error": result.error,
+            "summary": result.summary,
+            "metadata": result.metadata,
+            "session_id": await _create_session(result, excel_data, file_names)
+        })
+        return
+    
+    try:
+        model_data = report.model_view(excel_data)
+        async for kind, value in ai_svc.stream_accounting_analysis(model_data, report.model_prompt(prompt), use_cache=use_cache):
+            if kind != "result":
+                yield format_event(kind, value.model_dump())
+                continue
+            
+            value = report.merge_into(value)
+            session_id = await _create_session(value, excel_data, file_names)
+            yield format_event("summary", {
+                "success": value.success,
+                "error": value.error,
+                "summary": value.summary,
+                "metadata": value.metadata,
+                "session_id": session_id
+            })
+    except Exception as e:
+        logger.error(f"Error streaming analysis: {e}")
+        metrics.increment("analysis.stream_errors")
+        yield format_event("error", {"error": f"Error al analizar los archivos: {str(e)}"})
+
+
+async def _check_estimate(ai_svc, excel_data: str, prompt: str) -> AnalysisEstimate:
+    """Estimate the analysis off the event loop and reject it if it is over the limits"""
+    estimate = await parse_executor.run(ai_svc.estimate_analysis, excel_data, prompt)
+    if not estimate.allowed:
+        metrics.increment("analysis.rejected_by_estimate")
+        raise HTTPException(status_code=413, detail=estimate.reason)
+    
+    metrics.observe("analysis.estimated_input_tokens", estimate.input_tokens)
+    return estimate
+
+
+async def _read_and_extract(files: List[UploadFile], encoding: Optional[str] = None) -> Tuple[str, List[str], CheckReport]:
+    """Read and validate the uploads, then extract and check their data off the event loop"""
     if not files:
         raise HTTPException(
             status_code=400,
             detail="No se proporcionaron archivos para analizar"
         )
     
+    encoding = excel_processor.validate_encoding(encoding)
+    
     # Validate and process files
-    processed_files = []
-    
-    for file in files:
-        if not file.filename:
-            raise HTTPException(
-                status_code=400,
-                detail="Todos los archivos deben tener un nombre"
-            )
-        
-        try:
-            # Read file content
-            content = await file.read()
-            
-            # Validate file
-            excel_processor.validate_file(
-                file.filename,
-                len(content),
-                settings.MAX_FILE_SIZE
-            )
-            
-            # Store file data
-            processed_files.append({
-                'filename': file.filename,
-                'content': content
-            })
-            
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al procesar el archivo {file.filename}: {str(e)}"
-            )
+    uploads = []
+    handed_over = False
     
     try:
-        # Process Excel files
-        if len(processed_files) == 1:
-            excel_data = excel_processor.extract_data_from_excel(
-                processed_files[0]['content'],
-                processed_files[0]['filename']
-            )
-        else:
-            excel_data = excel_processor.process_multiple_files(processed_files)
+        for file in files:
+            if not file.filename:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Todos los archivos deben tener un nombre"
+                )
+            
+            try:
+                # Read in chunks, rejecting invalid or oversized files early
+                uploads.append(
+                    await excel_processor.read_upload(file, settings.MAX_FILE_SIZE)
+                )
+                
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error al procesar el archivo {file.filename}: {str(e)}"
+                )
         
-        # Analyze with AI service
-        analysis_result = ai_svc.analyze_accounting_data(
-            excel_data,
-            prompt or ""
+        def parse():
+            # Only called for the request that starts the parse, which then owns the uploads
+            nonlocal handed_over
+            handed_over = True
+            return _parse_uploads(uploads, encoding)
+        
+        # Concurrent requests with the same files share one parse
+        key = TieredCache.hash_key(
+            "parse", encoding, *(part for upload in uploads for part in (upload.filename, upload.digest))
         )
+        excel_data, report = await parse_flight.do(key, parse)
         
-        return analysis_result
+        return excel_data, [upload.filename for upload in uploads], report
         
+    finally:
+        if not handed_over:
+            for upload in uploads:
+                upload.cleanup()
+
+
+async def _parse_uploads(uploads: List[SpooledUpload], encoding: str) -> Tuple[str, CheckReport]:
+    """Extract and check the data of the uploads off the event loop, then remove them"""
+    # Large files are passed to the parser as the path of their spooled copy
+    processed_files = [
+        {'filename': upload.filename, 'content': upload.source}
+        for upload in uploads
+    ]
+    
+    try:
+        # Process Excel files off the event loop
+        return await parse_executor.run(_extract_and_check, processed_files, encoding)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error al analizar los archivos: {str(e)}"
-        ) 
\ No newline at end of file
+        )
+    finally:
+        for upload in uploads:
+            upload.cleanup()
+
+
+def _extract_and_check(processed_files: List[dict], encoding: str) -> Tuple[str, CheckReport]:
+    """Extract the text of the files and run the accounting checks on the sheets read for it.
+    
+    Several files are checked where they are parsed, in the process pool when there is one.
+    """
+    checks = check_engine if settings.ACCOUNTING_CHECKS_ENABLED else None
+    if len(processed_files) == 1:
+        content, filename = processed_files[0]['content'], processed_files[0]['filename']
+        excel_data, sheets = excel_processor.extract_sheets(content, filename, encoding)
+        reports = [checks.check_file(content, filename, sheets) if checks is not None else None]
+    else:
+        excel_data, reports = excel_processor.extract_files(processed_files, encoding, checks)
+    
+    return excel_data, check_engine.combine(reports)
+
+
+async def _create_session(analysis_result: AnalysisResponse, excel_data: str, file_names: List[str]) -> str:
+    """Create the chat session of an analysis, writing it to the store off the event loop"""
+    return await asyncio.to_thread(
+        session_service.create_session,
+        analysis_result=analysis_result.model_dump(),
+        excel_data={"data": excel_data, "files": file_names},
+        file_names=file_names
+    )
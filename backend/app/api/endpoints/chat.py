@@ -1,7 +1,17 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from app.models.chat import ChatRequest, ChatResponse
-from app.services.session_service import session_service
+from app.services.conversation import ConversationContext
+from app.services.session_service import conversation_compactor, session_service
 from app.dependencies import get_ai_service
+from app.utils.metrics import metrics
+from app.utils.streaming import STREAM_HEADERS, sse_event
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -20,48 +30,38 @@ async def chat_with_analysis(
     Retorna la respuesta del chat con el contexto del análisis.
     """
     try:
-        # Get session
-        session = session_service.get_session(chat_request.session_id)
+        # Get session, off the event loop: the store may wait on a lock or decompress the payload
+        session = await asyncio.to_thread(session_service.get_session, chat_request.session_id)
         if not session:
             raise HTTPException(
                 status_code=404,
                 detail="Sesión no encontrada"
             )
         
-        # Create conversation context
-        context_parts = [
-            f"ANÁLISIS PREVIO: {session.analysis_result.get('summary', 'No disponible')}",
-            f"ARCHIVOS ANALIZADOS: {', '.join(session.file_names)}",
-            "HALLAZGOS PRINCIPALES:",
-        ]
-        
-        # Add findings to context
-        findings = session.analysis_result.get('findings', [])
-        for finding in findings[:5]:  # Limit to top 5 findings
-            context_parts.append(f"- {finding.get('title', 'Sin título')}: {finding.get('description', 'Sin descripción')}")
-        
-        # Add conversation history
-        context_parts.append("CONVERSACIÓN PREVIA:")
-        for msg in session.conversation_history[-5:]:  # Last 5 messages
-            context_parts.append(f"{msg.role}: {msg.content}")
-        
-        conversation_context = "\n".join(context_parts)
+        # Conversation context kept up to date by the session service
+        conversation_context = session_service.context(session)
         
         # Get AI response
-        ai_response = ai_svc.chat_with_context(
+        ai_response = await ai_svc.chat_with_context_async(
             conversation_context,
             chat_request.message
         )
         
-        # Update session with new messages
-        session_service.add_message_to_session(
+        # Update session with new messages, off the event loop
+        updated_session = await asyncio.to_thread(
+            session_service.add_message_to_session,
             chat_request.session_id,
             chat_request.message,
             ai_response
         )
-        
-        # Get updated session
-        updated_session = session_service.get_session(chat_request.session_id)
+        if not updated_session:
+            # Expired while the answer was generated
+            raise HTTPException(
+                status_code=404,
+                detail="Sesión no encontrada"
+            )
+        # Fold older turns into the summary in the background if the history is long
+        conversation_compactor.schedule(updated_session, ai_svc)
         
         return ChatResponse(
             response=ai_response,
@@ -75,4 +75,70 @@ async def chat_with_analysis(
         raise HTTPException(
             status_code=500,
             detail=f"Error en el chat: {str(e)}"
-        ) 
\ No newline at end of file
+        )
+
+
+@router.post("/stream")
+async def stream_chat_with_analysis(
+    chat_request: ChatRequest,
+    ai_svc = Depends(get_ai_service)
+):
+    """
+    Chatear con el contexto de un análisis previo recibiendo la respuesta
+    como server-sent events a medida que se genera.
+    
+    - **session_id**: ID de la sesión del análisis previo
+    - **message**: Mensaje del usuario
+    
+    Emite eventos `delta` con cada fragmento del texto, y al final un evento
+    `done` con la respuesta completa (o `error` si la generación falla).
+    La respuesta se guarda en la sesión cuando el stream termina.
+    """
+    session = await asyncio.to_thread(session_service.get_session, chat_request.session_id)
+    if not session:
+        raise HTTPException(
+            status_code=404,
+            detail="Sesión no encontrada"
+        )
+    
+    conversation_context = session_service.context(session)
+    
+    return StreamingResponse(
+        _chat_events(ai_svc, chat_request, conversation_context),
+        media_type="text/event-stream",
+        headers=STREAM_HEADERS
+    )
+
+
+async def _chat_events(ai_svc, chat_request: ChatRequest, conversation_context: ConversationContext) -> AsyncIterator[str]:
+    """Forward the model's tokens as SSE events and commit the answer at the end"""
+    started = time.perf_counter()
+    parts = []
+    
+    try:
+        async for delta in ai_svc.stream_chat_with_context(conversation_context, chat_request.message):
+            if not parts:
+                metrics.observe("chat.time_to_first_token_seconds", time.perf_counter() - started)
+            parts.append(delta)
+            yield sse_event("delta", {"content": delta})
+    except Exception as e:
+        logger.error(f"Error streaming chat response: {e}")
+        metrics.increment("chat.stream_errors")
+        yield sse_event("error", {"error": f"Error en el chat: {str(e)}"})
+        return
+    
+    ai_response = "".join(parts).strip()
+    updated_session = await asyncio.to_thread(
+        session_service.add_message_to_session,
+        chat_request.session_id,
+        chat_request.message,
+        ai_response
+    )
+    if updated_session:
+        conversation_compactor.schedule(updated_session, ai_svc)
+    else:
+        logger.warning(f"Chat session {chat_request.session_id} expired before its answer was saved")
+    metrics.observe("chat.stream_duration_seconds", time.perf_counter() - started)
+    
+    yield sse_event("done", {"session_id": chat_request.session_id, "response": ai_response})
+
@@ -1,6 +1,9 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from app.core.config import settings
-from app.dependencies import get_ai_service
+from app.services.ai.health_probe import ai_health_probe
+from app.services.ai.resilience import openai_breaker
+from app.utils.metrics import metrics
 
 router = APIRouter()
 
@@ -17,20 +20,29 @@ async def root():
             "chat": "/chat",
             "sessions": "/sessions",
             "health": "/health",
+            "liveness": "/health/live",
+            "readiness": "/health/ready",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
 
 
 @router.get("/health")
-async def health_check(ai_svc=Depends(get_ai_service)):
-    """Detailed health check"""
-    health_status = {
-        "status": "healthy",
+async def health_check():
+    """Detailed health check, using the cached status of the AI upstream"""
+    probe = ai_health_probe.status
+    
+    return {
+        "status": "healthy" if ai_health_probe.available else "degraded",
         "ai_provider": "openai",
         "services": {
             "excel_processor": "available",
-            "ai_service": "unknown"
+            "ai_service": probe["status"]
+        },
+        "ai_service": {
+            **probe,
+            "circuit": openai_breaker.state
         },
         "configuration": {
             "max_file_size": f"{settings.MAX_FILE_SIZE / (1024*1024):.1f}MB",
@@ -38,16 +50,29 @@ async def health_check(ai_svc=Depends(get_ai_service)):
             "model": settings.OPENAI_MODEL
         }
     }
-    
-    # Test AI service connection
-    try:
-        if ai_svc and ai_svc.test_connection():
-            health_status["services"]["ai_service"] = "available"
-        else:
-            health_status["services"]["ai_service"] = "unavailable"
-            health_status["status"] = "degraded"
-    except Exception:
-        health_status["services"]["ai_service"] = "error"
-        health_status["status"] = "degraded"
-    
-    return health_status 
\ No newline at end of file
+
+
+@router.get("/health/live")
+async def liveness():
+    """Liveness: the worker is up and serving requests"""
+    return {"status": "alive"}
+
+
+@router.get("/health/ready")
+async def readiness():
+    """Readiness: the AI upstream answered the last probe and its circuit is not open"""
+    ready = ai_health_probe.available and openai_breaker.state != "open"
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "ai_service": ai_health_probe.status["status"],
+            "circuit": openai_breaker.state
+        }
+    )
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Worker metrics: executor queue depth, saturation and counters"""
+    return metrics.snapshot()
@@ -1,3 +1,4 @@
+import asyncio
 from fastapi import APIRouter, HTTPException
 from app.models.chat import SessionListResponse
 from app.services.session_service import session_service
@@ -13,7 +14,7 @@ async def list_sessions():
     Retorna una lista de sesiones con información básica.
     """
     try:
-        sessions = session_service.list_sessions()
+        sessions = await asyncio.to_thread(session_service.list_sessions)
         return SessionListResponse(
             sessions=sessions,
             total=len(sessions)
@@ -35,7 +36,7 @@ async def get_session_details(session_id: str):
     Retorna los detalles completos de la sesión.
     """
     try:
-        session = session_service.get_session(session_id)
+        session = await asyncio.to_thread(session_service.get_session, session_id)
         if not session:
             raise HTTPException(
                 status_code=404,
@@ -70,7 +71,7 @@ async def delete_session(session_id: str):
     Retorna confirmación de eliminación.
     """
     try:
-        success = session_service.delete_session(session_id)
+        success = await asyncio.to_thread(session_service.delete_session, session_id)
         if not success:
             raise HTTPException(
                 status_code=404,
@@ -8,10 +8,111 @@ class Settings:
     # OpenAI Configuration
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "")  # Empty by default
+    
+    # Shared async HTTP pool of each worker
+    OPENAI_MAX_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_CONNECTIONS", "500"))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "100"))
+    OPENAI_KEEPALIVE_EXPIRY: float = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+    OPENAI_TIMEOUT: float = float(os.getenv("OPENAI_TIMEOUT", "120"))
+    OPENAI_CONNECT_TIMEOUT: float = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+    OPENAI_HTTP2: bool = os.getenv("OPENAI_HTTP2", "true").lower() == "true"
+    
+    # Retries with jittered exponential backoff, hedging (0 = off) and circuit breaker
+    OPENAI_MAX_RETRIES: int = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+    OPENAI_RETRY_BASE_DELAY: float = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+    OPENAI_RETRY_MAX_DELAY: float = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20"))
+    OPENAI_HEDGE_DELAY: float = float(os.getenv("OPENAI_HEDGE_DELAY", "0"))
+    OPENAI_BREAKER_FAILURES: int = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+    OPENAI_BREAKER_RESET: float = float(os.getenv("OPENAI_BREAKER_RESET", "30"))
+    
+    # Background probe of the upstream behind /health (seconds)
+    OPENAI_HEALTH_INTERVAL: float = float(os.getenv("OPENAI_HEALTH_INTERVAL", "30"))
+    OPENAI_HEALTH_TIMEOUT: float = float(os.getenv("OPENAI_HEALTH_TIMEOUT", "5"))
+    
+    # Model limits and USD prices per million tokens (0 = known values of OPENAI_MODEL)
+    OPENAI_CONTEXT_WINDOW: int = int(os.getenv("OPENAI_CONTEXT_WINDOW", "0"))
+    OPENAI_INPUT_PRICE: float = float(os.getenv("OPENAI_INPUT_PRICE", "0"))
+    OPENAI_OUTPUT_PRICE: float = float(os.getenv("OPENAI_OUTPUT_PRICE", "0"))
+    
+    # Analyses above these limits are rejected before calling OpenAI (cost 0 = no limit)
+    ANALYSIS_MAX_INPUT_TOKENS: int = int(os.getenv("ANALYSIS_MAX_INPUT_TOKENS", "1000000"))
+    ANALYSIS_MAX_COST_USD: float = float(os.getenv("ANALYSIS_MAX_COST_USD", "0"))
+    
+    # Data larger than this (in tokens) is analyzed in chunks and merged (map-reduce)
+    ANALYSIS_CHUNK_TOKENS: int = int(os.getenv("ANALYSIS_CHUNK_TOKENS", "60000"))
+    ANALYSIS_MAP_CONCURRENCY: int = int(os.getenv("ANALYSIS_MAP_CONCURRENCY", "4"))
+    
+    # Deterministic accounting checks run on the parsed sheets before the model
+    ACCOUNTING_CHECKS_ENABLED: bool = os.getenv("ACCOUNTING_CHECKS_ENABLED", "true").lower() == "true"
+    ACCOUNTING_CHECKS: str = os.getenv("ACCOUNTING_CHECKS", "")  # comma-separated names, empty = all
+    ACCOUNTING_CHECK_PLUGINS: str = os.getenv("ACCOUNTING_CHECK_PLUGINS", "")  # modules that register checks
+    ACCOUNTING_CHECK_TOLERANCE: float = float(os.getenv("ACCOUNTING_CHECK_TOLERANCE", "0.01"))
+    ACCOUNTING_CHECK_MAX_FINDINGS: int = int(os.getenv("ACCOUNTING_CHECK_MAX_FINDINGS", "20"))  # per check and sheet
+    # What the model sees: "flagged" (only rows the checks flag, nothing if they settle it) or "all"
+    ACCOUNTING_CHECKS_LLM_SCOPE: str = os.getenv("ACCOUNTING_CHECKS_LLM_SCOPE", "flagged")
+    # Sheets with more data rows are sent as their top anomaly-scored rows plus statistics (0 = off)
+    ANOMALY_MIN_ROWS: int = int(os.getenv("ANOMALY_MIN_ROWS", "1000"))
+    ANOMALY_ROW_BUDGET: int = int(os.getenv("ANOMALY_ROW_BUDGET", "200"))  # rows across all sampled sheets
+    
+    # Cache of analysis completions keyed by model, prompt and parameters (empty dir = memory only)
+    OPENAI_CACHE_TTL: float = float(os.getenv("OPENAI_CACHE_TTL", "3600"))  # 1 hour
+    OPENAI_CACHE_MEMORY_BYTES: int = int(os.getenv("OPENAI_CACHE_MEMORY_BYTES", "33554432"))  # 32MB
+    OPENAI_CACHE_DIR: str = os.getenv("OPENAI_CACHE_DIR", "")
+    OPENAI_CACHE_DISK_BYTES: int = int(os.getenv("OPENAI_CACHE_DISK_BYTES", "268435456"))  # 256MB
+    
+    # Chat history sent to the model: the last N to 2N messages, so the prompt prefix stays stable between jumps
+    CHAT_HISTORY_MESSAGES: int = int(os.getenv("CHAT_HISTORY_MESSAGES", "10"))
+    # Tokens of history after which older turns are folded into a running summary in the background (0 = never)
+    CHAT_HISTORY_TOKENS: int = int(os.getenv("CHAT_HISTORY_TOKENS", "2000"))
+    CHAT_SUMMARY_MAX_TOKENS: int = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "512"))
+    
+    # Chat sessions: "memory" (this worker only), "sqlite" (every worker of the node) or "redis"
+    SESSION_STORE: str = os.getenv("SESSION_STORE", "sqlite")
+    SESSION_TIMEOUT: float = float(os.getenv("SESSION_TIMEOUT", "86400"))  # 24 hours since the last activity
+    # Background task removing expired sessions, in batches so the event loop is never held long
+    SESSION_REAP_INTERVAL: float = float(os.getenv("SESSION_REAP_INTERVAL", "60"))
+    SESSION_REAP_BATCH: int = int(os.getenv("SESSION_REAP_BATCH", "1000"))
+    SESSION_SQLITE_PATH: str = os.getenv("SESSION_SQLITE_PATH", "")  # empty = file in the temp dir
+    SESSION_SQLITE_BUSY_TIMEOUT: float = float(os.getenv("SESSION_SQLITE_BUSY_TIMEOUT", "5"))
+    SESSION_REDIS_URL: str = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+    SESSION_REDIS_PREFIX: str = os.getenv("SESSION_REDIS_PREFIX", "session:")
+    # Per-worker byte budgets (LRU): parsed sessions, and the data of the "memory" store (0 = no limit)
+    SESSION_CACHE_MEMORY_BYTES: int = int(os.getenv("SESSION_CACHE_MEMORY_BYTES", "134217728"))  # 128MB
+    SESSION_STORE_MEMORY_BYTES: int = int(os.getenv("SESSION_STORE_MEMORY_BYTES", "268435456"))  # 256MB
+    # Session data above this size is compressed: "auto" (zstd if installed, else zlib), "zstd", "zlib" or "none";
+    # the analysis and Excel data only when the session is created, not on every chat turn
+    SESSION_COMPRESSION: str = os.getenv("SESSION_COMPRESSION", "auto")
+    SESSION_COMPRESS_MIN_BYTES: int = int(os.getenv("SESSION_COMPRESS_MIN_BYTES", "4096"))
     
     # File Configuration
     MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB
-    ALLOWED_EXTENSIONS: set = {".xlsx", ".xls"}
+    ALLOWED_EXTENSIONS: set = {".xlsx", ".xlsm", ".xlsb", ".xls", ".csv"}
+    
+    # Uploads are read in chunks and spooled to disk above the threshold
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", "1048576"))  # 1MB
+    UPLOAD_SPOOL_THRESHOLD: int = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", "2097152"))  # 2MB
+    UPLOAD_SPOOL_DIR: str = os.getenv("UPLOAD_SPOOL_DIR", "")
+    
+    # Excel ingestion: "dataframe" (pandas), "streaming" (openpyxl read-only) or "auto" (streaming from a size)
+    EXCEL_INGESTION_MODE: str = os.getenv("EXCEL_INGESTION_MODE", "dataframe")
+    EXCEL_STREAMING_MIN_BYTES: int = int(os.getenv("EXCEL_STREAMING_MIN_BYTES", "5242880"))  # 5MB
+    # Reader backend: "auto" (fastest installed for the format) or calamine, openpyxl, xlrd, pyxlsb, csv
+    EXCEL_READER: str = os.getenv("EXCEL_READER", "auto")
+    # Default prompt encoding of the rows: "rows" (ColK: v per cell) or "compact" (header + delimited rows)
+    EXCEL_PROMPT_ENCODING: str = os.getenv("EXCEL_PROMPT_ENCODING", "rows")
+    # Also read formulas (.xlsx, .xlsm) so the checks can recompute SUM, SUBTOTAL and arithmetic locally
+    EXCEL_READ_FORMULAS: bool = os.getenv("EXCEL_READ_FORMULAS", "true").lower() == "true"
+    # Processes used to parse several uploaded files in parallel (0 = sequential)
+    EXCEL_PROCESS_POOL_SIZE: int = int(os.getenv("EXCEL_PROCESS_POOL_SIZE", "0"))
+    # Cache of extracted workbook text keyed by the file hash (empty dir = memory only)
+    EXCEL_CACHE_MEMORY_BYTES: int = int(os.getenv("EXCEL_CACHE_MEMORY_BYTES", "67108864"))  # 64MB
+    EXCEL_CACHE_DIR: str = os.getenv("EXCEL_CACHE_DIR", "")
+    EXCEL_CACHE_DISK_BYTES: int = int(os.getenv("EXCEL_CACHE_DISK_BYTES", "536870912"))  # 512MB
+    
+    # Executor that keeps Excel parsing off the event loop (threads and queued calls)
+    PARSE_EXECUTOR_WORKERS: int = int(os.getenv("PARSE_EXECUTOR_WORKERS", "2"))
+    PARSE_EXECUTOR_QUEUE: int = int(os.getenv("PARSE_EXECUTOR_QUEUE", "8"))
     
     DEFAULT_PROMPT: str = """Actúa como un auditor contable profesional. A continuación, recibirás datos tabulados provenientes de un archivo Excel contable. 
 
@@ -5,25 +5,32 @@ from contextlib import asynccontextmanager
 
 from app.api.endpoints import health, analysis, chat, sessions
 from app.dependencies import get_ai_service
+from app.services.excel_service import warm_up_process_pool, shutdown_process_pool
+from app.services.ai.http_client import close_http_client
+from app.services.ai.health_probe import ai_health_probe
+from app.services.session_service import conversation_compactor, session_reaper
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan events for the application"""
+    # Start the Excel parsing processes once per worker
+    warm_up_process_pool()
+    
+    # Probe OpenAI in the background instead of blocking startup on it
+    ai_health_probe.start(get_ai_service)
+    
+    # Expire chat sessions off the request path
+    session_reaper.start()
+    
     try:
-        # Initialize AI service
-        ai_service = get_ai_service()
-        
-        if ai_service.test_connection():
-            print("✅ Conexión con OpenAI establecida correctamente")
-        else:
-            print("⚠️  Advertencia: No se pudo conectar con OpenAI")
-        
-        yield
-    except Exception as e:
-        print(f"❌ Error al inicializar OpenAI: {e}")
         yield
     finally:
+        await ai_health_probe.stop()
+        await session_reaper.stop()
+        await conversation_compactor.stop()
+        shutdown_process_pool()
+        await close_http_client()
         print("🔄 Cerrando aplicación...")
 
 
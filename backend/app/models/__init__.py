@@ -1,6 +1,6 @@
 # Models exports
 from .base import BaseResponse, ErrorResponse
-from .analysis import Finding, Recommendation, AnalysisResponse, AnalysisRequest
+from .analysis import Finding, Recommendation, AnalysisResponse, AnalysisEstimate, AnalysisRequest
 from .chat import ChatMessage, ChatRequest, ChatResponse, AnalysisSession, SessionListResponse
 
 __all__ = [
@@ -9,6 +9,7 @@ __all__ = [
     "Finding",
     "Recommendation", 
     "AnalysisResponse",
+    "AnalysisEstimate",
     "AnalysisRequest",
     "ChatMessage",
     "ChatRequest",
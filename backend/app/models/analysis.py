@@ -32,6 +32,21 @@ class AnalysisResponse(BaseResponse):
     session_id: Optional[str] = None  # Add session_id for chat context
 
 
+class AnalysisEstimate(BaseModel):
+    """Model for the pre-flight estimate of an analysis"""
+    model: str
+    tokenizer: str  # "tiktoken" (exact) or "heuristic"
+    strategy: str  # "single" or "chunked"
+    calls: int
+    chunk_tokens: List[int]  # input tokens of each analysis call
+    input_tokens: int
+    max_output_tokens: int
+    context_window: int
+    projected_cost_usd: float  # with every call using its max_output_tokens
+    allowed: bool = True
+    reason: Optional[str] = None
+
+
 class AnalysisRequest(BaseModel):
     """Model for analysis request"""
     prompt: Optional[str] = None 
\ No newline at end of file
@@ -1,5 +1,5 @@
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from datetime import datetime
 from .base import BaseResponse
 
@@ -33,6 +33,13 @@ class AnalysisSession(BaseModel):
     created_at: datetime = datetime.now()
     last_activity: datetime = datetime.now()
     file_names: List[str] = []
+    # Running summary of the first summarized_messages messages of the conversation
+    conversation_summary: str = ""
+    summarized_messages: int = 0
+    # ConversationContext maintained by the session service, not serialized
+    _context: Any = PrivateAttr(default=None)
+    # Size of the serialized analysis and Excel data, counted in the parsed-session budget
+    _payload_bytes: int = PrivateAttr(default=0)
 
 
 class SessionListResponse(BaseResponse):
@@ -0,0 +1,110 @@
+import re
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# Lines that open a new file or sheet in the text produced by ExcelProcessor
+FILE_HEADER_PREFIX = "=== ANÁLISIS DE ARCHIVO:"
+SHEET_HEADER_PREFIX = "--- HOJA:"
+DIMENSIONS_PREFIX = "Dimensiones:"
+# Header line of a sheet in the compact encoding
+COLUMNS_PREFIX = "Columnas: "
+# Row lines of both encodings: "Fila N: ..." and "N|..."
+ROW_LINE = re.compile(r"^(?:Fila (\d+):|(\d+)\|)")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def split_excel_data(excel_data: str, max_tokens: int, count: Callable[[str], int] = estimate_tokens) -> List[str]:
+    """Split extracted Excel text into chunks of at most ``max_tokens``, as measured by ``count``.
+    
+    Chunks only break between lines, so rows are never cut, and a chunk that
+    continues a sheet starts again with its file and sheet headers (and, in the
+    compact encoding, its column line) so the model always knows where the rows
+    come from and what each value is.
+    """
+    if count(excel_data) <= max_tokens:
+        return [excel_data]
+    
+    chunks = []
+    current: List[str] = []
+    current_tokens = 0
+    context: List[str] = []  # file header, sheet header and dimensions of the current sheet
+    
+    for line in excel_data.split("\n"):
+        # Headers that must be repeated before this line if a new chunk starts here
+        if line.startswith(FILE_HEADER_PREFIX):
+            prefix = []
+        elif line.startswith(SHEET_HEADER_PREFIX):
+            prefix = context[:1]
+        else:
+            prefix = context
+        
+        line_tokens = count(line)
+        if current and current_tokens + line_tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current = list(prefix)
+            current_tokens = sum(count(header) for header in prefix)
+        
+        current.append(line)
+        current_tokens += line_tokens
+        
+        if line.startswith(FILE_HEADER_PREFIX):
+            context = [line]
+        elif line.startswith(SHEET_HEADER_PREFIX):
+            context = context[:1] + [line]
+        elif line.startswith(DIMENSIONS_PREFIX):
+            context = context[:2] + [line]
+        elif line.startswith(COLUMNS_PREFIX):
+            context = context[:3] + [line]
+    
+    if current:
+        chunks.append("\n".join(current))
+    
+    return chunks
+
+
+def focus_excel_data(
+    excel_data: str,
+    regions: Dict[Tuple[str, str], Set[int]],
+    notes: Optional[Dict[Tuple[str, str], List[str]]] = None
+) -> str:
+    """Keep only some rows of the sheets in ``regions``, keyed by (file, sheet).
+    
+    Headers, dimensions and statistics stay, and each narrowed sheet gets a
+    note saying why its other rows are missing: the lines in ``notes``, or by
+    default that they were verified locally. Sheets not in ``regions`` are
+    kept whole.
+    """
+    if not regions:
+        return excel_data
+    
+    notes = notes or {}
+    lines = []
+    file_name = sheet_name = None
+    keep = None
+    
+    for line in excel_data.split("\n"):
+        if line.startswith(FILE_HEADER_PREFIX):
+            file_name = line[len(FILE_HEADER_PREFIX):].strip().rstrip("=").strip()
+            keep = None
+        elif line.startswith(SHEET_HEADER_PREFIX):
+            sheet_name = line.strip()[len(SHEET_HEADER_PREFIX):].rstrip("-").strip()
+            keep = regions.get((file_name, sheet_name))
+            if keep is not None:
+                lines.append(line)
+                lines.extend(notes.get((file_name, sheet_name)) or [
+                    "Nota: solo se incluyen las filas señaladas por la verificación local; el resto de la hoja se verificó sin errores."
+                    if keep else
+                    "Nota: la verificación local revisó todas las filas de esta hoja sin encontrar errores; se omiten."
+                ])
+                continue
+        elif keep is not None:
+            match = ROW_LINE.match(line)
+            if match and int(match.group(1) or match.group(2)) not in keep:
+                continue
+        
+        lines.append(line)
+    
+    return "\n".join(lines)
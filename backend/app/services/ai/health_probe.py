@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+from fastapi import HTTPException
+from app.core.config import settings
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AIHealthProbe:
+    """Background task that keeps a cached status of the AI upstream.
+    
+    Every ``interval`` seconds it makes a cheap call (no tokens billed) and
+    stores the outcome, so health endpoints only read a dict.
+    """
+    
+    def __init__(self, interval: float, timeout: float):
+        self.interval = interval
+        self.timeout = timeout
+        self.status: Dict[str, Any] = {
+            "status": "unknown",
+            "checked_at": None,
+            "latency_ms": None,
+            "error": None
+        }
+        self._get_service: Optional[Callable] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def available(self) -> bool:
+        return self.status["status"] == "available"
+    
+    async def check(self) -> Dict[str, Any]:
+        """Probe the upstream once and cache the result"""
+        started = time.perf_counter()
+        error = None
+        try:
+            ai_service = self._get_service()
+            await asyncio.wait_for(ai_service.ping_async(), self.timeout)
+            status = "available"
+        except HTTPException as e:
+            status, error = "error", str(e.detail)
+        except asyncio.TimeoutError:
+            status, error = "unavailable", f"Sin respuesta en {self.timeout:.0f}s"
+        except Exception as e:
+            status, error = "unavailable", str(e)
+        
+        latency = time.perf_counter() - started
+        metrics.observe("openai.health_probe_seconds", latency)
+        if status != self.status["status"]:
+            logger.info(f"AI upstream status changed to {status}" + (f": {error}" if error else ""))
+        
+        self.status = {
+            "status": status,
+            "checked_at": datetime.now(timezone.utc).isoformat(),
+            "latency_ms": round(latency * 1000, 1),
+            "error": error
+        }
+        return self.status
+    
+    def start(self, get_service: Callable):
+        """Start probing in the background; the first probe runs right away"""
+        self._get_service = get_service
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+
+# Cached status of OpenAI, refreshed by the worker's background task
+ai_health_probe = AIHealthProbe(
+    interval=settings.OPENAI_HEALTH_INTERVAL,
+    timeout=settings.OPENAI_HEALTH_TIMEOUT
+)
@@ -0,0 +1,47 @@
+import importlib.util
+import logging
+from typing import Optional
+import httpx
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# One connection pool per worker process, shared by every async OpenAI call
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the worker's shared async HTTP client, creating it on first use"""
+    global _http_client
+    
+    if _http_client is None or _http_client.is_closed:
+        http2 = settings.OPENAI_HTTP2 and http2_available()
+        _http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(settings.OPENAI_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT)
+        )
+        logger.info(
+            f"Shared OpenAI HTTP pool created (http2={http2}, "
+            f"max_connections={settings.OPENAI_MAX_CONNECTIONS})"
+        )
+    
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared pool on shutdown"""
+    global _http_client
+    
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -1,16 +1,52 @@
 import openai
+import asyncio
 import json
 import re
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator, Union
 from fastapi import HTTPException
 from app.core.config import settings
-from app.models.analysis import AnalysisResponse, Finding, Recommendation
+from app.models.analysis import AnalysisEstimate, AnalysisResponse, Finding, Recommendation
+from app.services.ai.chunking import COLUMNS_PREFIX, split_excel_data
+from app.services.ai.http_client import close_http_client, get_http_client
+from app.services.ai.resilience import CircuitOpenError, call_with_retries, call_with_retries_async
+from app.services.ai.stream_parser import IncrementalAnalysisParser
+from app.services.ai.tokens import count_tokens, model_spec, projected_cost, tokenizer_name
+from app.services.conversation import ConversationContext
+from app.utils.cache import TieredCache
+from app.utils.metrics import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Output limits of the analysis and summary calls
+ANALYSIS_MAX_TOKENS = 2048
+SUMMARY_MAX_TOKENS = 512
+# Typical length of the summary of one chunk, used to estimate the summary call
+PART_SUMMARY_TOKENS = 150
+
+# System instructions of the chat, followed by the analysis context
+CHAT_INSTRUCTIONS = """Eres un experto contador y auditor especializado en análisis de cuadres contables.
+
+INSTRUCCIONES:
+- Responde a la pregunta del usuario basándote en el análisis previo
+- Sé específico y usa la información del análisis
+- Si la pregunta no está relacionada con el análisis, redirige al usuario
+- Mantén un tono profesional pero amigable
+- Proporciona explicaciones claras y detalladas
+
+CONTEXTO DEL ANÁLISIS PREVIO:"""
+
+# Completions of successful analyses, shared by every OpenAIService of the process
+response_cache = TieredCache(
+    "openai",
+    memory_bytes=settings.OPENAI_CACHE_MEMORY_BYTES,
+    disk_dir=settings.OPENAI_CACHE_DIR,
+    disk_bytes=settings.OPENAI_CACHE_DISK_BYTES,
+    ttl=settings.OPENAI_CACHE_TTL
+)
+
 
 class OpenAIService:
     def __init__(self):
@@ -18,8 +54,47 @@ class OpenAIService:
             raise ValueError("OPENAI_API_KEY no está configurada en las variables de entorno")
         
         # Initialize client
-        self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+        # Retries are handled by the resilience layer, not by the SDK
+        self.client = openai.OpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL or None,
+            max_retries=0
+        )
         self.model = settings.OPENAI_MODEL
+        self._async_client: Optional[openai.AsyncOpenAI] = None
+        self._async_http_client = None
+    
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        """Async client bound to the worker's shared connection pool"""
+        http_client = get_http_client()
+        if self._async_client is None or self._async_http_client is not http_client:
+            self._async_http_client = http_client
+            self._async_client = openai.AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                base_url=settings.OPENAI_BASE_URL or None,
+                http_client=http_client,
+                max_retries=0
+            )
+        return self._async_client
+    
+    def _complete(self, request: Dict[str, Any]):
+        """Chat completion with retries and the circuit breaker"""
+        return call_with_retries(lambda: self.client.chat.completions.create(**request))
+    
+    async def _complete_async(self, request: Dict[str, Any], stream: bool = False):
+        """Async chat completion with retries, hedging and the circuit breaker.
+        
+        Streams are retried only until they start and are never hedged.
+        """
+        if stream:
+            return await call_with_retries_async(
+                lambda: self.async_client.chat.completions.create(**request, stream=True)
+            )
+        return await call_with_retries_async(
+            lambda: self.async_client.chat.completions.create(**request),
+            hedge=True
+        )
     
     def test_connection(self) -> bool:
         """Test the OpenAI API connection"""
@@ -38,74 +113,389 @@ class OpenAIService:
             logger.error(f"Error testing OpenAI connection: {e}")
             return False
     
-    def analyze_accounting_data(self, excel_data: str, custom_prompt: str = "") -> AnalysisResponse:
-        """Send accounting data to OpenAI for analysis"""
-        try:
-            # Create the analysis prompt
-            prompt = self._create_analysis_prompt(excel_data, custom_prompt or "")
-            
-            # Make the API call
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.2,
-                max_tokens=2048
+    async def ping_async(self):
+        """Cheap upstream check that bills no tokens: retrieve the configured model.
+        
+        Raises on failure.
+        """
+        await self.async_client.models.retrieve(self.model)
+    
+    def analyze_accounting_data(self, excel_data: str, custom_prompt: str = "", use_cache: bool = True) -> AnalysisResponse:
+        """Blocking wrapper around analyze_accounting_data_async, for scripts and benchmarks.
+        
+        Runs its own event loop, so it cannot be called from async code, and
+        closes the shared connection pool when done.
+        """
+        async def analyze() -> AnalysisResponse:
+            try:
+                return await self.analyze_accounting_data_async(excel_data, custom_prompt, use_cache)
+            finally:
+                await close_http_client()
+        
+        return asyncio.run(analyze())
+    
+    async def analyze_accounting_data_async(self, excel_data: str, custom_prompt: str = "", use_cache: bool = True) -> AnalysisResponse:
+        """Send accounting data to OpenAI for analysis, using the shared connection pool.
+        
+        Data larger than ANALYSIS_CHUNK_TOKENS is split into chunks that are
+        analyzed concurrently and merged into a single response.
+        
+        Completions are cached by model, prompt and parameters; with
+        use_cache=False the cache is not read, but still refreshed.
+        metadata["cache_hits"] counts the calls served from the cache.
+        """
+        chunks = self._split(excel_data, custom_prompt or "")
+        if len(chunks) > 1:
+            return await self._analyze_in_chunks_async(chunks, custom_prompt or "", use_cache)
+        
+        return await self._analyze_chunk_async(excel_data, custom_prompt or "", use_cache=use_cache)
+    
+    def estimate_analysis(self, excel_data: str, custom_prompt: str = "") -> AnalysisEstimate:
+        """Token count, projected cost and chunking plan of an analysis, without calling OpenAI"""
+        custom_prompt = custom_prompt or ""
+        chunks = self._split(excel_data, custom_prompt)
+        total = len(chunks)
+        
+        chunk_tokens = [
+            count_tokens(self._create_analysis_prompt(chunk, custom_prompt, (i + 1, total) if total > 1 else None), self.model)
+            for i, chunk in enumerate(chunks)
+        ]
+        input_tokens = sum(chunk_tokens)
+        output_tokens = ANALYSIS_MAX_TOKENS * total
+        calls = total
+        
+        if total > 1:
+            # Reduce step over the chunk summaries
+            summary_prompt = self._summary_request([])["messages"][0]["content"]
+            input_tokens += count_tokens(summary_prompt, self.model) + PART_SUMMARY_TOKENS * total
+            output_tokens += SUMMARY_MAX_TOKENS
+            calls += 1
+        
+        cost = projected_cost(input_tokens, output_tokens, self.model)
+        reason = None
+        if input_tokens > settings.ANALYSIS_MAX_INPUT_TOKENS:
+            reason = (
+                f"Los archivos requieren unos {input_tokens} tokens, más que el límite de "
+                f"{settings.ANALYSIS_MAX_INPUT_TOKENS} por análisis. Reduzca el tamaño o la cantidad de archivos."
             )
+        elif settings.ANALYSIS_MAX_COST_USD and cost > settings.ANALYSIS_MAX_COST_USD:
+            reason = (
+                f"El costo estimado del análisis (USD {cost:.4f}) supera el máximo permitido "
+                f"de USD {settings.ANALYSIS_MAX_COST_USD:.4f}."
+            )
+        
+        return AnalysisEstimate(
+            model=self.model,
+            tokenizer=tokenizer_name(),
+            strategy="chunked" if total > 1 else "single",
+            calls=calls,
+            chunk_tokens=chunk_tokens,
+            input_tokens=input_tokens,
+            max_output_tokens=output_tokens,
+            context_window=model_spec(self.model)["context_window"],
+            projected_cost_usd=round(cost, 6),
+            allowed=reason is None,
+            reason=reason
+        )
+    
+    def _split(self, excel_data: str, custom_prompt: str) -> List[str]:
+        """Chunks of the data that each fit the model's context window along with the prompt.
+        
+        The budget is ANALYSIS_CHUNK_TOKENS, lowered when the model's window is
+        smaller, so data too large for one call switches to map-reduce. Tokens
+        are counted as in estimate_analysis, exactly when tiktoken is installed.
+        """
+        def count(text: str) -> int:
+            return count_tokens(text, self.model)
+        
+        overhead = count(self._create_analysis_prompt("", custom_prompt, (1, 1)))
+        fits = model_spec(self.model)["context_window"] - overhead - ANALYSIS_MAX_TOKENS
+        return split_excel_data(excel_data, max(1, min(settings.ANALYSIS_CHUNK_TOKENS, fits)), count)
+    
+    async def stream_accounting_analysis(self, excel_data: str, custom_prompt: str = "", use_cache: bool = True) -> AsyncIterator[Tuple[str, Any]]:
+        """Analyze data, yielding every finding and recommendation as soon as the model completes it.
+        
+        Yields ("finding", Finding) and ("recommendation", Recommendation) pairs,
+        without duplicates across chunks, and finally ("result", AnalysisResponse)
+        with the complete analysis.
+        """
+        chunks = self._split(excel_data, custom_prompt or "")
+        total = len(chunks)
+        semaphore = asyncio.Semaphore(settings.ANALYSIS_MAP_CONCURRENCY)
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def analyze(index: int, chunk: str) -> AnalysisResponse:
+            part = (index + 1, total) if total > 1 else None
+            async with semaphore:
+                return await self._stream_chunk(chunk, custom_prompt or "", part, queue, use_cache)
+        
+        async def analyze_all() -> List[AnalysisResponse]:
+            try:
+                return await asyncio.gather(*(analyze(i, chunk) for i, chunk in enumerate(chunks)))
+            finally:
+                await queue.put(None)
+        
+        runner = asyncio.ensure_future(analyze_all())
+        try:
+            seen = set()
+            while (item := await queue.get()) is not None:
+                kind, value = item
+                key = (kind, _finding_key(value) if kind == "finding" else _recommendation_key(value))
+                if key not in seen:
+                    seen.add(key)
+                    yield item
             
-            # Extract the response content
-            message_content = response.choices[0].message.content
-            if message_content is None:
-                raise ValueError("OpenAI response content is None")
-            response_content = message_content.strip()
-            
-            # Parse the response
-            analysis_result = self._parse_openai_response(response_content)
-            
-            logger.info(f"Analysis completed successfully with {len(analysis_result.findings)} findings")
+            partial_results = list(await runner)
+        finally:
+            runner.cancel()
+        
+        if total == 1:
+            yield "result", partial_results[0]
+            return
+        
+        summaries = [result.summary for result in partial_results if result.success]
+        summary = await self._summarize_partial_results_async(summaries, use_cache) if summaries else ""
+        yield "result", self._merge_partial_results(partial_results, summary)
+    
+    async def _stream_chunk(self, excel_data: str, custom_prompt: str, part: Optional[Tuple[int, int]], queue: asyncio.Queue, use_cache: bool = True) -> AnalysisResponse:
+        """Stream one analysis call, pushing completed items to the queue"""
+        request = self._analysis_request(excel_data, custom_prompt, part)
+        cache_key = _completion_cache_key(request)
+        cached = response_cache.get(cache_key) if use_cache else None
+        if cached is not None:
+            analysis_result = self._analysis_from_cache(cached)
+            for finding in analysis_result.findings:
+                await queue.put(("finding", finding))
+            for recommendation in analysis_result.recommendations:
+                await queue.put(("recommendation", recommendation))
             return analysis_result
+        
+        parser = IncrementalAnalysisParser()
+        try:
+            stream = await self._complete_async(request, stream=True)
+            async for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                for kind, data in parser.feed(chunk.choices[0].delta.content):
+                    if kind == "finding":
+                        await queue.put((kind, _finding_from_dict(data)))
+                    else:
+                        await queue.put((kind, _recommendation_from_dict(data)))
             
-        except openai.APIError as e:
-            logger.error(f"OpenAI API error: {e}")
-            return AnalysisResponse(
-                success=False,
-                error=f"Error en la API de OpenAI: {str(e)}",
-                findings=[],
-                recommendations=[],
-                summary="Error al procesar el análisis",
-                metadata={
-                    "provider": "openai",
-                    "model": self.model,
-                    "error": str(e)
-                }
-            )
+            analysis_result = self._analysis_from_content(parser.buffer.strip(), cache_key)
+            logger.info(f"Streamed analysis completed with {len(analysis_result.findings)} findings")
+            return analysis_result
+        except Exception as e:
+            return self._analysis_error(e)
+    
+    async def _analyze_chunk_async(self, excel_data: str, custom_prompt: str = "", part: Optional[Tuple[int, int]] = None, use_cache: bool = True) -> AnalysisResponse:
+        """Analyze a block of data with a single async OpenAI call"""
+        request = self._analysis_request(excel_data, custom_prompt, part)
+        cache_key = _completion_cache_key(request)
+        cached = response_cache.get(cache_key) if use_cache else None
+        if cached is not None:
+            return self._analysis_from_cache(cached)
+        
+        try:
+            response = await self._complete_async(request)
+            return self._analysis_from_completion(response, cache_key)
         except Exception as e:
+            return self._analysis_error(e)
+    
+    def _analysis_request(self, excel_data: str, custom_prompt: str, part: Optional[Tuple[int, int]]) -> Dict[str, Any]:
+        """Arguments of the chat completion that analyzes a block of data"""
+        # Create the analysis prompt
+        prompt = self._create_analysis_prompt(excel_data, custom_prompt or "", part)
+        
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.2,
+            "max_tokens": ANALYSIS_MAX_TOKENS
+        }
+    
+    def _analysis_from_completion(self, response, cache_key: Optional[str] = None) -> AnalysisResponse:
+        """Parse an analysis completion"""
+        # Extract the response content
+        message_content = response.choices[0].message.content
+        if message_content is None:
+            raise ValueError("OpenAI response content is None")
+        
+        analysis_result = self._analysis_from_content(message_content.strip(), cache_key)
+        
+        logger.info(f"Analysis completed successfully with {len(analysis_result.findings)} findings")
+        return analysis_result
+    
+    def _analysis_from_content(self, response_content: str, cache_key: Optional[str] = None) -> AnalysisResponse:
+        """Parse the text of a fresh completion, caching it if it is a valid analysis"""
+        analysis_result = self._parse_openai_response(response_content)
+        metrics.increment("openai.cache_misses")
+        
+        if analysis_result.success and cache_key is not None:
+            response_cache.put(cache_key, response_content)
+        
+        analysis_result.metadata["cache_hits"] = 0
+        return analysis_result
+    
+    def _analysis_from_cache(self, response_content: str) -> AnalysisResponse:
+        """Parse a cached completion"""
+        analysis_result = self._parse_openai_response(response_content)
+        metrics.increment("openai.cache_hits")
+        
+        analysis_result.metadata["cache_hits"] = 1
+        logger.info("Analysis served from the response cache")
+        return analysis_result
+    
+    def _analysis_error(self, e: Exception) -> AnalysisResponse:
+        """Failed analysis response for an exception raised by the call"""
+        if isinstance(e, CircuitOpenError):
+            logger.warning(f"OpenAI circuit open: {e}")
+            error = str(e)
+        elif isinstance(e, openai.APIError):
+            logger.error(f"OpenAI API error: {e}")
+            error = f"Error en la API de OpenAI: {str(e)}"
+        else:
             logger.error(f"Error analyzing data with OpenAI: {e}")
-            return AnalysisResponse(
-                success=False,
-                error=f"Error al procesar la respuesta de OpenAI: {str(e)}",
-                findings=[],
-                recommendations=[],
-                summary="Error al procesar el análisis",
-                metadata={
-                    "provider": "openai",
-                    "model": self.model,
-                    "error": str(e)
+            error = f"Error al procesar la respuesta de OpenAI: {str(e)}"
+        
+        return AnalysisResponse(
+            success=False,
+            error=error,
+            findings=[],
+            recommendations=[],
+            summary="Error al procesar el análisis",
+            metadata={
+                "provider": "openai",
+                "model": self.model,
+                "error": str(e)
+            }
+        )
+    
+    async def _analyze_in_chunks_async(self, chunks: List[str], custom_prompt: str, use_cache: bool = True) -> AnalysisResponse:
+        """Async map-reduce analysis, with at most ANALYSIS_MAP_CONCURRENCY chunks in flight"""
+        total = len(chunks)
+        logger.info(f"Analyzing data in {total} chunks")
+        semaphore = asyncio.Semaphore(settings.ANALYSIS_MAP_CONCURRENCY)
+        
+        async def analyze(index: int, chunk: str) -> AnalysisResponse:
+            async with semaphore:
+                return await self._analyze_chunk_async(chunk, custom_prompt, (index + 1, total), use_cache)
+        
+        partial_results = await asyncio.gather(*(analyze(i, chunk) for i, chunk in enumerate(chunks)))
+        
+        summaries = [result.summary for result in partial_results if result.success]
+        summary = await self._summarize_partial_results_async(summaries, use_cache) if summaries else ""
+        return self._merge_partial_results(list(partial_results), summary)
+    
+    def _merge_partial_results(self, partial_results: List[AnalysisResponse], summary: str) -> AnalysisResponse:
+        """Merge the chunk analyses into one response, removing repeated findings"""
+        succeeded = [result for result in partial_results if result.success]
+        if not succeeded:
+            return partial_results[0]
+        
+        findings = []
+        seen_findings = set()
+        for result in succeeded:
+            for finding in result.findings:
+                key = _finding_key(finding)
+                if key not in seen_findings:
+                    seen_findings.add(key)
+                    findings.append(finding)
+        
+        recommendations = []
+        seen_recommendations = set()
+        for result in succeeded:
+            for recommendation in result.recommendations:
+                key = _recommendation_key(recommendation)
+                if key not in seen_recommendations:
+                    seen_recommendations.add(key)
+                    recommendations.append(recommendation)
+        
+        failed = [result.error for result in partial_results if not result.success]
+        
+        return AnalysisResponse(
+            success=True,
+            findings=findings,
+            recommendations=recommendations,
+            summary=summary,
+            metadata={
+                "provider": "openai",
+                "model": self.model,
+                "total_findings": len(findings),
+                "critical_issues": sum(1 for finding in findings if finding.severity == "high"),
+                "chunks": len(partial_results),
+                "failed_chunks": len(failed),
+                "cache_hits": sum((result.metadata or {}).get("cache_hits", 0) for result in partial_results),
+                **({"chunk_errors": failed} if failed else {})
+            }
+        )
+    
+    async def _summarize_partial_results_async(self, summaries: List[str], use_cache: bool = True) -> str:
+        """Reduce step: combine the summaries of every chunk into one executive summary"""
+        request = self._summary_request(summaries)
+        cache_key = _completion_cache_key(request)
+        cached = response_cache.get(cache_key) if use_cache else None
+        if cached is not None:
+            return cached
+        
+        try:
+            response = await self._complete_async(request)
+            message_content = response.choices[0].message.content
+            if message_content:
+                response_cache.put(cache_key, message_content.strip())
+                return message_content.strip()
+        except Exception as e:
+            logger.error(f"Error summarizing chunk analyses: {e}")
+        
+        return _join_summaries(summaries)
+    
+    def _summary_request(self, summaries: List[str]) -> Dict[str, Any]:
+        """Arguments of the chat completion that merges the chunk summaries"""
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": (
+                        "Eres un auditor contable. Los siguientes son resúmenes del análisis de "
+                        "distintas partes de los mismos archivos. Redacta un único resumen ejecutivo "
+                        "breve que los integre, sin repetir información. Responde solo con el resumen.\n\n"
+                        f"{_join_summaries(summaries)}"
+                    )
                 }
-            )
+            ],
+            "temperature": 0.2,
+            "max_tokens": SUMMARY_MAX_TOKENS
+        }
     
-    def _create_analysis_prompt(self, excel_data: str, custom_prompt: str = "") -> str:
+    def _create_analysis_prompt(self, excel_data: str, custom_prompt: str = "", part: Optional[Tuple[int, int]] = None) -> str:
         """Create the analysis prompt for OpenAI"""
         
+        part_note = ""
+        if part is not None:
+            part_note = (
+                f"NOTA: Estos datos son la parte {part[0]} de {part[1]} de los archivos. "
+                "Analiza solo esta parte e indica hoja y fila en cada hallazgo."
+            )
+        
+        format_note = ""
+        if COLUMNS_PREFIX in excel_data:
+            format_note = (
+                f"FORMATO: En las hojas con línea '{COLUMNS_PREFIX.strip()}', cada línea siguiente es una fila "
+                "con sus valores separados por '|' en ese orden; el primer valor es el número de fila."
+            )
+        
         base_prompt = f"""
         Eres un experto contador y auditor especializado en análisis de cuadres contables.
         
         Analiza los siguientes datos de Excel y detecta posibles errores en cuadres contables:
         
+        {format_note}
         DATOS DEL ARCHIVO:
         {excel_data}
         
@@ -117,6 +507,7 @@ class OpenAIService:
         5. Verifica que los debitos y créditos cuadren
         
         {'INSTRUCCIONES ADICIONALES: ' + custom_prompt if custom_prompt else ''}
+        {part_note}
         
         IMPORTANTE: Responde ÚNICAMENTE con un JSON válido en el siguiente formato:
         {{
@@ -170,27 +561,8 @@ class OpenAIService:
             data = json.loads(response_text)
             
             # Convert to structured response
-            findings = []
-            for finding_data in data.get("findings", []):
-                finding = Finding(
-                    type=finding_data.get("type", "info"),
-                    title=finding_data.get("title", ""),
-                    description=finding_data.get("description", ""),
-                    location=finding_data.get("location", ""),
-                    severity=finding_data.get("severity", "medium"),
-                    suggested_fix=finding_data.get("suggested_fix", "")
-                )
-                findings.append(finding)
-            
-            recommendations = []
-            for rec_data in data.get("recommendations", []):
-                recommendation = Recommendation(
-                    title=rec_data.get("title", ""),
-                    description=rec_data.get("description", ""),
-                    priority=rec_data.get("priority", "medium"),
-                    category=rec_data.get("category", "general")
-                )
-                recommendations.append(recommendation)
+            findings = [_finding_from_dict(finding_data) for finding_data in data.get("findings", [])]
+            recommendations = [_recommendation_from_dict(rec_data) for rec_data in data.get("recommendations", [])]
             
             return AnalysisResponse(
                 success=data.get("success", True),
@@ -237,52 +609,153 @@ class OpenAIService:
                 }
             )
     
-    def chat_with_context(self, conversation_context: str, user_message: str) -> str:
+    def chat_with_context(self, conversation_context: Union[ConversationContext, str], user_message: str) -> str:
         """Chat with user using the analysis context"""
         try:
-            # Create the chat prompt
-            prompt = f"""
-            Eres un experto contador y auditor especializado en análisis de cuadres contables.
-            
-            CONTEXTO DEL ANÁLISIS PREVIO:
-            {conversation_context}
-            
-            INSTRUCCIONES:
-            - Responde a la pregunta del usuario basándote en el análisis previo
-            - Sé específico y usa la información del análisis
-            - Si la pregunta no está relacionada con el análisis, redirige al usuario
-            - Mantén un tono profesional pero amigable
-            - Proporciona explicaciones claras y detalladas
-            
-            PREGUNTA DEL USUARIO:
-            {user_message}
-            
-            RESPUESTA:
-            """
-            
-            # Make the API call
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.3,
-                max_tokens=1024
-            )
-            
-            # Extract the response content
-            message_content = response.choices[0].message.content
-            if message_content is None:
-                raise ValueError("OpenAI response content is None")
-            
-            return message_content.strip()
-            
-        except openai.APIError as e:
+            response = self._complete(self._chat_request(conversation_context, user_message))
+            return self._chat_text(response)
+        except Exception as e:
+            return self._chat_error(e)
+    
+    async def chat_with_context_async(self, conversation_context: Union[ConversationContext, str], user_message: str) -> str:
+        """Async version of chat_with_context, using the shared connection pool"""
+        try:
+            response = await self._complete_async(self._chat_request(conversation_context, user_message))
+            return self._chat_text(response)
+        except Exception as e:
+            return self._chat_error(e)
+    
+    async def stream_chat_with_context(self, conversation_context: Union[ConversationContext, str], user_message: str) -> AsyncIterator[str]:
+        """Stream the chat answer as text deltas while the model generates it.
+        
+        Unlike chat_with_context, errors are raised so the caller can report them.
+        """
+        stream = await self._complete_async(self._chat_request(conversation_context, user_message), stream=True)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    def _chat_request(self, conversation_context: Union[ConversationContext, str], user_message: str) -> Dict[str, Any]:
+        """Arguments of the chat completion that answers the user.
+        
+        The instructions and the analysis go first and the history after them,
+        so consecutive turns share a byte-identical prefix the provider can cache.
+        A plain text context is sent as the analysis, without history.
+        """
+        if isinstance(conversation_context, str):
+            messages = [
+                {"role": "system", "content": f"{CHAT_INSTRUCTIONS}\n{conversation_context}"},
+                {"role": "user", "content": user_message}
+            ]
+        else:
+            messages = conversation_context.messages(CHAT_INSTRUCTIONS, user_message)
+        
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.3,
+            "max_tokens": 1024
+        }
+    
+    async def summarize_conversation_async(self, summary: str, messages: List[Dict[str, str]]) -> str:
+        """Fold ``messages`` into the running ``summary`` of a chat.
+        
+        Runs in the background, so errors are raised for the caller to log.
+        """
+        response = await self._complete_async(self._conversation_summary_request(summary, messages))
+        return self._chat_text(response)
+    
+    def _conversation_summary_request(self, summary: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Arguments of the chat completion that extends the summary of a conversation"""
+        turns = "\n".join(
+            f"{'Usuario' if message['role'] == 'user' else 'Asistente'}: {message['content']}"
+            for message in messages
+        )
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": (
+                        "Eres un auditor contable. Actualiza el resumen de una conversación sobre un "
+                        "análisis contable con los nuevos mensajes. Conserva las cifras, cuentas, "
+                        "decisiones y preguntas pendientes; omite saludos y repeticiones. "
+                        "Responde solo con el resumen actualizado.\n\n"
+                        f"RESUMEN ACTUAL:\n{summary or 'Sin resumen todavía.'}\n\n"
+                        f"NUEVOS MENSAJES:\n{turns}"
+                    )
+                }
+            ],
+            "temperature": 0.2,
+            "max_tokens": settings.CHAT_SUMMARY_MAX_TOKENS
+        }
+    
+    def _chat_text(self, response) -> str:
+        """Extract the answer of a chat completion"""
+        message_content = response.choices[0].message.content
+        if message_content is None:
+            raise ValueError("OpenAI response content is None")
+        
+        return message_content.strip()
+    
+    def _chat_error(self, e: Exception) -> str:
+        """Message shown to the user when the chat call fails"""
+        if isinstance(e, CircuitOpenError):
+            logger.warning(f"OpenAI circuit open in chat: {e}")
+            return str(e)
+        
+        if isinstance(e, openai.APIError):
             logger.error(f"OpenAI API error in chat: {e}")
             return f"Lo siento, ocurrió un error al procesar tu pregunta: {str(e)}"
-        except Exception as e:
-            logger.error(f"Error in chat with OpenAI: {e}")
-            return f"Lo siento, ocurrió un error inesperado: {str(e)}"
+        
+        logger.error(f"Error in chat with OpenAI: {e}")
+        return f"Lo siento, ocurrió un error inesperado: {str(e)}"
+
+
+def _completion_cache_key(request: Dict[str, Any]) -> str:
+    """Cache key of a completion: model, full prompt, temperature and max_tokens"""
+    return TieredCache.hash_key(
+        request["model"],
+        json.dumps(request["messages"], ensure_ascii=False, sort_keys=True),
+        request["temperature"],
+        request["max_tokens"]
+    )
+
+
+def _normalize(text: str) -> str:
+    """Normalize a text for duplicate detection"""
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+def _finding_key(finding: Finding) -> tuple:
+    return (finding.type, _normalize(finding.title), _normalize(finding.location))
+
+
+def _recommendation_key(recommendation: Recommendation) -> str:
+    return _normalize(recommendation.title)
+
+
+def _finding_from_dict(finding_data: Dict[str, Any]) -> Finding:
+    """Build a Finding from the model's JSON, filling in missing fields"""
+    return Finding(
+        type=finding_data.get("type", "info"),
+        title=finding_data.get("title", ""),
+        description=finding_data.get("description", ""),
+        location=finding_data.get("location", ""),
+        severity=finding_data.get("severity", "medium"),
+        suggested_fix=finding_data.get("suggested_fix", "")
+    )
+
+
+def _recommendation_from_dict(rec_data: Dict[str, Any]) -> Recommendation:
+    """Build a Recommendation from the model's JSON, filling in missing fields"""
+    return Recommendation(
+        title=rec_data.get("title", ""),
+        description=rec_data.get("description", ""),
+        priority=rec_data.get("priority", "medium"),
+        category=rec_data.get("category", "general")
+    )
+
+
+def _join_summaries(summaries: List[str]) -> str:
+    return "\n".join(f"- Parte {i}: {summary}" for i, summary in enumerate(summaries, start=1))
@@ -0,0 +1,228 @@
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+import openai
+from app.core.config import settings
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while its circuit is open"""
+
+
+class CircuitBreaker:
+    """Fail fast while an upstream keeps failing.
+    
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls are rejected for ``recovery_timeout`` seconds. Then a single trial
+    call is let through (half-open): its success closes the circuit and its
+    failure opens it again.
+    """
+    
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._trial_started: Optional[float] = None
+        self._lock = threading.Lock()
+        
+        metrics.register_gauge(f"circuit.{name}", self.stats)
+    
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not reach the upstream"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open":
+                if now - self.opened_at < self.recovery_timeout:
+                    self._reject()
+                self.state = "half_open"
+                self._trial_started = None
+            
+            if self.state == "half_open":
+                # A trial that never reported back (e.g. cancelled) expires after the timeout
+                if self._trial_started is not None and now - self._trial_started < self.recovery_timeout:
+                    self._reject()
+                self._trial_started = now
+    
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"Circuit {self.name} closed")
+            self.state = "closed"
+            self.failures = 0
+            self._trial_started = None
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_started = None
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                logger.warning(f"Circuit {self.name} opened after {self.failures} consecutive failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.opens += 1
+    
+    def _reject(self):
+        self.rejected += 1
+        raise CircuitOpenError(
+            "El servicio de OpenAI no está disponible temporalmente. Intente de nuevo en unos minutos."
+        )
+    
+    def stats(self) -> Dict[str, Any]:
+        """Current state and counters of the circuit"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "opens": self.opens,
+                "rejected": self.rejected
+            }
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an OpenAI error is transient and the call can be repeated"""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Delay requested by the upstream in its retry-after-ms or Retry-After header"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                # HTTP-date form
+                retry_at = email.utils.parsedate_to_datetime(value)
+                return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def backoff_delay(attempt: int, error: Exception) -> float:
+    """Seconds to wait before retry number ``attempt`` (0-based).
+    
+    Honors Retry-After when present; otherwise exponential backoff with full
+    jitter. Both are capped at OPENAI_RETRY_MAX_DELAY.
+    """
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        return min(retry_after, settings.OPENAI_RETRY_MAX_DELAY)
+    
+    ceiling = min(settings.OPENAI_RETRY_MAX_DELAY, settings.OPENAI_RETRY_BASE_DELAY * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+def call_with_retries(call: Callable[[], Any], breaker: Optional[CircuitBreaker] = None) -> Any:
+    """Run a blocking OpenAI call with retries and the circuit breaker"""
+    breaker = breaker or openai_breaker
+    for attempt in range(settings.OPENAI_MAX_RETRIES + 1):
+        breaker.before_call()
+        try:
+            result = call()
+        except Exception as e:
+            if not _record_error(breaker, e) or attempt == settings.OPENAI_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt, e)
+            logger.warning(f"OpenAI call failed ({e}), retrying in {delay:.2f}s")
+            metrics.increment("openai.retries")
+            time.sleep(delay)
+            continue
+        
+        breaker.record_success()
+        return result
+
+
+async def call_with_retries_async(call: Callable[[], Awaitable[Any]], hedge: bool = False, breaker: Optional[CircuitBreaker] = None) -> Any:
+    """Async version of call_with_retries.
+    
+    With hedge=True and OPENAI_HEDGE_DELAY set, an attempt that has not
+    finished after that delay is raced against a duplicate request.
+    """
+    breaker = breaker or openai_breaker
+    hedge_delay = settings.OPENAI_HEDGE_DELAY if hedge else 0
+    for attempt in range(settings.OPENAI_MAX_RETRIES + 1):
+        breaker.before_call()
+        try:
+            result = await (_hedged(call, hedge_delay) if hedge_delay > 0 else call())
+        except Exception as e:
+            if not _record_error(breaker, e) or attempt == settings.OPENAI_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt, e)
+            logger.warning(f"OpenAI call failed ({e}), retrying in {delay:.2f}s")
+            metrics.increment("openai.retries")
+            await asyncio.sleep(delay)
+            continue
+        
+        breaker.record_success()
+        return result
+
+
+async def _hedged(call: Callable[[], Awaitable[Any]], hedge_delay: float) -> Any:
+    """Race the call against a duplicate started after hedge_delay; first success wins"""
+    first = asyncio.ensure_future(call())
+    done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+    if done:
+        return first.result()
+    
+    metrics.increment("openai.hedged_requests")
+    pending = {first, asyncio.ensure_future(call())}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        metrics.increment("openai.hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _record_error(breaker: CircuitBreaker, error: Exception) -> bool:
+    """Report a failed call to the breaker; returns whether it can be retried"""
+    if is_retryable(error):
+        breaker.record_failure()
+        return True
+    
+    # The upstream answered (e.g. a 400), so it is healthy
+    breaker.record_success()
+    return False
+
+
+# Circuit breaker shared by every OpenAI call of the worker
+openai_breaker = CircuitBreaker(
+    "openai",
+    failure_threshold=settings.OPENAI_BREAKER_FAILURES,
+    recovery_timeout=settings.OPENAI_BREAKER_RESET
+)
@@ -0,0 +1,85 @@
+import json
+import logging
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Top-level arrays of the analysis JSON whose items are emitted as they complete
+STREAMED_ARRAYS = {
+    "findings": "finding",
+    "recommendations": "recommendation",
+}
+
+
+class IncrementalAnalysisParser:
+    """Incremental scanner for the analysis JSON produced by the model.
+    
+    Text is fed as it arrives; every object inside the top-level "findings"
+    and "recommendations" arrays is returned as soon as its closing brace is
+    seen, without waiting for the rest of the document. Text before the first
+    "{" (such as a markdown fence) is ignored.
+    """
+    
+    def __init__(self):
+        self.buffer = ""
+        self._position = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._last_key = ""
+        self._array_kind = None
+        self._item_start = None
+    
+    def feed(self, text: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """Add text and return the (kind, item) pairs completed by it"""
+        self.buffer += text
+        completed = []
+        
+        for index in range(self._position, len(self.buffer)):
+            char = self.buffer[index]
+            
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        # At the root, the last string before "[" is that array's key
+                        self._last_key = self.buffer[self._string_start + 1:index]
+                continue
+            
+            if not self._stack and char != "{":
+                continue
+            
+            if char == '"':
+                self._in_string = True
+                self._string_start = index
+            elif char in "{[":
+                if char == "[" and len(self._stack) == 1:
+                    self._array_kind = STREAMED_ARRAYS.get(self._last_key)
+                elif char == "{" and len(self._stack) == 2 and self._array_kind:
+                    self._item_start = index
+                self._stack.append(char)
+            elif char in "}]" and self._stack:
+                self._stack.pop()
+                if char == "}" and len(self._stack) == 2 and self._item_start is not None:
+                    item = self._load_item(self.buffer[self._item_start:index + 1])
+                    if item is not None:
+                        completed.append((self._array_kind, item))
+                    self._item_start = None
+                elif char == "]" and len(self._stack) == 1:
+                    self._array_kind = None
+        
+        self._position = len(self.buffer)
+        return completed
+    
+    def _load_item(self, text: str):
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping malformed streamed item: {e}")
+            return None
+        return item if isinstance(item, dict) else None
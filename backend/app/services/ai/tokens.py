@@ -0,0 +1,63 @@
+import importlib.util
+from functools import lru_cache
+from typing import Any, Dict
+from app.core.config import settings
+from app.services.ai.chunking import estimate_tokens
+
+# Context window and USD price per million tokens of known models (matched by prefix)
+MODEL_SPECS: Dict[str, Dict[str, float]] = {
+    "gpt-4o-mini": {"context_window": 128000, "input_price": 0.15, "output_price": 0.60},
+    "gpt-4o": {"context_window": 128000, "input_price": 2.50, "output_price": 10.00},
+    "gpt-4.1-nano": {"context_window": 1047576, "input_price": 0.10, "output_price": 0.40},
+    "gpt-4.1-mini": {"context_window": 1047576, "input_price": 0.40, "output_price": 1.60},
+    "gpt-4.1": {"context_window": 1047576, "input_price": 2.00, "output_price": 8.00},
+    "gpt-4-turbo": {"context_window": 128000, "input_price": 10.00, "output_price": 30.00},
+    "gpt-3.5-turbo": {"context_window": 16385, "input_price": 0.50, "output_price": 1.50},
+}
+DEFAULT_MODEL_SPEC = MODEL_SPECS["gpt-4o-mini"]
+
+
+def tiktoken_available() -> bool:
+    """Exact counts need the optional tiktoken package (pip install tiktoken)"""
+    return importlib.util.find_spec("tiktoken") is not None
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def tokenizer_name() -> str:
+    return "tiktoken" if tiktoken_available() else "heuristic"
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Tokens of a text for the model: exact with tiktoken, estimated otherwise"""
+    if tiktoken_available():
+        return len(_encoding(model).encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def model_spec(model: str) -> Dict[str, Any]:
+    """Context window and prices of a model, with the overrides from the settings"""
+    spec = DEFAULT_MODEL_SPEC
+    for name in sorted(MODEL_SPECS, key=len, reverse=True):
+        if model.startswith(name):
+            spec = MODEL_SPECS[name]
+            break
+    
+    return {
+        "context_window": settings.OPENAI_CONTEXT_WINDOW or spec["context_window"],
+        "input_price": settings.OPENAI_INPUT_PRICE or spec["input_price"],
+        "output_price": settings.OPENAI_OUTPUT_PRICE or spec["output_price"]
+    }
+
+
+def projected_cost(input_tokens: int, output_tokens: int, model: str) -> float:
+    """Cost in USD of the given token counts"""
+    spec = model_spec(model)
+    return (input_tokens * spec["input_price"] + output_tokens * spec["output_price"]) / 1_000_000
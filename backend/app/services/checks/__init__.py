@@ -0,0 +1,11 @@
+from .base import Check, SheetData, register_check
+from .engine import CheckEngine, CheckReport, check_engine
+
+__all__ = [
+    "Check",
+    "SheetData",
+    "register_check",
+    "CheckEngine",
+    "CheckReport",
+    "check_engine"
+]
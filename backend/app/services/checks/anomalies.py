@@ -0,0 +1,91 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from .base import BALANCE_PATTERN, ENTRY_PATTERN, SheetData
+
+# Expected share of each leading digit 1-9 under Benford's law
+BENFORD = np.log10(1 + 1 / np.arange(1, 10))
+# Columns with fewer leading digits than this are not compared with Benford
+BENFORD_MIN_VALUES = 100
+# Nigrini's first-digit MAD thresholds and their verdicts
+BENFORD_CONFORMITY = ((0.006, "conformidad alta"), (0.012, "aceptable"), (0.015, "marginal"))
+
+Z_SCORE_UNIT = 3.0  # a value this many standard deviations away adds 1 to the row score
+IQR_FENCE = 1.5
+
+
+def score_rows(sheet: SheetData) -> Tuple[np.ndarray, List[str]]:
+    """Anomaly score of every data row, and aggregate statistics of the sheet.
+    
+    A row scores for its largest z-score, for each value outside the
+    interquartile fences, for round amounts, and for leading digits that its
+    column has more often than Benford's law predicts. Identifiers and
+    running balances are left out.
+    """
+    skipped = {sheet.column(ENTRY_PATTERN), sheet.column(BALANCE_PATTERN)}
+    positions = [
+        position for position in range(sheet.values.shape[1])
+        if position not in skipped and np.count_nonzero(~np.isnan(sheet.values[~sheet.total_rows, position])) >= 2
+    ]
+    scores = np.zeros(len(sheet.rows))
+    statistics = []
+    if not positions:
+        return scores, statistics
+    
+    values = np.where(sheet.total_rows[:, None], np.nan, sheet.values[:, positions])
+    present = ~np.isnan(values)
+    
+    mean = np.nanmean(values, axis=0)
+    std = np.nanstd(values, axis=0)
+    z = np.abs(values - mean) / np.where(std > 0, std, np.inf)
+    scores += np.minimum(np.nan_to_num(z).max(axis=1) / Z_SCORE_UNIT, 3.0)
+    
+    q1, q3 = np.nanpercentile(values, [25, 75], axis=0)
+    spread = IQR_FENCE * (q3 - q1)
+    outliers = present & ((values < q1 - spread) | (values > q3 + spread))
+    scores += outliers.sum(axis=1)
+    
+    magnitude = np.abs(np.nan_to_num(values))
+    thousands = (magnitude >= 1000) & (np.mod(magnitude, 1000) == 0)
+    hundreds = (magnitude >= 100) & (np.mod(magnitude, 100) == 0) & ~thousands
+    scores += 0.5 * thousands.sum(axis=1) + 0.25 * hundreds.sum(axis=1)
+    
+    digits = _leading_digits(magnitude)
+    for j, position in enumerate(positions):
+        column_digits = digits[:, j]
+        counted = column_digits[column_digits > 0]
+        benford_note = ""
+        if len(counted) >= BENFORD_MIN_VALUES:
+            observed = np.bincount(counted, minlength=10)[1:] / len(counted)
+            mad = float(np.mean(np.abs(observed - BENFORD)))
+            excess = np.concatenate(([0.0], np.maximum(observed - BENFORD, 0) / BENFORD))
+            scores += excess[column_digits]
+            benford_note = f", Benford MAD={mad:.4f} ({_conformity(mad)})"
+        
+        column = values[:, j][present[:, j]]
+        statistics.append(
+            f"  {sheet.columns[position]}: n={len(column)}, Suma={column.sum():.2f}, Promedio={mean[j]:.2f}, "
+            f"Desv={std[j]:.2f}, Min={column.min():.2f}, Max={column.max():.2f}, "
+            f"Atípicos={int(outliers[:, j].sum())}, Redondos={int(thousands[:, j].sum() + hundreds[:, j].sum())}"
+            f"{benford_note}"
+        )
+    
+    return scores, statistics
+
+
+def _leading_digits(magnitude: np.ndarray) -> np.ndarray:
+    """First significant digit of each value, 0 for zeros and values below 10"""
+    digits = np.zeros(magnitude.shape, dtype=np.int64)
+    counted = magnitude >= 10
+    exponent = np.floor(np.log10(magnitude[counted]))
+    # Clip to 1-9 against rounding at exact powers of ten
+    digits[counted] = np.clip((magnitude[counted] / 10 ** exponent).astype(np.int64), 1, 9)
+    return digits
+
+
+def _conformity(mad: float) -> str:
+    for limit, verdict in BENFORD_CONFORMITY:
+        if mad <= limit:
+            return verdict
+    return "no conforme"
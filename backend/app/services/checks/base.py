@@ -0,0 +1,159 @@
+import importlib
+import logging
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Type
+
+import numpy as np
+import pandas as pd
+
+from app.models.analysis import Finding
+from app.services.excel_service import FormulaSheet, detect_header
+
+logger = logging.getLogger(__name__)
+
+# Column roles, matched against the header without accents and in lower case
+DEBIT_PATTERN = r"\b(debe|debitos?|cargos?|debits?)\b"
+CREDIT_PATTERN = r"\b(haber|creditos?|abonos?|credits?)\b"
+BALANCE_PATTERN = r"\b(saldos?|balance)\b"
+ENTRY_PATTERN = r"\b(asientos?|comprobantes?|polizas?|entry|voucher)\b"
+
+# Rows whose text cells start like this state a total of the rows above them
+TOTAL_LABEL = re.compile(r"^(sub)?total(es)?\b|^sumas?\b|^gran total\b")
+GRAND_TOTAL_LABEL = re.compile(r"^(total general|gran total|total final)\b")
+
+# Registered check classes by name
+CHECKS: Dict[str, Type["Check"]] = {}
+
+
+class SheetData:
+    """A parsed sheet as the checks see it.
+    
+    ``values`` holds every cell as a float (NaN for empty and non-numeric
+    cells), ``rows`` the sheet row number of each data row and ``columns``
+    the header names, or ColK when the sheet has no header row. ``formulas``
+    holds the sheet's formulas when the workbook was read for them. Checks add
+    rows the model should see besides the ones in their findings to ``flagged``.
+    """
+    
+    def __init__(self, file: str, name: str, frame: pd.DataFrame, formulas: Optional[FormulaSheet] = None):
+        self.file = file
+        self.name = name
+        self.formulas = formulas
+        
+        names = detect_header(frame)
+        self.header_row: Optional[int] = int(frame.index[0]) + 1 if names is not None else None
+        body = frame.iloc[1:] if names is not None else frame
+        
+        self.columns: List[str] = names or [f"Col{position+1}" for position in range(frame.shape[1])]
+        self.keys: List[str] = [_normalize(column) for column in self.columns]
+        self.frame = body
+        self.rows: np.ndarray = (body.index + 1).to_numpy()
+        self.values: np.ndarray = np.column_stack(
+            [_numeric(series) for _, series in body.items()]
+        ) if body.shape[1] else np.empty((len(body), 0))
+        self.labels: List[np.ndarray] = [_labels(series) for _, series in body.items()]
+        self.total_rows: np.ndarray = self._match_labels(TOTAL_LABEL)
+        self.grand_total_rows: np.ndarray = self._match_labels(GRAND_TOTAL_LABEL)
+        self.flagged: Set[int] = set()
+    
+    def column(self, pattern: str) -> Optional[int]:
+        """Position of the first column whose header matches ``pattern``"""
+        for position, key in enumerate(self.keys):
+            if re.search(pattern, key):
+                return position
+        return None
+    
+    def flag(self, rows: Iterable[int]):
+        """Send these sheet rows to the model along with the findings"""
+        self.flagged.update(int(row) for row in rows)
+    
+    def location(self, row: Optional[int] = None, cell: Optional[str] = None) -> str:
+        """Human-readable location of a cell, a row, or the whole sheet"""
+        if cell is not None:
+            return f"{self.file}, hoja {self.name}, celda {cell}"
+        if row is None:
+            return f"{self.file}, hoja {self.name}"
+        return f"{self.file}, hoja {self.name}, fila {row}"
+    
+    def finding(self, row: Optional[int], cell: Optional[str] = None, **fields) -> Finding:
+        """A Finding located at a sheet row or cell (row None for the whole sheet)"""
+        return Finding(
+            location=self.location(row, cell),
+            sheet=self.name,
+            row=int(row) if row is not None else None,
+            **fields
+        )
+    
+    def _match_labels(self, pattern: re.Pattern) -> np.ndarray:
+        """Rows with a text cell matching ``pattern``"""
+        matches = np.zeros(len(self.rows), dtype=bool)
+        for labels in self.labels:
+            matches |= np.array([bool(pattern.match(label)) for label in labels], dtype=bool)
+        return matches
+
+
+class Check:
+    """Base class of the deterministic accounting checks.
+    
+    Subclasses set ``name`` and implement ``applies`` and ``run``, returning
+    findings located at sheet rows. A ``conclusive`` check verifies a whole
+    sheet: when every sheet passes one, the model is not needed. Register
+    subclasses with ``@register_check``; modules listed in
+    ACCOUNTING_CHECK_PLUGINS are imported so their checks register too.
+    """
+    
+    name = ""
+    conclusive = False
+    
+    def __init__(self, tolerance: float, max_findings: int):
+        self.tolerance = tolerance
+        self.max_findings = max_findings
+    
+    def applies(self, sheet: SheetData) -> bool:
+        """Whether the sheet has what the check needs"""
+        return True
+    
+    def run(self, sheet: SheetData) -> List[Finding]:
+        raise NotImplementedError
+
+
+def register_check(cls: Type[Check]) -> Type[Check]:
+    """Class decorator adding a check to the registry"""
+    if not cls.name:
+        raise ValueError(f"{cls.__name__} must set a name")
+    CHECKS[cls.name] = cls
+    return cls
+
+
+def load_plugins(modules: str):
+    """Import the comma-separated modules so their checks register"""
+    for module in filter(None, (name.strip() for name in modules.split(","))):
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            logger.error(f"Error loading accounting check plugin {module}: {e}")
+
+
+def _normalize(text: str) -> str:
+    """Lower-case text without accents, for matching headers and labels"""
+    text = unicodedata.normalize("NFKD", str(text))
+    return "".join(char for char in text if not unicodedata.combining(char)).strip().lower()
+
+
+def _numeric(series: pd.Series) -> np.ndarray:
+    """Float values of a column, NaN for empty, text, boolean and date cells"""
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+        return np.full(len(series), np.nan)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=np.float64)
+    
+    numbers = series.map(lambda value: value if isinstance(value, (int, float, np.number)) and not isinstance(value, bool) else np.nan)
+    return numbers.to_numpy(dtype=np.float64)
+
+
+def _labels(series: pd.Series) -> np.ndarray:
+    """Normalized text of the text cells of a column, '' elsewhere"""
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+        return np.full(len(series), "", dtype=object)
+    return np.array([_normalize(value) if isinstance(value, str) else "" for value in series.tolist()], dtype=object)
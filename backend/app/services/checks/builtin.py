@@ -0,0 +1,251 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from app.models.analysis import Finding
+from .base import (
+    BALANCE_PATTERN, CREDIT_PATTERN, DEBIT_PATTERN, ENTRY_PATTERN,
+    Check, SheetData, register_check
+)
+
+
+@register_check
+class JournalBalanceCheck(Check):
+    """Debits equal credits in every entry, or in the whole sheet without an entry column"""
+    
+    name = "journal_balance"
+    conclusive = True
+    
+    def applies(self, sheet: SheetData) -> bool:
+        return (
+            sheet.column(DEBIT_PATTERN) is not None
+            and sheet.column(CREDIT_PATTERN) is not None
+            and sheet.column(BALANCE_PATTERN) is None
+        )
+    
+    def run(self, sheet: SheetData) -> List[Finding]:
+        debit = sheet.values[:, sheet.column(DEBIT_PATTERN)]
+        credit = sheet.values[:, sheet.column(CREDIT_PATTERN)]
+        lines = ~sheet.total_rows & (~np.isnan(debit) | ~np.isnan(credit))
+        if not lines.any():
+            return []
+        
+        entry = sheet.column(ENTRY_PATTERN)
+        if entry is None:
+            debits, credits = np.nansum(debit[lines]), np.nansum(credit[lines])
+            if abs(debits - credits) <= self.tolerance:
+                return []
+            return [sheet.finding(
+                None,
+                type="error",
+                title="Debe y haber no cuadran",
+                description=(
+                    f"La hoja suma {debits:,.2f} en el debe y {credits:,.2f} en el haber "
+                    f"(diferencia {debits - credits:,.2f})."
+                ),
+                severity="high",
+                suggested_fix="Buscar el movimiento que falta o el importe mal registrado hasta que el debe y el haber coincidan."
+            )]
+        
+        # Entry numbers are often written on the first line only; lines before
+        # the first number have none and are checked together as one group
+        ids = pd.Series(sheet.frame.iloc[:, entry].to_numpy(), dtype=object).where(lines).ffill()
+        lines_frame = pd.DataFrame({
+            "entry": ids[lines].to_numpy(),
+            "debit": np.nan_to_num(debit[lines]),
+            "credit": np.nan_to_num(credit[lines]),
+            "row": sheet.rows[lines]
+        })
+        entries = lines_frame.groupby("entry", sort=False, dropna=False).agg(
+            debit=("debit", "sum"), credit=("credit", "sum"), row=("row", "min")
+        )
+        unbalanced = entries[(entries["debit"] - entries["credit"]).abs() > self.tolerance].head(self.max_findings)
+        flagged = lines_frame["entry"].isin(unbalanced.index.dropna())
+        if unbalanced.index.isna().any():
+            flagged |= lines_frame["entry"].isna()
+        sheet.flag(lines_frame["row"][flagged])
+        
+        findings = []
+        for entry_id, debits, credits, row in unbalanced.itertuples():
+            if pd.isna(entry_id):
+                title, subject = "Líneas sin número de asiento descuadradas", "Las líneas sin número de asiento suman"
+            else:
+                title, subject = f"Asiento {entry_id} descuadrado", f"El asiento {entry_id} suma"
+            findings.append(sheet.finding(
+                row,
+                type="error",
+                title=title,
+                description=(
+                    f"{subject} {debits:,.2f} en el debe y {credits:,.2f} en el haber "
+                    f"(diferencia {debits - credits:,.2f})."
+                ),
+                severity="high",
+                suggested_fix="Revisar los importes del asiento hasta que el debe y el haber coincidan."
+            ))
+        return findings
+
+
+@register_check
+class RunningBalanceCheck(Check):
+    """Each balance equals the previous one plus the debit minus the credit (or the reverse)"""
+    
+    name = "running_balance"
+    conclusive = True
+    
+    def applies(self, sheet: SheetData) -> bool:
+        return (
+            sheet.column(DEBIT_PATTERN) is not None
+            and sheet.column(CREDIT_PATTERN) is not None
+            and sheet.column(BALANCE_PATTERN) is not None
+        )
+    
+    def run(self, sheet: SheetData) -> List[Finding]:
+        balance_column = sheet.column(BALANCE_PATTERN)
+        lines = ~sheet.total_rows & ~np.isnan(sheet.values[:, balance_column])
+        if lines.sum() < 2:
+            return []
+        
+        balance = sheet.values[lines, balance_column]
+        movement = (
+            np.nan_to_num(sheet.values[lines, sheet.column(DEBIT_PATTERN)])
+            - np.nan_to_num(sheet.values[lines, sheet.column(CREDIT_PATTERN)])
+        )[1:]
+        rows = sheet.rows[lines][1:]
+        
+        # Asset accounts add debits, liability and bank statements add credits: keep the better fit
+        expected = balance[:-1] + movement
+        reverse = balance[:-1] - movement
+        if np.sum(np.abs(balance[1:] - reverse) > self.tolerance) < np.sum(np.abs(balance[1:] - expected) > self.tolerance):
+            expected = reverse
+        
+        wrong = np.flatnonzero(np.abs(balance[1:] - expected) > self.tolerance)[:self.max_findings]
+        name = sheet.columns[balance_column]
+        return [
+            sheet.finding(
+                rows[i],
+                type="error",
+                title="Saldo mal calculado",
+                description=(
+                    f"La columna {name} muestra {balance[i + 1]:,.2f}, pero el saldo anterior "
+                    f"y el movimiento de la fila dan {expected[i]:,.2f}."
+                ),
+                severity="high",
+                suggested_fix="Recalcular el saldo a partir de la fila anterior."
+            )
+            for i in wrong.tolist()
+        ]
+
+
+@register_check
+class StatedTotalsCheck(Check):
+    """Total rows match the sum of the rows above them"""
+    
+    name = "stated_totals"
+    
+    def applies(self, sheet: SheetData) -> bool:
+        return bool(sheet.total_rows.any())
+    
+    def run(self, sheet: SheetData) -> List[Finding]:
+        totals = sheet.total_rows
+        # A running balance or an entry number is not summed
+        skipped = {sheet.column(BALANCE_PATTERN), sheet.column(ENTRY_PATTERN)}
+        columns = [position for position in range(sheet.values.shape[1]) if position not in skipped]
+        if not columns:
+            return []
+        
+        # Rows belong to the block closed by the next total row
+        block = np.cumsum(totals) - totals
+        data = pd.DataFrame(np.where(totals[:, None], np.nan, sheet.values[:, columns]))
+        sums = data.groupby(block).sum(min_count=1)
+        cumulative = sums.fillna(0).cumsum().where(sums.notna().cumsum() > 0)
+        
+        total_positions = np.flatnonzero(totals)
+        expected = sums.reindex(block[total_positions]).to_numpy(copy=True)
+        grand = sheet.grand_total_rows[total_positions]
+        expected[grand] = cumulative.reindex(block[total_positions][grand]).to_numpy()
+        stated = sheet.values[total_positions][:, columns]
+        
+        wrong = np.argwhere(~np.isnan(stated) & ~np.isnan(expected) & (np.abs(stated - expected) > self.tolerance))
+        findings = []
+        for i, j in wrong[:self.max_findings].tolist():
+            row = sheet.rows[total_positions[i]]
+            findings.append(sheet.finding(
+                row,
+                type="error",
+                title="Total no cuadra",
+                description=(
+                    f"El total de la columna {sheet.columns[columns[j]]} es {stated[i, j]:,.2f}, pero las filas "
+                    f"que totaliza suman {expected[i, j]:,.2f} (diferencia {stated[i, j] - expected[i, j]:,.2f})."
+                ),
+                severity="high",
+                suggested_fix="Corregir la fórmula o el rango del total, o el importe que falta en las filas."
+            ))
+        return findings
+
+
+@register_check
+class DuplicateRowsCheck(Check):
+    """Rows with amounts that repeat another row exactly"""
+    
+    name = "duplicate_rows"
+    
+    def applies(self, sheet: SheetData) -> bool:
+        return len(sheet.rows) > 1
+    
+    def run(self, sheet: SheetData) -> List[Finding]:
+        candidates = ~sheet.total_rows & np.any(~np.isnan(sheet.values), axis=1)
+        frame = sheet.frame[candidates]
+        rows = sheet.rows[candidates]
+        repeated = frame.duplicated(keep="first").to_numpy()
+        if not repeated.any():
+            return []
+        
+        groups = frame.groupby(list(frame.columns), dropna=False, sort=False).ngroup().to_numpy()
+        first_row = pd.Series(rows).groupby(groups).transform("min").to_numpy()
+        
+        positions = np.flatnonzero(repeated)[:self.max_findings]
+        sheet.flag(first_row[positions])
+        return [
+            sheet.finding(
+                rows[i],
+                type="warning",
+                title="Fila duplicada",
+                description=f"La fila {rows[i]} repite exactamente la fila {first_row[i]}.",
+                severity="medium",
+                suggested_fix="Verificar si el registro se ingresó dos veces y eliminar el duplicado."
+            )
+            for i in positions.tolist()
+        ]
+
+
+@register_check
+class NegativeAmountsCheck(Check):
+    """Debit and credit amounts are recorded as positive numbers"""
+    
+    name = "negative_amounts"
+    
+    def applies(self, sheet: SheetData) -> bool:
+        return sheet.column(DEBIT_PATTERN) is not None or sheet.column(CREDIT_PATTERN) is not None
+    
+    def run(self, sheet: SheetData) -> List[Finding]:
+        findings = []
+        for pattern in (DEBIT_PATTERN, CREDIT_PATTERN):
+            column = sheet.column(pattern)
+            if column is None:
+                continue
+            
+            values = sheet.values[:, column]
+            negative = np.flatnonzero(~sheet.total_rows & (values < -self.tolerance))[:self.max_findings]
+            findings.extend(
+                sheet.finding(
+                    sheet.rows[i],
+                    type="warning",
+                    title="Importe negativo",
+                    description=f"La columna {sheet.columns[column]} tiene {values[i]:,.2f} en la fila {sheet.rows[i]}.",
+                    severity="medium",
+                    suggested_fix="Registrar el importe en positivo en la columna contraria (debe o haber)."
+                )
+                for i in negative.tolist()
+            )
+        return findings
@@ -0,0 +1,301 @@
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.models.analysis import AnalysisResponse, Finding
+from app.services.ai.chunking import focus_excel_data
+from app.services.excel_service import ExcelProcessor, FileSource, FormulaSheet, extraction_cache, content_digest
+from app.services.readers import SheetResult
+from app.utils.cache import TieredCache
+from app.utils.metrics import metrics
+from .anomalies import score_rows
+from .base import CHECKS, Check, SheetData, load_plugins
+from . import builtin, formulas  # noqa: F401  (register the built-in checks)
+
+logger = logging.getLogger(__name__)
+
+# Bump when the checks change so cached reports are not reused
+CHECKS_CACHE_VERSION = 4
+
+# Local findings listed in the prompt so the model does not repeat them
+PROMPT_FINDINGS = 20
+
+
+class SheetCheck(BaseModel):
+    """What the checks covered and flagged in one sheet"""
+    file: str
+    sheet: str
+    checks: List[str] = []
+    covered: bool = False  # a conclusive check verified the whole sheet
+    whole_sheet: bool = False  # a finding concerns the sheet rather than some rows
+    rows: List[int] = []  # flagged sheet rows, header row included
+    header_row: Optional[int] = None
+    data_rows: int = 0
+    sample: List[int] = []  # rows of a large sheet by decreasing anomaly score
+    sample_scores: List[float] = []
+    statistics: List[str] = []  # aggregate statistics of a sampled sheet
+    error: Optional[str] = None
+
+
+class CheckReport(BaseModel):
+    """Findings of the deterministic checks and the regions they flag"""
+    findings: List[Finding] = []
+    sheets: List[SheetCheck] = []
+    complete: bool = True  # every file could be read by the checks
+    
+    @property
+    def settled(self) -> bool:
+        """Every sheet was verified by a conclusive check and nothing was found"""
+        return (
+            self.complete
+            and bool(self.sheets)
+            and not self.findings
+            and all(sheet.covered for sheet in self.sheets)
+        )
+    
+    @property
+    def model_needed(self) -> bool:
+        """Whether the model still has to look at the data"""
+        return not (self.settled and settings.ACCOUNTING_CHECKS_LLM_SCOPE == "flagged")
+    
+    def regions(self) -> Dict[Tuple[str, str], Set[int]]:
+        """Rows to keep of each verified sheet; sheets left out are sent whole"""
+        regions = {}
+        for sheet in self.sheets:
+            if sheet.covered and not sheet.whole_sheet:
+                regions[(sheet.file, sheet.sheet)] = set(sheet.rows)
+        return regions
+    
+    def model_view(self, excel_data: str) -> str:
+        """The part of the extracted data the model still needs to see.
+        
+        Verified sheets are narrowed to their flagged rows. Large sheets the
+        model must see are narrowed to their most anomalous rows, the
+        ANOMALY_ROW_BUDGET best across all of them, plus the rows the checks
+        flagged and their aggregate statistics.
+        """
+        if settings.ACCOUNTING_CHECKS_LLM_SCOPE != "flagged":
+            return excel_data
+        
+        regions = self.regions()
+        notes = {}
+        sampled = [sheet for sheet in self.sheets if sheet.sample and (sheet.file, sheet.sheet) not in regions]
+        
+        candidates = sorted(
+            ((score, index, row) for index, sheet in enumerate(sampled) for row, score in zip(sheet.sample, sheet.sample_scores)),
+            key=lambda candidate: -candidate[0]
+        )[:settings.ANOMALY_ROW_BUDGET]
+        for index, sheet in enumerate(sampled):
+            picked = {row for _, chosen, row in candidates if chosen == index}
+            regions[(sheet.file, sheet.sheet)] = picked | set(sheet.rows) | ({sheet.header_row} if sheet.header_row else set())
+            notes[(sheet.file, sheet.sheet)] = [
+                f"Nota: hoja de {sheet.data_rows} filas; solo se incluyen las {len(picked)} filas con mayor puntuación "
+                "de anomalía (z-score, dígitos de Benford, importes redondos y valores atípicos) y las señaladas por la "
+                "verificación local.",
+                "Estadísticas agregadas de todas las filas:",
+                *sheet.statistics
+            ]
+        
+        return focus_excel_data(excel_data, regions, notes)
+    
+    def model_prompt(self, custom_prompt: str) -> str:
+        """The custom prompt followed by what the checks already found"""
+        if not self.findings:
+            return custom_prompt
+        
+        lines = [
+            "VERIFICACIÓN LOCAL: los siguientes hallazgos ya se detectaron con cálculos exactos. "
+            "No los repitas; explica sus posibles causas y busca otros problemas:"
+        ]
+        lines.extend(f"- {finding.location}: {finding.description}" for finding in self.findings[:PROMPT_FINDINGS])
+        if len(self.findings) > PROMPT_FINDINGS:
+            lines.append(f"- ... y {len(self.findings) - PROMPT_FINDINGS} hallazgos más")
+        return "\n".join(filter(None, [custom_prompt, *lines]))
+    
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "local_findings": len(self.findings),
+            "sheets_checked": len(self.sheets),
+            "sheets_verified": sum(1 for sheet in self.sheets if sheet.covered),
+            "sheets_sampled": sum(1 for sheet in self.sheets if sheet.sample),
+            "settled_locally": self.settled
+        }
+    
+    def merge_into(self, analysis_result: AnalysisResponse) -> AnalysisResponse:
+        """Put the local findings first in the model's response"""
+        findings = [finding.model_copy() for finding in self.findings] + list(analysis_result.findings)
+        metadata = {**(analysis_result.metadata or {}), **self.metadata()}
+        metadata["total_findings"] = len(findings)
+        metadata["critical_issues"] = sum(1 for finding in findings if finding.severity == "high")
+        return analysis_result.model_copy(update={"findings": findings, "metadata": metadata})
+    
+    def local_response(self) -> AnalysisResponse:
+        """Response of an analysis settled without calling the model"""
+        return AnalysisResponse(
+            success=True,
+            summary=(
+                f"La verificación local revisó {len(self.sheets)} hoja(s) (cuadre de debe y haber, saldos, "
+                "totales, duplicados e importes negativos) y no encontró errores; no fue necesario consultar el modelo."
+            ),
+            findings=[],
+            recommendations=[],
+            metadata={
+                "provider": "local",
+                "total_findings": 0,
+                "critical_issues": 0,
+                **self.metadata()
+            }
+        )
+
+
+class CheckEngine:
+    """Runs the registered checks over the sheets of the uploaded workbooks"""
+    
+    def __init__(self, names: Optional[List[str]] = None, tolerance: Optional[float] = None, max_findings: Optional[int] = None):
+        load_plugins(settings.ACCOUNTING_CHECK_PLUGINS)
+        if names is None:
+            names = [name.strip() for name in settings.ACCOUNTING_CHECKS.split(",") if name.strip()] or list(CHECKS)
+        
+        unknown = [name for name in names if name not in CHECKS]
+        if unknown:
+            logger.warning(f"Unknown accounting checks ignored: {', '.join(unknown)}")
+        
+        self.tolerance = settings.ACCOUNTING_CHECK_TOLERANCE if tolerance is None else tolerance
+        self.max_findings = settings.ACCOUNTING_CHECK_MAX_FINDINGS if max_findings is None else max_findings
+        self.sample_min_rows = settings.ANOMALY_MIN_ROWS
+        self.row_budget = settings.ANOMALY_ROW_BUDGET
+        self.checks: List[Check] = [
+            CHECKS[name](self.tolerance, self.max_findings) for name in names if name in CHECKS
+        ]
+        self.read_formulas = settings.EXCEL_READ_FORMULAS and any(check.name == "formulas" for check in self.checks)
+        self.processor = ExcelProcessor()
+    
+    def combine(self, reports: List[Optional[CheckReport]]) -> CheckReport:
+        """One report of the files' reports in upload order; None is a file the checks did not run on"""
+        report = CheckReport()
+        for file_report in reports:
+            if file_report is None:
+                report.complete = False
+                continue
+            report.findings.extend(file_report.findings)
+            report.sheets.extend(file_report.sheets)
+            report.complete = report.complete and file_report.complete
+        return report
+    
+    def check_file(self, file_content: FileSource, filename: str, sheets: Optional[List[SheetResult]] = None) -> CheckReport:
+        """Check one workbook, reusing the report of earlier uploads of the same bytes.
+        
+        ``sheets`` are the file's sheets as ``read_sheets`` yields them, when the
+        extraction has already read them; otherwise ``compute`` reads the file.
+        """
+        key = self.report_key(file_content, filename)
+        report = self.lookup(key)
+        if report is None:
+            report = self.compute(file_content, filename, sheets)
+            self.store(key, report)
+        return report
+    
+    def report_key(self, file_content: FileSource, filename: str) -> str:
+        """Cache key of a file's report under the current checks and settings"""
+        return TieredCache.hash_key(
+            "checks", CHECKS_CACHE_VERSION, filename, self.tolerance, self.max_findings,
+            self.sample_min_rows, self.row_budget, self.read_formulas, self.processor.reader,
+            *(check.name for check in self.checks), content_digest(file_content)
+        )
+    
+    def lookup(self, key: str) -> Optional[CheckReport]:
+        """The cached report under ``key``, if any"""
+        cached = extraction_cache.get(key)
+        return CheckReport.model_validate_json(cached) if cached is not None else None
+    
+    def store(self, key: str, report: CheckReport):
+        """Cache a report, unless the file could not be fully checked"""
+        if report.complete:
+            extraction_cache.put(key, report.model_dump_json())
+    
+    def compute(self, file_content: FileSource, filename: str, sheets: Optional[List[SheetResult]] = None) -> CheckReport:
+        """Check one workbook without the cache, as ``check_file`` does.
+        
+        A file large enough to be streamed is not read here: the checks need
+        whole sheets, so such files are left unchecked and the report incomplete.
+        """
+        # Whatever the prompt encoding, files the streaming reader takes are not loaded whole
+        if sheets is None and self.processor.is_streamed(filename, file_content, "rows"):
+            logger.info(f"Accounting checks skipped on {filename}: the file is read by the streaming reader")
+            return CheckReport(complete=False)
+        
+        started = time.perf_counter()
+        try:
+            report = CheckReport()
+            formula_sheets = self._read_formulas(file_content, filename)
+            if sheets is None:
+                sheets = self.processor.read_sheets(file_content, filename)
+            for sheet_name, frame in sheets:
+                if isinstance(frame, Exception):
+                    report.sheets.append(SheetCheck(file=filename, sheet=sheet_name, error=str(frame)))
+                elif not frame.empty:
+                    findings, sheet_check = self.run(SheetData(filename, sheet_name, frame, formula_sheets.get(sheet_name)))
+                    report.findings.extend(findings)
+                    report.sheets.append(sheet_check)
+        except Exception as e:
+            logger.error(f"Error running accounting checks on {filename}: {e}")
+            return CheckReport(complete=False)
+        
+        metrics.observe("checks.duration_seconds", time.perf_counter() - started)
+        metrics.increment("checks.findings", len(report.findings))
+        return report
+    
+    def _read_formulas(self, file_content: FileSource, filename: str) -> Dict[str, FormulaSheet]:
+        """Formulas of the workbook, or none when they are not read or cannot be"""
+        if not self.read_formulas:
+            return {}
+        try:
+            return self.processor.read_formulas(file_content, filename)
+        except Exception as e:
+            logger.warning(f"Formulas of {filename} could not be read: {e}")
+            return {}
+    
+    def run(self, sheet: SheetData) -> Tuple[List[Finding], SheetCheck]:
+        """Run the applicable checks on one sheet, scoring its rows when it is large"""
+        findings = []
+        applied = []
+        for check in self.checks:
+            if not check.applies(sheet):
+                continue
+            try:
+                findings.extend(check.run(sheet))
+                applied.append(check)
+            except Exception as e:
+                logger.error(f"Accounting check {check.name} failed on {sheet.location()}: {e}")
+        
+        rows = sheet.flagged | {finding.row for finding in findings if finding.row is not None}
+        if rows and sheet.header_row is not None:
+            rows.add(sheet.header_row)
+        
+        sheet_check = SheetCheck(
+            file=sheet.file,
+            sheet=sheet.name,
+            checks=[check.name for check in applied],
+            covered=any(check.conclusive for check in applied),
+            whole_sheet=any(finding.row is None for finding in findings),
+            rows=sorted(rows),
+            header_row=sheet.header_row,
+            data_rows=len(sheet.rows)
+        )
+        
+        # Sheets narrowed to their flagged rows do not need a sample
+        if self.sample_min_rows and len(sheet.rows) > self.sample_min_rows and not (sheet_check.covered and not sheet_check.whole_sheet):
+            scores, sheet_check.statistics = score_rows(sheet)
+            order = np.argsort(-scores, kind="stable")[:self.row_budget]
+            sheet_check.sample = sheet.rows[order].tolist()
+            sheet_check.sample_scores = np.round(scores[order], 4).tolist()
+        
+        return findings, sheet_check
+
+
+# Engine shared by the analysis endpoints
+check_engine = CheckEngine()
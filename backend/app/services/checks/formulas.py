@@ -0,0 +1,347 @@
+import ast
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+from app.models.analysis import Finding
+from .base import Check, SheetData, register_check
+
+# Tokens of the formulas evaluated locally: aggregate calls, ranges, cells, numbers and operators
+TOKEN = re.compile(
+    r"\s*(?:(?P<function>[A-Za-z][A-Za-z0-9.]*)\("
+    r"|(?P<range>\$?[A-Za-z]{1,3}\$?\d+:\$?[A-Za-z]{1,3}\$?\d+)"
+    r"|(?P<cell>\$?[A-Za-z]{1,3}\$?\d+)"
+    r"|(?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?%?)"
+    r"|(?P<operator>[-+*/^()]))"
+)
+REFERENCE = re.compile(r"^\$?([A-Za-z]{1,3})\$?(\d+)(?::\$?([A-Za-z]{1,3})\$?(\d+))?$")
+
+# Aggregates by function name, and by SUBTOTAL code (the 10x codes skip hidden rows, which
+# read-only openpyxl does not report, so they are treated like the plain codes)
+AGGREGATES = {"SUM": "sum", "AVERAGE": "average", "COUNT": "count"}
+SUBTOTAL_CODES = {1: "average", 2: "count", 9: "sum", 101: "average", 102: "count", 109: "sum"}
+
+ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd
+)
+
+# A rectangle (first row, first column, last row, last column), 1-based and inclusive
+Area = Tuple[int, int, int, int]
+
+
+class Term:
+    """A value a formula template refers to: one cell, or an aggregate over ranges"""
+    
+    __slots__ = ("kind", "areas", "subtotal")
+    
+    def __init__(self, kind: str, areas: List[Area], subtotal: bool = False):
+        self.kind = kind  # "cell", "sum", "average" or "count"
+        self.areas = areas
+        self.subtotal = subtotal
+
+
+def parse_formula(text: str) -> Optional[Tuple[str, List[Term]]]:
+    """Turn a formula into a Python expression over v0, v1... and the terms they stand for.
+    
+    Returns None for anything beyond SUM, AVERAGE, COUNT and SUBTOTAL over
+    ranges of the same sheet combined with + - * / ^ and numbers.
+    """
+    body = text[1:] if text.startswith("=") else text
+    parts: List[str] = []
+    terms: List[Term] = []
+    position = 0
+    
+    while body[position:].strip():
+        match = TOKEN.match(body, position)
+        if match is None:
+            return None
+        position = match.end()
+        
+        if match["function"]:
+            closing = body.find(")", position)
+            if closing < 0 or "(" in body[position:closing]:
+                return None
+            term = _aggregate(match["function"].upper(), body[position:closing].split(","))
+            if term is None:
+                return None
+            position = closing + 1
+        elif match["range"]:
+            return None  # a range outside an aggregate is not a number
+        elif match["cell"]:
+            term = Term("cell", [_area(match["cell"])])
+        elif match["number"]:
+            number = match["number"]
+            parts.append(f"({number[:-1]}/100)" if number.endswith("%") else number)
+            continue
+        else:
+            parts.append("**" if match["operator"] == "^" else match["operator"])
+            continue
+        
+        parts.append(f"v{len(terms)}")
+        terms.append(term)
+    
+    template = " ".join(parts)
+    if not terms or _compile(template) is None:
+        return None
+    return template, terms
+
+
+def evaluate_formulas(values: np.ndarray, parsed: List[Tuple[str, List[Term]]], subtotal_cells: np.ndarray) -> np.ndarray:
+    """Recompute every parsed formula from the cached values of the cells it uses.
+    
+    Aggregates are read from summed-area tables, so each range costs four
+    lookups however large it is, and formulas sharing a template (the same
+    formula copied down a column) are evaluated together as numpy arrays.
+    SUBTOTAL leaves out the other SUBTOTAL cells in its ranges, as Excel does.
+    """
+    terms = [term for _, formula_terms in parsed for term in formula_terms]
+    term_values = _term_values(values, terms, subtotal_cells)
+    
+    offsets = np.cumsum([0] + [len(formula_terms) for _, formula_terms in parsed])
+    groups: Dict[str, List[int]] = {}
+    for index, (template, _) in enumerate(parsed):
+        groups.setdefault(template, []).append(index)
+    
+    results = np.full(len(parsed), np.nan)
+    for template, indexes in groups.items():
+        starts = offsets[indexes]
+        count = offsets[indexes[0] + 1] - starts[0]
+        variables = {f"v{i}": term_values[starts + i] for i in range(count)}
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            results[indexes] = np.broadcast_to(eval(_compile(template), {"__builtins__": {}}, variables), len(indexes))
+    return results
+
+
+@register_check
+class FormulaCheck(Check):
+    """Cached formula results match a local recomputation, SUM ranges reach the total and no formula errors"""
+    
+    name = "formulas"
+    
+    def applies(self, sheet: SheetData) -> bool:
+        return sheet.formulas is not None and bool(sheet.formulas.formulas)
+    
+    def run(self, sheet: SheetData) -> List[Finding]:
+        formulas = sheet.formulas
+        findings = self._errors(sheet)
+        
+        parsed = [(row, column, text, parse_formula(text)) for row, column, text in formulas.formulas]
+        parsed = [(row, column, text, result) for row, column, text, result in parsed if result is not None]
+        if not parsed:
+            return findings
+        
+        values = formulas.values
+        subtotal_cells = np.zeros(values.shape, dtype=bool)
+        for row, column, text, (_, terms) in parsed:
+            if any(term.subtotal for term in terms) and row <= values.shape[0] and column <= values.shape[1]:
+                subtotal_cells[row - 1, column - 1] = True
+        
+        computed = evaluate_formulas(values, [result for *_, result in parsed], subtotal_cells)
+        cached = np.array([_cell(values, row, column) for row, column, _, _ in parsed])
+        wrong = ~np.isnan(cached) & np.isfinite(computed) & (
+            np.abs(computed - cached) > self.tolerance + 1e-9 * np.abs(cached)
+        )
+        
+        for index in np.flatnonzero(wrong)[:self.max_findings].tolist():
+            row, column, text, _ = parsed[index]
+            cell = f"{get_column_letter(column)}{row}"
+            findings.append(sheet.finding(
+                row,
+                cell=cell,
+                type="error",
+                title="Valor de fórmula no coincide",
+                description=(
+                    f"La celda {cell} ({text}) muestra {cached[index]:,.2f}, pero recalculada con los valores "
+                    f"de sus celdas da {computed[index]:,.2f} (diferencia {cached[index] - computed[index]:,.2f})."
+                ),
+                severity="high",
+                suggested_fix="Recalcular el libro y revisar si se pegaron valores sobre la fórmula o el cálculo está en manual."
+            ))
+        
+        findings.extend(self._short_ranges(sheet, parsed))
+        return findings
+    
+    def _errors(self, sheet: SheetData) -> List[Finding]:
+        """Formulas whose cached result is an Excel error"""
+        findings = []
+        for row, column, text in sheet.formulas.formulas:
+            error = sheet.formulas.errors.get((row, column))
+            if error is None:
+                continue
+            cell = f"{get_column_letter(column)}{row}"
+            findings.append(sheet.finding(
+                row,
+                cell=cell,
+                type="error",
+                title="Fórmula con error",
+                description=f"La celda {cell} ({text}) devuelve {error}.",
+                severity="high",
+                suggested_fix="Corregir las referencias o los valores que usa la fórmula."
+            ))
+            if len(findings) >= self.max_findings:
+                break
+        return findings
+    
+    def _short_ranges(self, sheet: SheetData, parsed: list) -> List[Finding]:
+        """Column totals whose SUM range stops before the numbers right above the total"""
+        candidates = [
+            (row, column, text, terms[0].areas[0])
+            for row, column, text, (template, terms) in parsed
+            if template == "v0" and terms[0].kind == "sum" and len(terms[0].areas) == 1
+            and terms[0].areas[0][1] == terms[0].areas[0][3] == column and terms[0].areas[0][2] < row - 1
+        ]
+        if not candidates:
+            return []
+        
+        values = sheet.formulas.values
+        present = np.vstack([~np.isnan(values), np.zeros((1, values.shape[1]), dtype=bool)])
+        counts = np.vstack([np.zeros((1, values.shape[1]), dtype=np.int64), np.cumsum(present, axis=0)])
+        
+        # Numbers strictly between the end of the range and the total, per candidate
+        rows = np.array([row for row, *_ in candidates])
+        columns = np.array([column for _, column, *_ in candidates]) - 1
+        ends = np.minimum(np.array([area[2] for *_, area in candidates]), values.shape[0])
+        last = np.minimum(rows - 1, values.shape[0])
+        missed = counts[last, columns] - counts[ends, columns]
+        
+        findings = []
+        for index in np.flatnonzero(missed > 0)[:self.max_findings].tolist():
+            row, column, text, area = candidates[index]
+            cell = f"{get_column_letter(column)}{row}"
+            findings.append(sheet.finding(
+                row,
+                cell=cell,
+                type="error",
+                title="Rango de suma incompleto",
+                description=(
+                    f"La fórmula {text} de la celda {cell} suma hasta la fila {area[2]}, pero entre esa fila y el "
+                    f"total hay {int(missed[index])} importe(s) que no incluye."
+                ),
+                severity="high",
+                suggested_fix=f"Extender el rango de la suma hasta la fila {row - 1}."
+            ))
+        return findings
+
+
+def _aggregate(name: str, arguments: List[str]) -> Optional[Term]:
+    """The term of an aggregate call over cells and ranges, or None if unsupported"""
+    arguments = [argument.strip() for argument in arguments]
+    subtotal = name == "SUBTOTAL"
+    if subtotal:
+        if not arguments or not arguments[0].isdigit() or int(arguments[0]) not in SUBTOTAL_CODES:
+            return None
+        kind = SUBTOTAL_CODES[int(arguments[0])]
+        arguments = arguments[1:]
+    elif name in AGGREGATES:
+        kind = AGGREGATES[name]
+    else:
+        return None
+    
+    if not arguments or not all(REFERENCE.match(argument) for argument in arguments):
+        return None
+    return Term(kind, [_area(argument) for argument in arguments], subtotal)
+
+
+def _area(reference: str) -> Area:
+    """1-based rectangle of an A1 reference or range"""
+    first_column, first_row, last_column, last_row = REFERENCE.match(reference).groups()
+    last_column, last_row = last_column or first_column, last_row or first_row
+    rows = sorted((int(first_row), int(last_row)))
+    columns = sorted((column_index_from_string(first_column.upper()), column_index_from_string(last_column.upper())))
+    return rows[0], columns[0], rows[1], columns[1]
+
+
+@lru_cache(maxsize=1024)
+def _compile(template: str):
+    """Compiled arithmetic template, or None if it has anything but numbers and operators"""
+    try:
+        tree = ast.parse(template, mode="eval")
+    except SyntaxError:
+        return None
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            return None
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            return None
+    return compile(tree, "<formula>", "eval")
+
+
+def _cell(values: np.ndarray, row: int, column: int) -> float:
+    if row > values.shape[0] or column > values.shape[1]:
+        return np.nan
+    return values[row - 1, column - 1]
+
+
+def _summed_area(grid: np.ndarray) -> np.ndarray:
+    """Summed-area table padded with a leading row and column of zeros"""
+    table = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1))
+    table[1:, 1:] = grid.cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+def _term_values(values: np.ndarray, terms: List[Term], subtotal_cells: np.ndarray) -> np.ndarray:
+    """Value of every term: cells as Excel reads them in arithmetic, aggregates by range"""
+    result = np.zeros(len(terms))
+    if not terms:
+        return result
+    kinds = np.array([term.kind for term in terms])
+    
+    present = ~np.isnan(values)
+    numbers = np.where(present, values, 0.0)
+    tables = {
+        False: (_summed_area(numbers), _summed_area(present.astype(np.float64))),
+    }
+    if any(term.subtotal for term in terms):
+        visible = present & ~subtotal_cells
+        tables[True] = (_summed_area(np.where(visible, values, 0.0)), _summed_area(visible.astype(np.float64)))
+    
+    for subtotal, (sums_table, counts_table) in tables.items():
+        owners, areas = [], []
+        for index, term in enumerate(terms):
+            if term.kind != "cell" and term.subtotal == subtotal:
+                owners.extend([index] * len(term.areas))
+                areas.extend(term.areas)
+        if not areas:
+            continue
+        
+        areas = np.array(areas)
+        first_rows = np.minimum(areas[:, 0], values.shape[0] + 1) - 1
+        first_columns = np.minimum(areas[:, 1], values.shape[1] + 1) - 1
+        last_rows = np.minimum(areas[:, 2], values.shape[0])
+        last_columns = np.minimum(areas[:, 3], values.shape[1])
+        
+        def rectangles(table: np.ndarray) -> np.ndarray:
+            totals = (
+                table[last_rows, last_columns] - table[first_rows, last_columns]
+                - table[last_rows, first_columns] + table[first_rows, first_columns]
+            )
+            return np.where((last_rows > first_rows) & (last_columns > first_columns), totals, 0.0)
+        
+        sums = np.zeros(len(terms))
+        counts = np.zeros(len(terms))
+        np.add.at(sums, owners, rectangles(sums_table))
+        np.add.at(counts, owners, rectangles(counts_table))
+        
+        owned = np.zeros(len(terms), dtype=bool)
+        owned[owners] = True
+        with np.errstate(divide="ignore", invalid="ignore"):
+            averages = np.where(counts > 0, sums / counts, np.nan)
+        result = np.where(owned & (kinds == "sum"), sums, result)
+        result = np.where(owned & (kinds == "count"), counts, result)
+        result = np.where(owned & (kinds == "average"), averages, result)
+    
+    # Empty and text cells count as 0 in arithmetic
+    cells = np.flatnonzero(kinds == "cell")
+    if len(cells):
+        rows = np.array([terms[index].areas[0][0] for index in cells])
+        columns = np.array([terms[index].areas[0][1] for index in cells])
+        inside = (rows <= values.shape[0]) & (columns <= values.shape[1])
+        looked_up = np.zeros(len(cells))
+        looked_up[inside] = numbers[rows[inside] - 1, columns[inside] - 1]
+        result[cells] = looked_up
+    
+    return result
@@ -0,0 +1,138 @@
+import copy
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.models.chat import AnalysisSession, ChatMessage
+from app.services.ai.tokens import count_tokens
+
+ROLE_LABELS = {"user": "Usuario", "assistant": "Asistente"}
+
+
+class ConversationContext:
+    """Chat context of a session, kept up to date instead of rebuilt on every turn.
+    
+    The analysis part is rendered once, and again only when the analysis
+    changes; messages are rendered as they are appended. The history sent to
+    the model starts at an index that only moves forward, by ``window``
+    messages at a time, so between those jumps a turn only adds messages at
+    the end: everything before them is byte-identical to the previous turn
+    and provider-side prompt caching can reuse it.
+    
+    The first ``summarized`` messages are replaced by the running summary of
+    the session, which the ConversationCompactor extends in the background
+    once the messages after it go over ``budget`` tokens.
+    """
+    
+    def __init__(self, session: AnalysisSession, window: Optional[int] = None, budget: Optional[int] = None):
+        self.window = window if window is not None else settings.CHAT_HISTORY_MESSAGES
+        self.budget = budget if budget is not None else settings.CHAT_HISTORY_TOKENS
+        self.start = 0
+        self.history: List[Dict[str, str]] = []
+        self._lines: List[str] = []
+        self._tokens: List[int] = []
+        self.set_analysis(session.analysis_result, session.file_names, session.created_at)
+        self.set_summary(session.conversation_summary, session.summarized_messages)
+        for message in session.conversation_history:
+            self.append(message)
+    
+    def set_analysis(self, analysis_result: Dict[str, Any], file_names: List[str], created_at: datetime):
+        """Render the analysis part of the context"""
+        lines = [
+            "ANÁLISIS PREVIO:",
+            f"Archivos analizados: {', '.join(file_names)}",
+            f"Fecha del análisis: {created_at.strftime('%Y-%m-%d %H:%M:%S')}",
+            "",
+            "RESUMEN DEL ANÁLISIS:",
+            str(analysis_result.get('summary', 'No disponible')),
+            "",
+            "HALLAZGOS:"
+        ]
+        
+        findings = analysis_result.get('findings', [])
+        for finding in findings[:5]:  # Limit to first 5 findings
+            lines.append(f"- {finding.get('title', 'Sin título')}: {finding.get('description', '')}")
+        if len(findings) > 5:
+            lines.append(f"... y {len(findings) - 5} hallazgos más.")
+        
+        lines.extend(["", "RECOMENDACIONES:"])
+        recommendations = analysis_result.get('recommendations', [])
+        for rec in recommendations[:3]:  # Limit to first 3 recommendations
+            lines.append(f"- {rec.get('title', 'Sin título')}: {rec.get('description', '')}")
+        if len(recommendations) > 3:
+            lines.append(f"... y {len(recommendations) - 3} recomendaciones más.")
+        
+        self.analysis = "\n".join(lines)
+    
+    def set_summary(self, summary: str, summarized: int):
+        """Replace the first ``summarized`` messages by ``summary``"""
+        self.summary = summary
+        self.summarized = summarized
+    
+    def append(self, message: ChatMessage):
+        """Add a message, moving the start of the history when it is twice the window"""
+        self.history.append({"role": message.role, "content": message.content})
+        self._lines.append(f"{ROLE_LABELS.get(message.role, message.role)}: {message.content}")
+        self._tokens.append(count_tokens(message.content, settings.OPENAI_MODEL))
+        if self.window and len(self.history) - self.start > 2 * self.window:
+            self.start = len(self.history) - self.window
+            # Start at a question so no answer is shown without it
+            while self.start < len(self.history) - 1 and self.history[self.start]["role"] != "user":
+                self.start += 1
+    
+    def copy(self) -> "ConversationContext":
+        """An independent copy, sharing the rendered messages"""
+        context = copy.copy(self)
+        context.history, context._lines, context._tokens = list(self.history), list(self._lines), list(self._tokens)
+        return context
+    
+    @property
+    def first(self) -> int:
+        """Index of the first message sent as is"""
+        return max(self.start, self.summarized)
+    
+    def recent(self) -> List[Dict[str, str]]:
+        """Messages sent to the model: those after the summary, at most the last ``2 * window``"""
+        return self.history[self.first:]
+    
+    def history_tokens(self) -> int:
+        """Tokens of the messages sent as is"""
+        return sum(self._tokens[self.first:])
+    
+    def pending(self) -> Optional[int]:
+        """Index up to which messages should be folded into the summary, or None.
+        
+        Once the messages after the summary go over the budget, all but the
+        most recent ones within half of it are folded, starting again at a
+        question. Messages the window already dropped are always folded, so
+        they end up in the summary instead of being lost.
+        """
+        if not self.budget:
+            return None
+        
+        cut = self.summarized
+        if sum(self._tokens[self.summarized:]) > self.budget:
+            kept = 0
+            cut = len(self.history)
+            while cut > self.summarized and kept + self._tokens[cut - 1] <= self.budget // 2:
+                cut -= 1
+                kept += self._tokens[cut]
+            while cut < len(self.history) and self.history[cut]["role"] != "user":
+                cut += 1
+        cut = max(cut, self.start)
+        return cut if cut > self.summarized else None
+    
+    def _summary_text(self) -> str:
+        return f"\n\nRESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{self.summary}" if self.summary else ""
+    
+    def messages(self, instructions: str, user_message: str) -> List[Dict[str, str]]:
+        """Chat messages for the model: instructions, analysis and summary, the history, then the question"""
+        return [
+            {"role": "system", "content": f"{instructions}\n{self.analysis}{self._summary_text()}"},
+            *self.recent(),
+            {"role": "user", "content": user_message}
+        ]
+    
+    def text(self) -> str:
+        """The context as one text: the analysis and summary followed by the recent history"""
+        return "\n".join([self.analysis + self._summary_text(), "", "HISTORIAL DE CONVERSACIÓN:", *self._lines[self.first:]]) + "\n"
@@ -1,14 +1,72 @@
+import numpy as np
 import pandas as pd
 import openpyxl
-from typing import List, Dict, Any
+from openpyxl.utils.datetime import WINDOWS_EPOCH, to_excel
+from typing import List, Dict, Any, Optional, Iterator, Set, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor, wait
+import hashlib
 import io
+import multiprocessing
 import os
-from fastapi import HTTPException
+import posixpath
+import re
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ElementTree
+from datetime import date, datetime, time, timedelta
+from fastapi import HTTPException, UploadFile
+from app.core.config import settings
+from app.services.ai.chunking import COLUMNS_PREFIX
+from app.services.readers import FileSource, SheetResult, choose_reader, open_source, readable_extensions
+from app.utils.cache import TieredCache
+
+# Leading bytes of each supported format (OOXML is a ZIP, .xls an OLE2 compound file)
+FILE_SIGNATURES = {
+    '.xlsx': b"PK\x03\x04",
+    '.xlsm': b"PK\x03\x04",
+    '.xlsb': b"PK\x03\x04",
+    '.xls': b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1",
+}
+
+# Formats openpyxl reads, for streaming and formulas
+OPENPYXL_EXTENSIONS = ('.xlsx', '.xlsm')
+
+# Start of a formula element in a worksheet's XML, with any namespace prefix
+FORMULA_TAG = re.compile(rb"<(?:\w+:)?f[\s>/]")
+
+# Bump when the extracted text format changes so on-disk entries are not reused
+EXTRACTION_CACHE_VERSION = 3
+
+# Prompt encodings of the sheet rows: "ColK: v | ..." per row, or one header line plus delimited rows
+PROMPT_ENCODINGS = ("rows", "compact")
+COMPACT_DELIMITER = "|"
+
+# Extracted workbook text keyed by file content, shared by every ExcelProcessor
+extraction_cache = TieredCache(
+    "excel",
+    memory_bytes=settings.EXCEL_CACHE_MEMORY_BYTES,
+    disk_dir=settings.EXCEL_CACHE_DIR,
+    disk_bytes=settings.EXCEL_CACHE_DISK_BYTES
+)
 
 
 class ExcelProcessor:
-    def __init__(self):
-        self.supported_extensions = {'.xlsx', '.xls'}
+    def __init__(self, ingestion_mode: Optional[str] = None, encoding: Optional[str] = None, reader: Optional[str] = None):
+        # Formats some installed reader backend can parse
+        self.supported_extensions = settings.ALLOWED_EXTENSIONS & readable_extensions()
+        self.ingestion_mode = ingestion_mode or settings.EXCEL_INGESTION_MODE
+        self.encoding = encoding or settings.EXCEL_PROMPT_ENCODING
+        self.reader = reader or settings.EXCEL_READER
+    
+    def validate_encoding(self, encoding: Optional[str]) -> str:
+        """Resolve the prompt encoding of a request, rejecting unknown ones"""
+        encoding = encoding or self.encoding
+        if encoding not in PROMPT_ENCODINGS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Codificación no soportada. Codificaciones permitidas: {', '.join(PROMPT_ENCODINGS)}"
+            )
+        return encoding
     
     def validate_file(self, filename: str, file_size: int, max_size: int) -> bool:
         """Validate if the file is supported and within size limits"""
@@ -17,7 +75,7 @@ class ExcelProcessor:
         if file_ext not in self.supported_extensions:
             raise HTTPException(
                 status_code=400,
-                detail=f"Formato de archivo no soportado. Formatos permitidos: {', '.join(self.supported_extensions)}"
+                detail=f"Formato de archivo no soportado. Formatos permitidos: {', '.join(sorted(self.supported_extensions))}"
             )
         
         if file_size > max_size:
@@ -28,53 +86,119 @@ class ExcelProcessor:
         
         return True
     
-    def extract_data_from_excel(self, file_content: bytes, filename: str) -> str:
-        """Extract and format data from Excel file"""
+    def validate_signature(self, filename: str, head: bytes) -> bool:
+        """Check that the first bytes of the file match its extension"""
+        file_ext = os.path.splitext(filename)[1].lower()
+        signature = FILE_SIGNATURES.get(file_ext)
+        
+        if signature is not None and not head.startswith(signature):
+            raise HTTPException(
+                status_code=400,
+                detail=f"El contenido del archivo {filename} no corresponde a un archivo {file_ext} válido"
+            )
+        
+        return True
+    
+    async def read_upload(self, file: UploadFile, max_size: int) -> "SpooledUpload":
+        """Read an upload in chunks, validating it as early as possible.
+        
+        The extension is checked before reading, the magic bytes on the first
+        chunk, and the size after every chunk, so oversized files are rejected
+        without being buffered. Files above UPLOAD_SPOOL_THRESHOLD are written to
+        a temporary file that the parser reads from.
+        """
+        self.validate_file(file.filename, 0, max_size)
+        
+        upload = SpooledUpload(file.filename)
         try:
-            # Read Excel file
-            excel_file = pd.ExcelFile(io.BytesIO(file_content))
+            while True:
+                chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if upload.size == 0:
+                    self.validate_signature(file.filename, chunk)
+                
+                upload.write(chunk)
+                self.validate_file(file.filename, upload.size, max_size)
+            
+            upload.finish()
+            return upload
+        except Exception:
+            upload.cleanup()
+            raise
+    
+    def extract_data_from_excel(self, file_content: FileSource, filename: str, encoding: Optional[str] = None) -> str:
+        """Extract and format data from Excel file, reusing earlier extractions of the same bytes"""
+        return self.extract_sheets(file_content, filename, encoding)[0]
+    
+    def extract_sheets(self, file_content: FileSource, filename: str, encoding: Optional[str] = None) -> Tuple[str, Optional[List[SheetResult]]]:
+        """Like extract_data_from_excel, also returning the sheets the text was formatted from.
+        
+        The sheets are those of ``read_sheets``, so the accounting checks can
+        reuse them instead of parsing the file again. They are None when the
+        text came from the cache or from the streaming reader.
+        """
+        encoding = encoding or self.encoding
+        header = self._file_header(filename)
+        key = self.cache_key(file_content, filename, encoding)
+        
+        body = extraction_cache.get(key)
+        sheets = None
+        if body is None:
+            text, sheets = self._extract(file_content, filename, encoding)
+            # The cached text leaves out the header so renamed copies still hit
+            body = text[len(header):]
+            extraction_cache.put(key, body)
+        
+        return header + body, sheets
+    
+    def cache_key(self, file_content: FileSource, filename: str, encoding: Optional[str] = None) -> str:
+        """Content-addressed key of a file's extracted text"""
+        encoding = encoding or self.encoding
+        if self._use_streaming(filename, encoding, file_content):
+            mode = "streaming"
+        else:
+            mode = choose_reader(filename, self.reader).name
+        return TieredCache.hash_key("excel", EXTRACTION_CACHE_VERSION, mode, encoding, content_digest(file_content))
+    
+    def _file_header(self, filename: str) -> str:
+        return f"=== ANÁLISIS DE ARCHIVO: {filename} ===\n"
+    
+    def _extract(self, file_content: FileSource, filename: str, encoding: Optional[str] = None) -> Tuple[str, Optional[List[SheetResult]]]:
+        """Parse the workbook and format its data, returning the sheets read (None when streamed)"""
+        encoding = encoding or self.encoding
+        try:
+            if self._use_streaming(filename, encoding, file_content):
+                return "\n".join(self.iter_excel_lines(file_content, filename)), None
             
             formatted_data = []
-            formatted_data.append(f"=== ANÁLISIS DE ARCHIVO: {filename} ===\n")
+            formatted_data.append(self._file_header(filename))
             
             # Process each sheet
-            for sheet_name in excel_file.sheet_names:
+            sheets = list(self.read_sheets(file_content, filename))
+            for sheet_name, df in sheets:
                 formatted_data.append(f"\n--- HOJA: {sheet_name} ---")
                 
                 try:
-                    # Read the sheet
-                    df = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
-                    
-                    # Remove completely empty rows and columns
-                    df = df.dropna(how='all').dropna(axis=1, how='all')
+                    if isinstance(df, Exception):
+                        raise df
                     
                     if df.empty:
                         formatted_data.append("Esta hoja está vacía o no contiene datos válidos.")
                         continue
                     
+                    if encoding == "compact":
+                        formatted_data.extend(self._format_sheet_compact(df))
+                        continue
+                    
                     # Add sheet information
                     formatted_data.append(f"Dimensiones: {df.shape[0]} filas x {df.shape[1]} columnas")
                     
                     # Convert to string representation
                     formatted_data.append("\nDatos:")
                     
-                    # Process each row with row numbers
-                    for idx, row in df.iterrows():
-                        row_data = []
-                        for col_idx, value in enumerate(row):
-                            if pd.notna(value):
-                                # Format numbers appropriately
-                                if isinstance(value, (int, float)):
-                                    if isinstance(value, float) and value.is_integer():
-                                        formatted_value = f"{int(value)}"
-                                    else:
-                                        formatted_value = f"{value:,.2f}"
-                                else:
-                                    formatted_value = str(value)
-                                row_data.append(f"Col{col_idx+1}: {formatted_value}")
-                        
-                        if row_data:
-                            formatted_data.append(f"Fila {idx+1}: {' | '.join(row_data)}")
+                    # Format rows column by column instead of iterating row objects
+                    formatted_data.extend(self._format_rows(df))
                     
                     # Add summary statistics for numeric columns
                     numeric_columns = df.select_dtypes(include=['number']).columns
@@ -94,7 +218,7 @@ class ExcelProcessor:
                     formatted_data.append(f"Error al procesar la hoja '{sheet_name}': {str(e)}")
                     continue
             
-            return "\n".join(formatted_data)
+            return "\n".join(formatted_data), sheets
             
         except Exception as e:
             raise HTTPException(
@@ -102,20 +226,626 @@ class ExcelProcessor:
                 detail=f"Error al procesar el archivo Excel: {str(e)}"
             )
     
-    def process_multiple_files(self, files_data: List[Dict[str, Any]]) -> str:
-        """Process multiple Excel files and combine their data"""
-        all_data = []
+    def read_sheets(self, file_content: FileSource, filename: str) -> Iterator[Tuple[str, Union[pd.DataFrame, Exception]]]:
+        """Yield each sheet as the DataFrame the text is extracted from, or the error reading it.
+        
+        The reader backend is chosen by extension (EXCEL_READER first when it
+        reads the format); completely empty rows and columns are dropped.
+        """
+        for sheet_name, df in choose_reader(filename, self.reader).read(file_content, filename):
+            if isinstance(df, Exception):
+                yield sheet_name, df
+            else:
+                yield sheet_name, df.dropna(how='all').dropna(axis=1, how='all')
+    
+    def read_formulas(self, file_content: FileSource, filename: str) -> Dict[str, "FormulaSheet"]:
+        """Formulas and cached values of the sheets that have formulas (.xlsx and .xlsm only).
+        
+        pandas only sees the values Excel cached, so the sheets with formulas
+        are read twice with openpyxl: once for the formula text and once for
+        the cached values. Which sheets have formulas is found first by
+        scanning their XML, so workbooks without any are not read at all.
+        """
+        if os.path.splitext(filename)[1].lower() not in OPENPYXL_EXTENSIONS:
+            return {}
+        
+        names = _formula_sheet_names(file_content)
+        if not names:
+            return {}
+        
+        formula_book = openpyxl.load_workbook(open_source(file_content), read_only=True, data_only=False)
+        value_book = openpyxl.load_workbook(open_source(file_content), read_only=True, data_only=True)
+        try:
+            sheets = {}
+            for formula_sheet, value_sheet in zip(formula_book.worksheets, value_book.worksheets):
+                if formula_sheet.title not in names:
+                    continue
+                formulas = [
+                    (row_number, column_number, value)
+                    for row_number, values in enumerate(formula_sheet.iter_rows(min_row=1, min_col=1, values_only=True), start=1)
+                    for column_number, value in enumerate(values, start=1)
+                    if isinstance(value, str) and value.startswith("=")
+                ]
+                if formulas:
+                    sheets[formula_sheet.title] = FormulaSheet(
+                        list(value_sheet.iter_rows(min_row=1, min_col=1, values_only=True)), formulas, value_book.epoch
+                    )
+            return sheets
+        finally:
+            formula_book.close()
+            value_book.close()
+    
+    def iter_excel_lines(self, file_content: FileSource, filename: str) -> Iterator[str]:
+        """Yield the formatted workbook text line by line using openpyxl's read-only mode.
         
-        for file_data in files_data:
-            filename = file_data['filename']
-            content = file_data['content']
+        Only the current row and running per-column statistics are held in memory,
+        so memory stays bounded regardless of the number of rows. Columns keep their
+        sheet position, and the dimensions line is emitted after the rows.
+        """
+        workbook = openpyxl.load_workbook(open_source(file_content), read_only=True, data_only=True)
+        try:
+            yield self._file_header(filename)
+            
+            for worksheet in workbook.worksheets:
+                yield f"\n--- HOJA: {worksheet.title} ---"
+                try:
+                    yield from self._iter_sheet_lines(worksheet)
+                except Exception as e:
+                    yield f"Error al procesar la hoja '{worksheet.title}': {str(e)}"
+        finally:
+            workbook.close()
+    
+    def _iter_sheet_lines(self, worksheet) -> Iterator[str]:
+        """Stream the rows of a read-only worksheet followed by its summary"""
+        stats: Dict[int, _ColumnStats] = {}
+        row_count = 0
+        
+        for row_number, values in enumerate(worksheet.iter_rows(values_only=True), start=1):
+            row_data = []
+            for col_idx, value in enumerate(values):
+                if value is None:
+                    continue
+                
+                column = stats.get(col_idx)
+                if column is None:
+                    column = stats[col_idx] = _ColumnStats()
+                column.add(value)
+                row_data.append(f"Col{col_idx+1}: {_format_value(value)}")
             
-            try:
-                file_analysis = self.extract_data_from_excel(content, filename)
+            if row_data:
+                if row_count == 0:
+                    yield "\nDatos:"
+                row_count += 1
+                yield f"Fila {row_number}: {' | '.join(row_data)}"
+        
+        if row_count == 0:
+            yield "Esta hoja está vacía o no contiene datos válidos."
+            return
+        
+        yield f"Dimensiones: {row_count} filas x {len(stats)} columnas"
+        
+        numeric_columns = [col for col in sorted(stats) if stats[col].is_numeric]
+        if numeric_columns:
+            yield f"\nResumen estadístico para columnas numéricas:"
+            for col in numeric_columns:
+                column = stats[col]
+                yield (
+                    f"  Columna {col+1}: Suma={column.total:,.2f}, "
+                    f"Promedio={column.total / column.count:,.2f}, "
+                    f"Min={column.minimum:,.2f}, "
+                    f"Max={column.maximum:,.2f}"
+                )
+    
+    def _use_streaming(self, filename: str, encoding: Optional[str] = None, file_content: Optional[FileSource] = None) -> bool:
+        """Check whether the file should be read with the streaming reader.
+        
+        In "auto" mode only files of at least EXCEL_STREAMING_MIN_BYTES are streamed.
+        """
+        # openpyxl only reads OOXML workbooks, and the compact encoding needs whole columns
+        file_ext = os.path.splitext(filename)[1].lower()
+        if file_ext not in OPENPYXL_EXTENSIONS or (encoding or self.encoding) != "rows":
+            return False
+        if self.ingestion_mode == "auto":
+            return file_content is not None and _source_size(file_content) >= settings.EXCEL_STREAMING_MIN_BYTES
+        return self.ingestion_mode == "streaming"
+    
+    def _format_rows(self, df: pd.DataFrame) -> List[str]:
+        """Render every row as 'Fila N: ColK: v | ...' working one column at a time"""
+        columns = self._format_columns(df)
+        row_numbers = (df.index + 1).tolist()
+        
+        rows = []
+        for row_number, cells in zip(row_numbers, zip(*columns)):
+            row_data = [cell for cell in cells if cell is not None]
+            if row_data:
+                rows.append(f"Fila {row_number}: {' | '.join(row_data)}")
+        return rows
+    
+    def _format_columns(self, df: pd.DataFrame) -> List[List[Optional[str]]]:
+        """Format each column into 'ColK: v' cells, with None for empty cells.
+        
+        Values are formatted exactly as a row-wise ``iterrows`` walk would see
+        them, including the dtype the frame is interleaved to: in an all-numeric
+        frame with a float column, integer columns are upcast to float.
+        """
+        common_dtype = _interleaved_dtype(df.dtypes)
+        columns = []
+        
+        for position, (_, series) in enumerate(df.items()):
+            label = f"Col{position+1}: "
+            dtype = common_dtype if common_dtype is not None else series.dtype
+            
+            if isinstance(dtype, np.dtype) and dtype.kind == 'f':
+                columns.append(_format_float_column(series.to_numpy(dtype=np.float64), label))
+            elif isinstance(dtype, np.dtype) and dtype.kind in 'iub':
+                columns.append([f"{label}{value:,.2f}" for value in series.to_numpy().tolist()])
+            else:
+                columns.append([
+                    f"{label}{_format_value(value)}" if pd.notna(value) else None
+                    for value in series.tolist()
+                ])
+        
+        return columns
+    
+    def _format_sheet_compact(self, df: pd.DataFrame) -> List[str]:
+        """Render a sheet as one 'Columnas:' line followed by '|'-delimited rows.
+        
+        A first row of text labels is used as the header; otherwise columns are
+        named ColK as in the rows encoding. Each row starts with its sheet row
+        number, and numbers use one format per column.
+        """
+        names = detect_header(df)
+        body = df
+        if names is not None:
+            body = df.iloc[1:].infer_objects()
+        else:
+            names = [f"Col{position+1}" for position in range(df.shape[1])]
+        
+        lines = [
+            f"Dimensiones: {body.shape[0]} filas x {body.shape[1]} columnas",
+            f"{COLUMNS_PREFIX}Fila{COMPACT_DELIMITER}{COMPACT_DELIMITER.join(names)}"
+        ]
+        
+        columns = [_format_compact_column(series) for _, series in body.items()]
+        for row_number, cells in zip((body.index + 1).tolist(), zip(*columns)):
+            lines.append(f"{row_number}{COMPACT_DELIMITER}{COMPACT_DELIMITER.join(cells)}")
+        
+        numeric_columns = [
+            (name, series.dropna()) for name, (_, series) in zip(names, body.items())
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+        ]
+        numeric_columns = [(name, values) for name, values in numeric_columns if len(values) > 0]
+        if numeric_columns:
+            lines.append("Resumen estadístico para columnas numéricas:")
+            for name, values in numeric_columns:
+                lines.append(
+                    f"  {name}: Suma={values.sum():.2f}, Promedio={values.mean():.2f}, "
+                    f"Min={values.min():.2f}, Max={values.max():.2f}"
+                )
+        
+        return lines
+    
+    def process_multiple_files(self, files_data: List[Dict[str, Any]], encoding: Optional[str] = None) -> str:
+        """Process multiple Excel files and combine their data.
+        
+        When a process pool is configured the files are parsed in parallel;
+        results are still combined in upload order.
+        """
+        return self.extract_files(files_data, encoding)[0]
+    
+    def extract_files(self, files_data: List[Dict[str, Any]], encoding: Optional[str] = None, checks: Optional[Any] = None) -> Tuple[str, List[Any]]:
+        """Like process_multiple_files, also running the accounting ``checks`` (a CheckEngine) on each file.
+        
+        Each file is checked right after it is extracted, in the process that
+        parsed it, with the sheets of ``extract_sheets``: pooled files are not
+        read again in the server nor their DataFrames sent back. The reports
+        are returned in upload order, None for the files that could not be
+        extracted.
+        """
+        encoding = encoding or self.encoding
+        pool = get_process_pool() if len(files_data) > 1 else None
+        
+        if pool is not None:
+            results = self._extract_in_pool(pool, files_data, encoding, checks)
+        else:
+            results = [self._extract_and_check(f['content'], f['filename'], encoding, checks) for f in files_data]
+        
+        all_data = []
+        for file_data, (file_analysis, error, _) in zip(files_data, results):
+            if error is None:
                 all_data.append(file_analysis)
-                all_data.append("\n" + "="*80 + "\n")
-            except Exception as e:
-                all_data.append(f"Error procesando {filename}: {str(e)}")
-                all_data.append("\n" + "="*80 + "\n")
+            else:
+                all_data.append(f"Error procesando {file_data['filename']}: {error}")
+            all_data.append("\n" + "="*80 + "\n")
+        
+        return "\n".join(all_data), [report for _, _, report in results]
+    
+    def is_streamed(self, filename: str, file_content: FileSource, encoding: Optional[str] = None) -> bool:
+        """Whether the file is read with the streaming reader rather than loaded as DataFrames"""
+        return self._use_streaming(filename, encoding, file_content)
+    
+    def _extract_and_check(
+        self,
+        file_content: FileSource,
+        filename: str,
+        encoding: Optional[str] = None,
+        checks: Optional[Any] = None
+    ) -> Tuple[Optional[str], Optional[str], Any]:
+        """Extract a file and check its sheets, returning the error message instead of raising"""
+        try:
+            text, sheets = self.extract_sheets(file_content, filename, encoding)
+        except Exception as e:
+            return None, str(e), None
+        return text, None, checks.check_file(file_content, filename, sheets) if checks is not None else None
+    
+    def _extract_in_pool(
+        self,
+        pool: ProcessPoolExecutor,
+        files_data: List[Dict[str, Any]],
+        encoding: str,
+        checks: Optional[Any] = None
+    ) -> List[Tuple[Optional[str], Optional[str], Any]]:
+        """Extract and check the files in the pool, caching their text and reports in this process.
+        
+        Pool processes have their own in-memory caches, so the caches are
+        looked up and filled here: only what is missing is sent to the pool,
+        and a file whose text is cached is only checked there.
+        """
+        results = []
+        pending = []
+        for index, file_data in enumerate(files_data):
+            content, filename = file_data['content'], file_data['filename']
+            text_key = self.cache_key(content, filename, encoding)
+            body = extraction_cache.get(text_key)
+            report_key = checks.report_key(content, filename) if checks is not None else None
+            report = checks.lookup(report_key) if checks is not None else None
+            
+            results.append((None if body is None else self._file_header(filename) + body, None, report))
+            if body is None or (checks is not None and report is None):
+                pending.append((index, text_key, report_key))
         
-        return "\n".join(all_data) 
\ No newline at end of file
+        jobs = [
+            (files_data[index]['filename'], files_data[index]['content'], self.ingestion_mode, self.reader, encoding,
+             checks if report_key is not None and results[index][2] is None else None, results[index][0] is None)
+            for index, _, report_key in pending
+        ]
+        for (index, text_key, report_key), (text, error, report) in zip(pending, pool.map(_extract_in_worker, jobs)):
+            cached_text, _, cached_report = results[index]
+            if cached_text is None and error is None:
+                # The cached text leaves out the header so renamed copies still hit
+                extraction_cache.put(text_key, text[len(self._file_header(files_data[index]['filename'])):])
+            if report is not None:
+                checks.store(report_key, report)
+            results[index] = (cached_text or text, error, cached_report or report)
+        return results
+
+class FormulaSheet:
+    """The formulas of a worksheet and the values Excel cached for its cells.
+    
+    ``values`` is a float grid indexed by (row - 1, column - 1), NaN where the
+    cached value is empty or not a number; dates and times hold the serial
+    number Excel computes with, counted from ``epoch``. ``errors`` holds the
+    cells whose cached value is an Excel error such as #REF!. Formulas are
+    (row, column, text) with 1-based sheet coordinates.
+    """
+    
+    def __init__(self, rows: List[tuple], formulas: List[Tuple[int, int, str]], epoch: datetime = WINDOWS_EPOCH):
+        width = max((len(row) for row in rows), default=0)
+        self.values = np.full((len(rows), width), np.nan)
+        self.errors: Dict[Tuple[int, int], str] = {}
+        self.formulas = formulas
+        
+        for row_index, row in enumerate(rows):
+            for column_index, value in enumerate(row):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.values[row_index, column_index] = value
+                elif isinstance(value, (date, time, timedelta)):
+                    self.values[row_index, column_index] = to_excel(value, epoch)
+                elif isinstance(value, str) and value.startswith("#"):
+                    self.errors[(row_index + 1, column_index + 1)] = value
+
+
+class SpooledUpload:
+    """An upload kept in memory while small and spooled to a temporary file once large"""
+    
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.size = 0
+        self.path: Optional[str] = None
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._file = None
+        self._digest = hashlib.sha256()
+    
+    @property
+    def digest(self) -> str:
+        """SHA-256 of the bytes received so far"""
+        return self._digest.hexdigest()
+    
+    @property
+    def source(self) -> FileSource:
+        """What the parser reads: the bytes, or the path of the spooled file"""
+        return self.path if self.path is not None else self._buffer.getvalue()
+    
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        self._digest.update(chunk)
+        
+        if self._file is None and self.size > settings.UPLOAD_SPOOL_THRESHOLD:
+            self._file = tempfile.NamedTemporaryFile(
+                prefix="upload-",
+                suffix=os.path.splitext(self.filename)[1],
+                dir=settings.UPLOAD_SPOOL_DIR or None,
+                delete=False
+            )
+            self.path = self._file.name
+            self._file.write(self._buffer.getvalue())
+            self._buffer = None
+        
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer.write(chunk)
+    
+    def finish(self):
+        """Flush the spooled file so it can be opened by path"""
+        if self._file is not None:
+            self._file.close()
+    
+    def cleanup(self):
+        """Remove the spooled file, if any"""
+        if self._file is not None:
+            self._file.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _source_size(file_content: FileSource) -> int:
+    """Size in bytes of the workbook, without reading spooled files"""
+    if isinstance(file_content, str):
+        return os.path.getsize(file_content)
+    return len(file_content)
+
+
+def _formula_sheet_names(file_content: FileSource) -> Set[str]:
+    """Names of the worksheets of an OOXML workbook whose XML has a formula element"""
+    relationships = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+    with zipfile.ZipFile(open_source(file_content)) as archive:
+        targets = {
+            rel.get("Id"): rel.get("Target")
+            for rel in ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        }
+        members = set(archive.namelist())
+        names = set()
+        for sheet in ElementTree.fromstring(archive.read("xl/workbook.xml")).iter():
+            if not sheet.tag.endswith("}sheet") or targets.get(sheet.get(relationships)) is None:
+                continue
+            target = targets[sheet.get(relationships)]
+            path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+            if path in members and _has_formula(archive, path):
+                names.add(sheet.get("name"))
+        return names
+
+
+def _has_formula(archive: zipfile.ZipFile, path: str) -> bool:
+    """Scan a member of the archive in chunks for a formula element"""
+    tail = b""
+    with archive.open(path) as member:
+        for chunk in iter(lambda: member.read(1 << 20), b""):
+            if FORMULA_TAG.search(tail + chunk):
+                return True
+            tail = chunk[-16:]
+    return False
+
+
+def content_digest(file_content: FileSource) -> str:
+    """SHA-256 of the workbook bytes, reading spooled files in chunks"""
+    if not isinstance(file_content, str):
+        return hashlib.sha256(file_content).hexdigest()
+    
+    digest = hashlib.sha256()
+    with open(file_content, "rb") as f:
+        for chunk in iter(lambda: f.read(settings.UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _interleaved_dtype(dtypes: pd.Series) -> Optional[np.dtype]:
+    """Return the dtype pandas uses for ``df.values``, or None when it is object"""
+    if not all(isinstance(dtype, np.dtype) for dtype in dtypes):
+        return None
+    kinds = {dtype.kind for dtype in dtypes}
+    if kinds == {'b'}:
+        return np.dtype(bool)
+    if kinds <= {'i', 'u', 'f'}:
+        return np.result_type(*dtypes)
+    return None
+
+
+def _format_value(value: Any) -> str:
+    """Format a single non-empty cell value"""
+    # Format numbers appropriately
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and value.is_integer():
+            return f"{int(value)}"
+        return f"{value:,.2f}"
+    return str(value)
+
+
+def _format_float_column(values: np.ndarray, label: str) -> List[Optional[str]]:
+    """Format a float column, printing integral values without decimals"""
+    cells = np.full(len(values), None, dtype=object)
+    present = ~np.isnan(values)
+    integral = present & np.isfinite(values) & (values == np.trunc(values))
+    
+    # Integral values that fit in int64 are converted in a single numpy pass
+    fits = integral & (np.abs(values) < 2**63)
+    cells[fits] = [label + text for text in values[fits].astype(np.int64).astype(str).tolist()]
+    
+    remaining = present & ~fits
+    cells[remaining] = [f"{label}{_format_value(value)}" for value in values[remaining].tolist()]
+    
+    return cells.tolist()
+
+
+def detect_header(df: pd.DataFrame) -> Optional[List[str]]:
+    """Column names taken from the first row, if it looks like a header row.
+    
+    The first row counts as a header when at least half of its cells are
+    filled, all of them with text, and there are data rows below it.
+    """
+    if len(df) < 2:
+        return None
+    
+    first = df.iloc[0].tolist()
+    labels = [value for value in first if pd.notna(value)]
+    if len(labels) * 2 < len(first) or not all(isinstance(value, str) for value in labels):
+        return None
+    
+    return [
+        _compact_text(value) if pd.notna(value) else f"Col{position+1}"
+        for position, value in enumerate(first)
+    ]
+
+
+def _compact_text(value: Any) -> str:
+    """Text of a cell with the delimiter and line breaks removed"""
+    return " ".join(str(value).replace(COMPACT_DELIMITER, "/").split())
+
+
+def _compact_value(value: Any) -> str:
+    """Format one cell of a mixed-type column for the compact encoding"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return str(int(value)) if float(value).is_integer() else f"{value:.2f}"
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return _compact_datetime(pd.Timestamp(value))
+    return _compact_text(value)
+
+
+def _compact_datetime(value: pd.Timestamp) -> str:
+    return value.strftime("%Y-%m-%d") if value == value.normalize() else value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _format_compact_column(series: pd.Series) -> List[str]:
+    """Format a column with one number format for all of its values, '' for empty cells"""
+    if pd.api.types.is_bool_dtype(series):
+        return [str(value) for value in series.tolist()]
+    
+    if pd.api.types.is_integer_dtype(series):
+        return series.astype(str).tolist()
+    
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        if np.all(values[present] == np.trunc(values[present])) and np.all(np.abs(values[present]) < 2**63):
+            cells = np.full(len(values), "", dtype=object)
+            cells[present] = values[present].astype(np.int64).astype(str)
+            return cells.tolist()
+        return ["" if np.isnan(value) else f"{value:.2f}" for value in values.tolist()]
+    
+    if pd.api.types.is_datetime64_any_dtype(series):
+        dates = series.dt.normalize()
+        pattern = "%Y-%m-%d" if bool((series.dropna() == dates.dropna()).all()) else "%Y-%m-%d %H:%M:%S"
+        return series.dt.strftime(pattern).fillna("").tolist()
+    
+    return [_compact_value(value) for value in series.tolist()]
+
+
+class _ColumnStats:
+    """Running statistics of a column, kept while streaming rows"""
+    
+    __slots__ = ("count", "total", "minimum", "maximum", "is_numeric")
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+        self.is_numeric = True
+    
+    def add(self, value: Any):
+        """Account for a non-empty cell value"""
+        # Like pandas' numeric dtypes: a single text or boolean cell disqualifies the column
+        if not self.is_numeric:
+            return
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            self.is_numeric = False
+            return
+        self.count += 1
+        self.total += value
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+
+# Process pool shared by every ExcelProcessor of this (gunicorn) worker
+_process_pool: Optional[ProcessPoolExecutor] = None
+_worker_processor: Optional[ExcelProcessor] = None
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Get the parsing process pool, or None when parallel parsing is disabled"""
+    global _process_pool
+    
+    if settings.EXCEL_PROCESS_POOL_SIZE <= 0:
+        return None
+    
+    if _process_pool is None:
+        # spawn avoids forking a worker that already runs the event loop and its threads
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.EXCEL_PROCESS_POOL_SIZE,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_pool_worker
+        )
+    
+    return _process_pool
+
+
+def warm_up_process_pool():
+    """Start every pool process up front so the first upload does not pay for it"""
+    pool = get_process_pool()
+    if pool is not None:
+        wait([pool.submit(_pool_worker_ready) for _ in range(settings.EXCEL_PROCESS_POOL_SIZE)])
+
+
+def shutdown_process_pool():
+    """Stop the parsing process pool"""
+    global _process_pool
+    
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+
+
+def _init_pool_worker():
+    """Runs once in each pool process: import the readers and build the processor"""
+    global _worker_processor
+    _worker_processor = ExcelProcessor()
+
+
+def _pool_worker_ready() -> bool:
+    return _worker_processor is not None
+
+
+def _extract_in_worker(job: Tuple[str, FileSource, str, str, str, Optional[Any], bool]) -> Tuple[Optional[str], Optional[str], Any]:
+    """Parse and check one file inside a pool process, leaving the caching to the server.
+    
+    The file is only checked when its text is already cached there.
+    """
+    filename, content, ingestion_mode, reader, encoding, checks, extract = job
+    _worker_processor.ingestion_mode = ingestion_mode
+    _worker_processor.reader = reader
+    
+    text, sheets = None, None
+    if extract:
+        try:
+            text, sheets = _worker_processor._extract(content, filename, encoding)
+        except Exception as e:
+            return None, str(e), None
+    return text, None, checks.compute(content, filename, sheets) if checks is not None else None
@@ -0,0 +1,235 @@
+import csv
+import importlib.util
+import io
+import os
+from typing import Dict, Iterator, Optional, Tuple, Type, Union
+
+import pandas as pd
+from fastapi import HTTPException
+
+# Workbook bytes, or the path of an upload spooled to disk
+FileSource = Union[bytes, str]
+
+# A sheet as read (no header, nothing dropped), or the error reading it
+SheetResult = Tuple[str, Union[pd.DataFrame, Exception]]
+
+# Reader classes by name, in order of preference for automatic selection
+READERS: Dict[str, Type["SheetReader"]] = {}
+
+# Bytes of a CSV file used to detect its delimiter
+CSV_SNIFF_BYTES = 65536
+# Numbers written with a decimal comma and optional thousands dots: 1.234,56 or 1234,5
+DECIMAL_COMMA_NUMBER = r"^-?(?:\d{1,3}(?:\.\d{3})*|\d+)(?:,\d+)?$"
+
+
+class SheetReader:
+    """A spreadsheet reading backend.
+    
+    Subclasses set ``name``, the ``extensions`` they read and the optional
+    ``module`` they need, and yield every sheet as a header-less DataFrame
+    whose index and columns are the 0-based sheet row and column, so row
+    numbers match the workbook whatever the backend.
+    """
+    
+    name = ""
+    extensions: Tuple[str, ...] = ()
+    module: Optional[str] = None
+    
+    @classmethod
+    def available(cls) -> bool:
+        """Whether the package the backend needs is installed"""
+        return cls.module is None or importlib.util.find_spec(cls.module) is not None
+    
+    def read(self, source: FileSource, filename: str) -> Iterator[SheetResult]:
+        raise NotImplementedError
+
+
+def register_reader(cls: Type[SheetReader]) -> Type[SheetReader]:
+    """Class decorator adding a backend to the registry"""
+    READERS[cls.name] = cls
+    return cls
+
+
+def readable_extensions() -> set:
+    """Extensions some installed backend can read"""
+    return {extension for reader in READERS.values() if reader.available() for extension in reader.extensions}
+
+
+def choose_reader(filename: str, preferred: str = "auto") -> SheetReader:
+    """The backend for a file: ``preferred`` when it can read it, else the first installed one"""
+    extension = os.path.splitext(filename)[1].lower()
+    
+    reader = READERS.get(preferred)
+    if reader is not None and extension in reader.extensions and reader.available():
+        return reader()
+    
+    for reader in READERS.values():
+        if extension in reader.extensions and reader.available():
+            return reader()
+    
+    raise HTTPException(
+        status_code=400,
+        detail=f"No hay un lector instalado para archivos {extension}"
+    )
+
+
+def open_source(source: FileSource):
+    """Something the readers can open: a path or an in-memory buffer"""
+    if isinstance(source, str):
+        return source
+    return io.BytesIO(source)
+
+
+@register_reader
+class CalamineReader(SheetReader):
+    """Rust reader for every Excel format, several times faster than openpyxl"""
+    
+    name = "calamine"
+    extensions = ('.xlsx', '.xlsm', '.xlsb', '.xls')
+    module = "python_calamine"
+    
+    def read(self, source: FileSource, filename: str) -> Iterator[SheetResult]:
+        from python_calamine import CalamineWorkbook
+        
+        workbook = CalamineWorkbook.from_object(open_source(source))
+        for sheet_name in workbook.sheet_names:
+            try:
+                # Keep the leading empty rows and columns so positions match the sheet
+                rows = workbook.get_sheet_by_name(sheet_name).to_python(skip_empty_area=False)
+                yield sheet_name, _frame_from_rows(rows)
+            except Exception as e:
+                yield sheet_name, e
+
+
+class _PandasExcelReader(SheetReader):
+    """Backends pandas drives through one of its Excel engines"""
+    
+    def read(self, source: FileSource, filename: str) -> Iterator[SheetResult]:
+        excel_file = pd.ExcelFile(open_source(source), engine=self.name)
+        try:
+            for sheet_name in excel_file.sheet_names:
+                try:
+                    yield sheet_name, pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
+                except Exception as e:
+                    yield sheet_name, e
+        finally:
+            excel_file.close()
+
+
+@register_reader
+class OpenpyxlReader(_PandasExcelReader):
+    name = "openpyxl"
+    extensions = ('.xlsx', '.xlsm')
+    module = "openpyxl"
+
+
+@register_reader
+class XlrdReader(_PandasExcelReader):
+    name = "xlrd"
+    extensions = ('.xls',)
+    module = "xlrd"
+
+
+@register_reader
+class PyxlsbReader(_PandasExcelReader):
+    name = "pyxlsb"
+    extensions = ('.xlsb',)
+    module = "pyxlsb"
+
+
+@register_reader
+class CsvReader(SheetReader):
+    """CSV files as a single sheet named after the file.
+    
+    The delimiter is detected among , ; tab and |, and files delimited with
+    ';' also accept a decimal comma, as spreadsheets export them in locales
+    that write 1.234,56. Whether dots are thousands separators is decided
+    for the whole file, so 1.250 means the same in every row; cells that do
+    not fit the pattern keep their dots, so 3.14 stays a number and
+    01.02.2024 stays text. Numbers are parsed cell by cell, so a header row
+    leaves the values below it numeric as in a workbook.
+    """
+    
+    name = "csv"
+    extensions = ('.csv',)
+    
+    def read(self, source: FileSource, filename: str) -> Iterator[SheetResult]:
+        sheet_name = os.path.splitext(os.path.basename(filename))[0] or "CSV"
+        try:
+            sample = _read_head(source, CSV_SNIFF_BYTES)
+            encoding = _text_encoding(sample)
+            delimiter = _sniff_delimiter(sample.decode(encoding, errors="ignore"))
+            frame = pd.read_csv(
+                open_source(source),
+                header=None,
+                sep=delimiter,
+                encoding=encoding,
+                dtype=object,
+                skip_blank_lines=False
+            )
+            yield sheet_name, _parse_numbers(frame, decimal_comma=delimiter == ";")
+        except Exception as e:
+            yield sheet_name, e
+
+
+def _frame_from_rows(rows: list) -> pd.DataFrame:
+    """DataFrame of calamine rows, with its empty strings as missing values
+
+    Whole floats become ints, as pandas' Excel engines read them, so 100
+    and an entry number 2 are formatted the same whatever the backend.
+    """
+    frame = pd.DataFrame(rows, dtype=object)
+    frame = frame.mask(frame.map(lambda value: isinstance(value, str) and value == ""))
+    frame = frame.map(lambda value: int(value) if isinstance(value, float) and value.is_integer() else value)
+    return frame.infer_objects()
+
+
+def _parse_numbers(frame: pd.DataFrame, decimal_comma: bool) -> pd.DataFrame:
+    """Turn the text cells that are numbers into floats, leaving the rest as text.
+    
+    With decimal_comma the locale is decided once per file: dots are read as
+    thousands separators only if some cell writes a decimal comma, so 1.250
+    is 1250 next to 99,5 and 1.25 in a file that never uses a comma.
+    """
+    cleaned = {position: text.str.strip() for position, text in frame.items()}
+    localized = {}
+    if decimal_comma:
+        localized = {position: text.str.match(DECIMAL_COMMA_NUMBER, na=False) for position, text in cleaned.items()}
+        if not any((matches & cleaned[position].str.contains(",", regex=False, na=False)).any()
+                   for position, matches in localized.items()):
+            localized = {}
+    
+    columns = {}
+    for position, text in frame.items():
+        numbers = cleaned[position]
+        if localized:
+            numbers = numbers.where(
+                ~localized[position], numbers.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+            )
+        numbers = pd.to_numeric(numbers, errors="coerce")
+        columns[position] = numbers.astype(object).where(numbers.notna(), text)
+    return pd.DataFrame(columns, index=frame.index).infer_objects()
+
+
+def _read_head(source: FileSource, size: int) -> bytes:
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read(size)
+    return source[:size]
+
+
+def _text_encoding(sample: bytes) -> str:
+    """UTF-8 (with or without BOM) when the sample decodes as such, else Latin-1"""
+    try:
+        # A multi-byte character may be cut at the end of the sample
+        sample[:-4].decode("utf-8")
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+
+def _sniff_delimiter(text: str) -> str:
+    try:
+        return csv.Sniffer().sniff(text, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
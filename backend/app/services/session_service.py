@@ -1,126 +1,459 @@
-from typing import Dict, Optional, List
+from typing import Any, Callable, Dict, Optional, List, Tuple
+import asyncio
+import json
+import logging
+import threading
+import time
 import uuid
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from chat_models import AnalysisSession, ChatMessage
-import json
+from app.core.config import settings
+from app.models.chat import AnalysisSession, ChatMessage
+from app.services.conversation import ConversationContext
+from app.services.session_store import SessionConflict, SessionStore, create_session_store
+from app.utils.compression import compress, decompress
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Activity is written back to the store at most this often per session (seconds)
+TOUCH_INTERVAL = 60
+
+# Session fields stored as the payload, written when the session is created and
+# when its analysis changes; the rest is rewritten on every chat turn
+PAYLOAD_FIELDS = {"analysis_result", "excel_data"}
+
+# Times an update is re-applied when other writers keep changing the session first
+UPDATE_ATTEMPTS = 10
+
+
+class ParsedSessions:
+    """Sessions a worker has parsed, by last access, within a byte budget.
+    
+    Each session counts the size of its JSON; once the total goes over
+    ``max_bytes`` the least recently used are dropped and parsed again from
+    the store if they come back. Sessions over the budget are not kept.
+    Sessions are saved from worker threads, so every access takes a lock.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], AnalysisSession, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, session_id: str) -> Optional[Tuple[Tuple[int, int], AnalysisSession]]:
+        """Store versions and parsed session, marking it as the most recently used"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(session_id)
+            return entry[0], entry[1]
+    
+    def put(self, session_id: str, versions: Tuple[int, int], session: AnalysisSession, size: int):
+        with self._lock:
+            self._pop(session_id)
+            if self.max_bytes and size > self.max_bytes:
+                return
+            
+            self._entries[session_id] = (versions, session, size)
+            self.bytes += size
+            while self.max_bytes and self.bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+    
+    def pop(self, session_id: str):
+        with self._lock:
+            self._pop(session_id)
+    
+    def _pop(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+    
+    def expire(self, oldest: datetime) -> int:
+        """Drop the sessions last active before ``oldest``, from the front of the access order"""
+        expired = 0
+        with self._lock:
+            while self._entries:
+                session_id, (_, session, size) = next(iter(self._entries.items()))
+                if session.last_activity >= oldest:
+                    break
+                del self._entries[session_id]
+                self.bytes -= size
+                expired += 1
+        return expired
+    
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "bytes": self.bytes, "evictions": self.evictions}
 
 
 class SessionService:
-    """Service to manage analysis sessions and chat context"""
+    """Service to manage analysis sessions and chat context.
+    
+    Sessions are kept in a SessionStore shared by the workers (SESSION_STORE),
+    so a chat can land on a different worker from its analysis. Each worker
+    keeps the sessions it has parsed with their store versions and only
+    re-reads the parts another worker changed, within a per-worker byte
+    budget (SESSION_CACHE_MEMORY_BYTES). The analysis and Excel data are
+    stored apart from the conversation, so a chat turn only writes the
+    latter. Session data is compressed in the store above
+    SESSION_COMPRESS_MIN_BYTES. Expired sessions are removed by the
+    SessionReaper task, never on the request path. Updates are written only
+    over the version they were computed from and re-applied when another
+    worker or thread wrote first, so concurrent turns are not lost. Reads
+    and writes block on the store, so async callers run them in a thread.
+    """
     
-    def __init__(self):
-        self.sessions: Dict[str, AnalysisSession] = {}
-        self.session_timeout = timedelta(hours=24)  # Sessions expire after 24 hours
+    def __init__(self, store: Optional[SessionStore] = None):
+        self.store = store or create_session_store(ttl=settings.SESSION_TIMEOUT)
+        self.session_timeout = timedelta(seconds=self.store.ttl)  # Sessions expire after 24 hours
+        self._parsed = ParsedSessions(settings.SESSION_CACHE_MEMORY_BYTES)
     
     def create_session(self, analysis_result: Dict, excel_data: Dict, file_names: List[str]) -> str:
         """Create a new analysis session"""
         session_id = str(uuid.uuid4())
+        now = datetime.now()
         
         session = AnalysisSession(
             session_id=session_id,
             analysis_result=analysis_result,
             excel_data=excel_data,
             conversation_history=[],
-            file_names=file_names
+            file_names=file_names,
+            created_at=now,
+            last_activity=now
         )
         
-        self.sessions[session_id] = session
-        self.cleanup_expired_sessions()
+        self._save(session, payload=True)
         
         return session_id
     
     def get_session(self, session_id: str) -> Optional[AnalysisSession]:
         """Get a session by ID"""
-        session = self.sessions.get(session_id)
-        if session:
-            # Update last activity
-            session.last_activity = datetime.now()
-            return session
-        return None
+        loaded = self._load(session_id)
+        return loaded[1] if loaded is not None else None
+    
+    def _load(self, session_id: str) -> Optional[Tuple[int, AnalysisSession]]:
+        """The session and the store version it was read at"""
+        cached = self._parsed.get(session_id)
+        stored = self.store.get(session_id, *(cached[0] if cached else (0, 0)))
+        if stored is None:
+            self._parsed.pop(session_id)
+            return None
+        
+        if stored.data is None:
+            session = cached[1]
+        else:
+            data = decompress(stored.data)
+            fields = json.loads(data)
+            if stored.payload is None:
+                # Only the conversation changed: keep the payload already parsed
+                payload_bytes = cached[1]._payload_bytes
+                fields.update({field: getattr(cached[1], field) for field in PAYLOAD_FIELDS})
+            else:
+                payload = decompress(stored.payload)
+                payload_bytes = len(payload)
+                fields.update(json.loads(payload))
+            session = AnalysisSession.model_validate(fields)
+            session._payload_bytes = payload_bytes
+            self._parsed.put(session_id, (stored.version, stored.payload_version), session, payload_bytes + len(data))
+        
+        # Update last activity
+        now = time.time()
+        if now - stored.last_activity >= TOUCH_INTERVAL:
+            self.store.touch(session_id, now)
+        session.last_activity = datetime.fromtimestamp(now)
+        return stored.version, session
     
     def add_message(self, session_id: str, message: ChatMessage) -> bool:
         """Add a message to the session conversation"""
-        session = self.get_session(session_id)
-        if session:
-            session.conversation_history.append(message)
-            session.last_activity = datetime.now()
-            return True
-        return False
+        return self.add_messages(session_id, [message]) is not None
+    
+    def add_messages(self, session_id: str, messages: List[ChatMessage]) -> Optional[AnalysisSession]:
+        """Add messages to the session conversation in a single write.
+        
+        Returns the updated session, or None if it is gone.
+        """
+        def change(session: AnalysisSession) -> AnalysisSession:
+            updated = _copy(session, conversation_history=session.conversation_history + messages, last_activity=datetime.now())
+            if updated._context is not None:
+                for message in messages:
+                    updated._context.append(message)
+            return updated
+        
+        return self._update(session_id, change)
+    
+    def add_message_to_session(self, session_id: str, user_message: str, ai_response: str) -> Optional[AnalysisSession]:
+        """Add a user question and the assistant answer to the session conversation"""
+        return self.add_messages(session_id, [
+            ChatMessage(role="user", content=user_message),
+            ChatMessage(role="assistant", content=ai_response)
+        ])
+    
+    def update_analysis(self, session_id: str, analysis_result: Dict) -> bool:
+        """Replace the analysis of a session, re-rendering only that part of its context"""
+        def change(session: AnalysisSession) -> AnalysisSession:
+            updated = _copy(session, analysis_result=analysis_result)
+            if updated._context is not None:
+                updated._context.set_analysis(analysis_result, updated.file_names, updated.created_at)
+            return updated
+        
+        return self._update(session_id, change, payload=True) is not None
+    
+    def update_summary(self, session_id: str, summary: str, summarized: int, upto: int) -> bool:
+        """Fold the messages up to ``upto`` into the session summary.
+        
+        ``summarized`` is how many messages the summary covered when it was
+        computed; if another task or worker has moved it since, the new
+        summary is dropped.
+        """
+        def change(session: AnalysisSession) -> Optional[AnalysisSession]:
+            if session.summarized_messages != summarized:
+                return None
+            updated = _copy(session, conversation_summary=summary, summarized_messages=upto)
+            if updated._context is not None:
+                updated._context.set_summary(summary, upto)
+            return updated
+        
+        return self._update(session_id, change) is not None
+    
+    def context(self, session: AnalysisSession) -> ConversationContext:
+        """The session's conversation context, built on first use and then kept up to date"""
+        if session._context is None:
+            session._context = ConversationContext(session)
+        return session._context
     
     def get_conversation_context(self, session_id: str) -> str:
         """Get the full conversation context for AI processing"""
         session = self.get_session(session_id)
         if not session:
             return ""
+        return self.context(session).text()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Resident bytes and evictions of the parsed sessions and the store"""
+        return {"parsed": self._parsed.stats(), "store": self.store.stats()}
+    
+    def cleanup_expired_sessions(self) -> int:
+        """Remove expired sessions"""
+        removed = self.store.purge(time.time())
+        self.forget_expired_sessions()
+        return removed
+    
+    def forget_expired_sessions(self) -> int:
+        """Drop the expired sessions this worker has parsed, oldest access first"""
+        return self._parsed.expire(datetime.now() - self.session_timeout)
+    
+    def list_sessions(self) -> List[Dict]:
+        """List all active sessions"""
+        sessions = []
+        for session_id, data, last_activity in self.store.items():
+            fields = json.loads(decompress(data))
+            sessions.append({
+                "session_id": session_id,
+                "file_names": fields["file_names"],
+                "created_at": fields["created_at"],
+                "last_activity": datetime.fromtimestamp(last_activity).isoformat(),
+                "message_count": len(fields["conversation_history"])
+            })
+        return sessions
+    
+    def delete_session(self, session_id: str) -> bool:
+        """Delete a session"""
+        self._parsed.pop(session_id)
+        return self.store.delete(session_id)
+    
+    def _update(
+        self,
+        session_id: str,
+        change: Callable[[AnalysisSession], Optional[AnalysisSession]],
+        payload: bool = False
+    ) -> Optional[AnalysisSession]:
+        """Write ``change(session)`` over the version of the session it was computed from.
         
-        # Build context with analysis results and conversation history
-        context = f"""
-ANÁLISIS PREVIO:
-Archivos analizados: {', '.join(session.file_names)}
-Fecha del análisis: {session.created_at.strftime('%Y-%m-%d %H:%M:%S')}
-
-RESUMEN DEL ANÁLISIS:
-{session.analysis_result.get('summary', 'No disponible')}
-
-HALLAZGOS:
-"""
-        
-        # Add findings
-        findings = session.analysis_result.get('findings', [])
-        for i, finding in enumerate(findings[:5]):  # Limit to first 5 findings
-            context += f"- {finding.get('title', 'Sin título')}: {finding.get('description', '')}\n"
-        
-        if len(findings) > 5:
-            context += f"... y {len(findings) - 5} hallazgos más.\n"
+        ``change`` returns an updated copy, or None to leave the session as
+        is. When another worker or thread writes the session in between, it
+        is read again and ``change`` re-applied to it. Returns the written
+        session, or None if the session is gone or ``change`` declined.
+        """
+        for _ in range(UPDATE_ATTEMPTS):
+            loaded = self._load(session_id)
+            if loaded is None:
+                return None
+            version, session = loaded
+            
+            updated = change(session)
+            if updated is None:
+                return None
+            try:
+                return updated if self._save(updated, payload, version) else None
+            except SessionConflict:
+                metrics.increment("sessions.write_conflicts")
+        raise SessionConflict(session_id)
+    
+    def _save(self, session: AnalysisSession, payload: bool = False, version: Optional[int] = None) -> bool:
+        """Write a session to the store, compressed if large, and keep it parsed at its new versions.
         
-        context += "\nRECOMENDACIONES:\n"
-        recommendations = session.analysis_result.get('recommendations', [])
-        for i, rec in enumerate(recommendations[:3]):  # Limit to first 3 recommendations
-            context += f"- {rec.get('title', 'Sin título')}: {rec.get('description', '')}\n"
+        The payload is only written with ``payload``; False if the session is
+        gone. With ``version`` the write raises SessionConflict if the session
+        is no longer at that version.
+        """
+        data = session.model_dump_json(exclude=PAYLOAD_FIELDS).encode("utf-8")
+        stored = compress(data, settings.SESSION_COMPRESSION, settings.SESSION_COMPRESS_MIN_BYTES)
+        stored_payload = None
+        if payload:
+            payload_data = session.model_dump_json(include=PAYLOAD_FIELDS).encode("utf-8")
+            stored_payload = compress(payload_data, settings.SESSION_COMPRESSION, settings.SESSION_COMPRESS_MIN_BYTES)
+            session._payload_bytes = len(payload_data)
+            metrics.increment("sessions.data_bytes", len(payload_data))
+            metrics.increment("sessions.stored_bytes", len(stored_payload))
         
-        if len(recommendations) > 3:
-            context += f"... y {len(recommendations) - 3} recomendaciones más.\n"
+        versions = self.store.put(session.session_id, stored, session.last_activity.timestamp(), stored_payload, version)
+        if versions is None:
+            self._parsed.pop(session.session_id)
+            return False
+        self._parsed.put(session.session_id, tuple(versions), session, session._payload_bytes + len(data))
         
-        # Add conversation history
-        context += "\nHISTORIAL DE CONVERSACIÓN:\n"
-        for msg in session.conversation_history[-10:]:  # Last 10 messages
-            role = "Usuario" if msg.role == "user" else "Asistente"
-            context += f"{role}: {msg.content}\n"
+        metrics.increment("sessions.data_bytes", len(data))
+        metrics.increment("sessions.stored_bytes", len(stored))
+        return True
+
+
+def _copy(session: AnalysisSession, **fields: Any) -> AnalysisSession:
+    """A copy of a parsed session with ``fields`` replaced and its own conversation context.
+    
+    The parsed session stays as the store has it until the copy is written,
+    and other threads may be reading it meanwhile.
+    """
+    updated = session.model_copy(update=fields)
+    if session._context is not None:
+        updated._context = session._context.copy()
+    return updated
+
+
+class SessionReaper:
+    """Background task that removes expired sessions every ``interval`` seconds.
+    
+    The store is purged in batches of ``batch`` sessions in a thread, so
+    neither the event loop nor the store is held for long, and the sessions
+    this worker has parsed are dropped from the front of their access order.
+    """
+    
+    def __init__(self, service: SessionService, interval: float, batch: int):
+        self.service = service
+        self.interval = interval
+        self.batch = batch
+        self._task: Optional[asyncio.Task] = None
+    
+    async def reap(self) -> int:
+        """Remove every session expired by now and return how many the store held"""
+        removed = 0
+        now = time.time()
+        while True:
+            purged = await asyncio.to_thread(self.service.store.purge, now, self.batch)
+            removed += purged
+            if purged < self.batch:
+                break
         
-        return context
+        self.service.forget_expired_sessions()
+        if removed:
+            metrics.increment("sessions.expired", removed)
+        return removed
     
-    def cleanup_expired_sessions(self):
-        """Remove expired sessions"""
-        current_time = datetime.now()
-        expired_sessions = [
-            session_id for session_id, session in self.sessions.items()
-            if current_time - session.last_activity > self.session_timeout
-        ]
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"Error removing expired sessions: {e}")
+
+
+class ConversationCompactor:
+    """Background summarization of long chat histories.
+    
+    After each turn ``schedule`` checks the session context; when the
+    messages after the summary go over CHAT_HISTORY_TOKENS, the oldest are
+    folded into the summary by a task, so the chat request never waits for it
+    and the next turns send the summary instead of those messages. A session
+    has at most one compaction running per worker; one that fails is retried
+    on the next turn. ``schedule`` takes the session the turn wrote, so it
+    does not read the store on the event loop.
+    """
+    
+    def __init__(self, service: SessionService):
+        self.service = service
+        self._tasks: Dict[str, asyncio.Task] = {}
+    
+    def schedule(self, session: AnalysisSession, ai_service) -> bool:
+        """Start compacting the session, as the turn just left it, if it needs it and is not already being compacted"""
+        session_id = session.session_id
+        if session_id in self._tasks:
+            return False
+        
+        context = self.service.context(session)
+        upto = context.pending()
+        if upto is None:
+            return False
         
-        for session_id in expired_sessions:
-            del self.sessions[session_id]
+        messages = context.history[context.summarized:upto]
+        self._tasks[session_id] = asyncio.create_task(
+            self._compact(session_id, ai_service, context.summary, context.summarized, upto, messages)
+        )
+        return True
     
-    def list_sessions(self) -> List[Dict]:
-        """List all active sessions"""
-        self.cleanup_expired_sessions()
-        return [
-            {
-                "session_id": session.session_id,
-                "file_names": session.file_names,
-                "created_at": session.created_at.isoformat(),
-                "last_activity": session.last_activity.isoformat(),
-                "message_count": len(session.conversation_history)
-            }
-            for session in self.sessions.values()
-        ]
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
     
-    def delete_session(self, session_id: str) -> bool:
-        """Delete a session"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            return True
-        return False
+    async def _compact(self, session_id: str, ai_service, summary: str, summarized: int, upto: int, messages: List[Dict[str, str]]):
+        started = time.perf_counter()
+        try:
+            summary = await ai_service.summarize_conversation_async(summary, messages)
+            if await asyncio.to_thread(self.service.update_summary, session_id, summary, summarized, upto):
+                metrics.increment("chat.compactions")
+                metrics.increment("chat.compacted_messages", upto - summarized)
+                metrics.observe("chat.compaction_seconds", time.perf_counter() - started)
+        except Exception as e:
+            logger.error(f"Error summarizing conversation {session_id}: {e}")
+            metrics.increment("chat.compaction_errors")
+        finally:
+            self._tasks.pop(session_id, None)
 
 
 # Global session service instance
 session_service = SessionService()
+metrics.register_gauge("sessions", session_service.stats)
+
+# Expiry of the sessions, run by each worker in the background
+session_reaper = SessionReaper(session_service, settings.SESSION_REAP_INTERVAL, settings.SESSION_REAP_BATCH)
+
+# Summarization of long conversations, run by each worker in the background
+conversation_compactor = ConversationCompactor(session_service)
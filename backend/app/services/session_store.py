@@ -0,0 +1,464 @@
+import heapq
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.resp import RespClient
+
+logger = logging.getLogger(__name__)
+
+class SessionConflict(Exception):
+    """The session was written by someone else after the version the writer read"""
+
+
+class StoredSession(NamedTuple):
+    """A stored session; each part is None when the caller already has its version"""
+    data: Optional[bytes]
+    payload: Optional[bytes]
+    version: int  # Bumped on every write
+    payload_version: int  # Bumped when the payload is written
+    last_activity: float  # Epoch seconds
+
+
+class SessionStore:
+    """Where sessions live between requests.
+    
+    Records hold two opaque parts: a large payload written when the session
+    is created and rarely after, and small data rewritten on every change,
+    so a chat turn never rewrites the payload. Each part has a version and
+    records expire ``ttl`` seconds after their last activity. Versions let a
+    worker keep the sessions it has parsed and re-read only the parts
+    another worker changed, and make writes conditional on the version the
+    writer read, so concurrent updates from different workers are not lost.
+    """
+    
+    name = ""
+    
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+    
+    def get(self, session_id: str, known_version: int = 0, known_payload_version: int = 0) -> Optional[StoredSession]:
+        """A live session, without the parts that are still at the known versions"""
+        raise NotImplementedError
+    
+    def put(
+        self,
+        session_id: str,
+        data: bytes,
+        last_activity: float,
+        payload: Optional[bytes] = None,
+        version: Optional[int] = None
+    ) -> Optional[Tuple[int, int]]:
+        """Write a session and return its new versions.
+        
+        Without ``payload`` only the data of an existing session is replaced,
+        and None is returned if the session is gone. With ``version`` the
+        session must exist and still be at that version, or SessionConflict
+        is raised and nothing is written.
+        """
+        raise NotImplementedError
+    
+    def touch(self, session_id: str, last_activity: float) -> bool:
+        """Record activity on a session, extending its life; False if it is gone"""
+        raise NotImplementedError
+    
+    def delete(self, session_id: str) -> bool:
+        raise NotImplementedError
+    
+    def items(self) -> Iterator[Tuple[str, bytes, float]]:
+        """(session_id, data, last_activity) of every live session, without the payloads"""
+        raise NotImplementedError
+    
+    def purge(self, now: float, limit: Optional[int] = None) -> int:
+        """Remove up to ``limit`` sessions expired at ``now`` and return how many"""
+        raise NotImplementedError
+    
+    def stats(self) -> Dict[str, Any]:
+        """Size counters of the backend, for the metrics"""
+        return {"backend": self.name}
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions of this process only, for a single worker and for tests.
+    
+    A min-heap of (last activity, session_id) orders the sessions by expiry.
+    Touching a session does not update its heap entry: when the entry comes
+    up, a session that has been active since is pushed back with its current
+    activity, so purging costs O(log n) per session it looks at. With
+    ``max_bytes`` the least recently used sessions are evicted once their
+    data and payloads go over that many bytes.
+    """
+    
+    name = "memory"
+    
+    def __init__(self, ttl: float, max_bytes: int = 0):
+        super().__init__(ttl)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._records: "OrderedDict[str, List]" = OrderedDict()
+        self._expiry: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+    
+    def get(self, session_id: str, known_version: int = 0, known_payload_version: int = 0) -> Optional[StoredSession]:
+        with self._lock:
+            record = self._records.get(session_id)
+            if record is None or record[4] < time.time() - self.ttl:
+                return None
+            self._records.move_to_end(session_id)
+        data, payload, version, payload_version, last_activity = record
+        return StoredSession(
+            None if version == known_version else data,
+            None if payload_version == known_payload_version else payload,
+            version,
+            payload_version,
+            last_activity
+        )
+    
+    def put(
+        self,
+        session_id: str,
+        data: bytes,
+        last_activity: float,
+        payload: Optional[bytes] = None,
+        version: Optional[int] = None
+    ) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            record = self._records.get(session_id)
+            if version is not None and record is not None and record[2] != version:
+                raise SessionConflict(session_id)
+            
+            record = self._records.pop(session_id, None)
+            if record is None:
+                if payload is None or version is not None:
+                    return None
+                heapq.heappush(self._expiry, (last_activity, session_id))
+                record = [b"", b"", 0, 0, last_activity]
+            else:
+                self.bytes -= len(record[0]) + len(record[1])
+            
+            record[0], record[2], record[4] = data, record[2] + 1, last_activity
+            if payload is not None:
+                record[1], record[3] = payload, record[3] + 1
+            self._records[session_id] = record
+            self.bytes += len(record[0]) + len(record[1])
+            
+            # The session just written is kept even if it alone is over the budget
+            while self.max_bytes and self.bytes > self.max_bytes and len(self._records) > 1:
+                _, evicted = self._records.popitem(last=False)
+                self.bytes -= len(evicted[0]) + len(evicted[1])
+                self.evictions += 1
+            return record[2], record[3]
+    
+    def touch(self, session_id: str, last_activity: float) -> bool:
+        with self._lock:
+            record = self._records.get(session_id)
+            if record is None:
+                return False
+            record[4] = last_activity
+            return True
+    
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            record = self._records.pop(session_id, None)
+            if record is None:
+                return False
+            self.bytes -= len(record[0]) + len(record[1])
+            return True
+    
+    def items(self) -> Iterator[Tuple[str, bytes, float]]:
+        oldest = time.time() - self.ttl
+        with self._lock:
+            live = [(session_id, record[0], record[4]) for session_id, record in self._records.items() if record[4] >= oldest]
+        yield from live
+    
+    def purge(self, now: float, limit: Optional[int] = None) -> int:
+        oldest = now - self.ttl
+        removed = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] < oldest and (limit is None or removed < limit):
+                _, session_id = heapq.heappop(self._expiry)
+                record = self._records.get(session_id)
+                if record is None:
+                    # Deleted since it was pushed
+                    continue
+                if record[4] >= oldest:
+                    heapq.heappush(self._expiry, (record[4], session_id))
+                    continue
+                del self._records[session_id]
+                self.bytes -= len(record[0]) + len(record[1])
+                removed += 1
+        return removed
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "entries": len(self._records),
+            "bytes": self.bytes,
+            "evictions": self.evictions
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite database in WAL mode, shared by every worker of the node.
+    
+    WAL lets readers run while a worker writes, so a lookup is one indexed
+    SELECT that skips the data and payload the caller has current. Payloads
+    live in their own table: SQLite rewrites a whole row on UPDATE, so a
+    chat turn would otherwise copy the payload again. Each process and
+    thread opens its own connection on first use.
+    """
+    
+    name = "sqlite"
+    
+    def __init__(self, path: str, ttl: float):
+        super().__init__(ttl)
+        self.path = path
+        self._local = threading.local()
+    
+    def get(self, session_id: str, known_version: int = 0, known_payload_version: int = 0) -> Optional[StoredSession]:
+        row = self._connection().execute(
+            "SELECT CASE WHEN version = ? THEN NULL ELSE data END, "
+            "CASE WHEN payload_version = ? THEN NULL ELSE "
+            "(SELECT payload FROM chat_session_payloads WHERE session_id = chat_sessions.session_id) END, "
+            "version, payload_version, last_activity "
+            "FROM chat_sessions WHERE session_id = ? AND last_activity >= ?",
+            (known_version, known_payload_version, session_id, time.time() - self.ttl)
+        ).fetchone()
+        return StoredSession(*row) if row is not None else None
+    
+    def put(
+        self,
+        session_id: str,
+        data: bytes,
+        last_activity: float,
+        payload: Optional[bytes] = None,
+        version: Optional[int] = None
+    ) -> Optional[Tuple[int, int]]:
+        connection = self._connection()
+        with connection:
+            if payload is None or version is not None:
+                # The version condition makes the check and the write one atomic statement
+                cursor = connection.execute(
+                    "UPDATE chat_sessions SET data = ?, version = version + 1, "
+                    "payload_version = payload_version + ?, last_activity = ? "
+                    "WHERE session_id = ? AND (? IS NULL OR version = ?)",
+                    (data, int(payload is not None), last_activity, session_id, version, version)
+                )
+                if cursor.rowcount == 0:
+                    exists = connection.execute(
+                        "SELECT 1 FROM chat_sessions WHERE session_id = ?", (session_id,)
+                    ).fetchone()
+                    if exists and version is not None:
+                        raise SessionConflict(session_id)
+                    return None
+                if payload is not None:
+                    connection.execute(
+                        "UPDATE chat_session_payloads SET payload = ? WHERE session_id = ?", (payload, session_id)
+                    )
+            else:
+                connection.execute(
+                    "INSERT INTO chat_sessions (session_id, data, version, payload_version, last_activity) "
+                    "VALUES (?, ?, 1, 1, ?) ON CONFLICT(session_id) DO UPDATE SET "
+                    "data = excluded.data, version = version + 1, "
+                    "payload_version = payload_version + 1, last_activity = excluded.last_activity",
+                    (session_id, data, last_activity)
+                )
+                connection.execute(
+                    "INSERT INTO chat_session_payloads (session_id, payload) VALUES (?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET payload = excluded.payload",
+                    (session_id, payload)
+                )
+            return connection.execute(
+                "SELECT version, payload_version FROM chat_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+    
+    def touch(self, session_id: str, last_activity: float) -> bool:
+        connection = self._connection()
+        with connection:
+            cursor = connection.execute(
+                "UPDATE chat_sessions SET last_activity = ? WHERE session_id = ?", (last_activity, session_id)
+            )
+        return cursor.rowcount > 0
+    
+    def delete(self, session_id: str) -> bool:
+        connection = self._connection()
+        with connection:
+            cursor = connection.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+        return cursor.rowcount > 0
+    
+    def items(self) -> Iterator[Tuple[str, bytes, float]]:
+        yield from self._connection().execute(
+            "SELECT session_id, data, last_activity FROM chat_sessions WHERE last_activity >= ?",
+            (time.time() - self.ttl,)
+        ).fetchall()
+    
+    def purge(self, now: float, limit: Optional[int] = None) -> int:
+        connection = self._connection()
+        with connection:
+            # The last_activity index makes this a range scan of the expired rows only
+            cursor = connection.execute(
+                "DELETE FROM chat_sessions WHERE session_id IN "
+                "(SELECT session_id FROM chat_sessions WHERE last_activity < ? LIMIT ?)",
+                (now - self.ttl, -1 if limit is None else limit)
+            )
+        return cursor.rowcount
+    
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        
+        connection = sqlite3.connect(self.path, timeout=settings.SESSION_SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        # Deleting or purging a session removes its payload
+        connection.execute("PRAGMA foreign_keys=ON")
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions ("
+                "session_id TEXT PRIMARY KEY, data BLOB NOT NULL, "
+                "version INTEGER NOT NULL, payload_version INTEGER NOT NULL, last_activity REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS chat_session_payloads ("
+                "session_id TEXT PRIMARY KEY REFERENCES chat_sessions (session_id) ON DELETE CASCADE, "
+                "payload BLOB NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS chat_sessions_last_activity ON chat_sessions (last_activity)")
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+
+class RedisSessionStore(SessionStore):
+    """Sessions in Redis (or anything speaking its protocol), shared across nodes.
+    
+    Each session is a hash with its data, payload, their versions and the last
+    activity, and Redis expires it through the key's TTL, so ``purge`` has
+    nothing to do.
+    """
+    
+    name = "redis"
+    
+    def __init__(self, url: str, ttl: float, prefix: str = "session:"):
+        super().__init__(ttl)
+        self.client = RespClient(url)
+        self.prefix = prefix
+    
+    def get(self, session_id: str, known_version: int = 0, known_payload_version: int = 0) -> Optional[StoredSession]:
+        key = self._key(session_id)
+        version, payload_version, last_activity = self.client.command(
+            "HMGET", key, "version", "payload_version", "last_activity"
+        )
+        if version is None or payload_version is None:
+            return None
+        
+        version, payload_version, last_activity = int(version), int(payload_version), float(last_activity)
+        fields = [
+            field for field, known in (("data", version == known_version), ("payload", payload_version == known_payload_version))
+            if not known
+        ]
+        values = dict(zip(fields, self.client.command("HMGET", key, *fields))) if fields else {}
+        if any(value is None for value in values.values()):
+            return None
+        return StoredSession(values.get("data"), values.get("payload"), version, payload_version, last_activity)
+    
+    def put(
+        self,
+        session_id: str,
+        data: bytes,
+        last_activity: float,
+        payload: Optional[bytes] = None,
+        version: Optional[int] = None
+    ) -> Optional[Tuple[int, int]]:
+        key = self._key(session_id)
+        if version is not None:
+            # The transaction below is discarded if the key changes after WATCH
+            _, current = self.client.pipeline([("WATCH", key), ("HGET", key, "version")])
+            if current is None or int(current) != version:
+                self.client.command("UNWATCH")
+                if current is None:
+                    return None
+                raise SessionConflict(session_id)
+        
+        if payload is None or version is not None:
+            # Only an existing session gets new data: PEXPIRE fails on a missing key
+            fields = ("data", data, "last_activity", repr(last_activity)) + (("payload", payload) if payload is not None else ())
+            replies = self.client.pipeline([
+                ("MULTI",),
+                ("PEXPIRE", key, self._ttl_ms()),
+                ("HSET", key, *fields),
+                ("HINCRBY", key, "version", 1),
+                ("HINCRBY", key, "payload_version", int(payload is not None)),
+                ("EXEC",)
+            ])
+            if replies[-1] is None:
+                raise SessionConflict(session_id)
+            expired, _, new_version, payload_version = replies[-1]
+            if not expired:
+                self.client.command("DEL", key)
+                return None
+            return int(new_version), int(payload_version)
+        
+        replies = self.client.pipeline([
+            ("MULTI",),
+            ("HSET", key, "data", data, "payload", payload, "last_activity", repr(last_activity)),
+            ("HINCRBY", key, "version", 1),
+            ("HINCRBY", key, "payload_version", 1),
+            ("PEXPIRE", key, self._ttl_ms()),
+            ("EXEC",)
+        ])
+        return int(replies[-1][1]), int(replies[-1][2])
+    
+    def touch(self, session_id: str, last_activity: float) -> bool:
+        key = self._key(session_id)
+        if not self.client.command("PEXPIRE", key, self._ttl_ms()):
+            return False
+        self.client.command("HSET", key, "last_activity", repr(last_activity))
+        return True
+    
+    def delete(self, session_id: str) -> bool:
+        return self.client.command("DEL", self._key(session_id)) > 0
+    
+    def items(self) -> Iterator[Tuple[str, bytes, float]]:
+        cursor = b"0"
+        while True:
+            cursor, keys = self.client.command("SCAN", cursor, "MATCH", f"{self.prefix}*", "COUNT", 500)
+            if keys:
+                replies = self.client.pipeline([("HMGET", key, "data", "last_activity") for key in keys])
+                for key, (data, last_activity) in zip(keys, replies):
+                    if data is not None:
+                        yield key.decode("utf-8")[len(self.prefix):], data, float(last_activity)
+            if cursor in (b"0", 0):
+                return
+    
+    def purge(self, now: float, limit: Optional[int] = None) -> int:
+        return 0
+    
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+    
+    def _ttl_ms(self) -> int:
+        return max(int(self.ttl * 1000), 1)
+
+
+def create_session_store(backend: Optional[str] = None, ttl: Optional[float] = None) -> SessionStore:
+    """The store selected by SESSION_STORE: memory, sqlite or redis"""
+    backend = backend or settings.SESSION_STORE
+    ttl = ttl if ttl is not None else settings.SESSION_TIMEOUT
+    
+    if backend == "sqlite":
+        path = settings.SESSION_SQLITE_PATH or os.path.join(tempfile.gettempdir(), "openia-proxy-sessions.sqlite3")
+        return SQLiteSessionStore(path, ttl)
+    if backend == "redis":
+        return RedisSessionStore(settings.SESSION_REDIS_URL, ttl, settings.SESSION_REDIS_PREFIX)
+    if backend != "memory":
+        logger.error(f"Unknown SESSION_STORE {backend!r}, keeping sessions in memory")
+    return MemorySessionStore(ttl, settings.SESSION_STORE_MEMORY_BYTES)
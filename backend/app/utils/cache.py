@@ -0,0 +1,200 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from app.utils.metrics import metrics
+
+
+class MemoryLRU:
+    """In-process LRU cache of strings bounded by their total size in bytes"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+    
+    def delete(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+    
+    def put(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            
+            self._entries[key] = (value, size)
+            self.bytes += size
+            
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    """Directory of cache files shared by every worker process of the node.
+    
+    Files are written atomically and their modification time is refreshed on
+    every hit, so eviction removes the least recently used files first.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest())
+    
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data.decode("utf-8")
+    
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+    
+    def put(self, key: str, value: str):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(value.encode("utf-8"))
+        os.replace(tmp_path, path)
+        
+        # Puts only happen after a miss, which is far more expensive than this scan
+        self._evict()
+    
+    def _evict(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class TieredCache:
+    """Two-tier string cache: in-memory LRU in front of an optional on-disk tier.
+    
+    With a TTL, every value is stored with its expiry time and expired entries
+    are dropped from both tiers when they are read.
+    """
+    
+    def __init__(self, name: str, memory_bytes: int, disk_dir: str = "", disk_bytes: int = 0, ttl: float = 0):
+        self.name = name
+        self.ttl = ttl
+        self.memory = MemoryLRU(memory_bytes) if memory_bytes > 0 else None
+        self.disk = DiskCache(disk_dir, disk_bytes) if disk_dir and disk_bytes > 0 else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        
+        metrics.register_gauge(f"cache.{name}", self.stats)
+    
+    @staticmethod
+    def hash_key(*parts: Any) -> str:
+        """Build a key from the SHA-256 of the given bytes/strings"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        if self.memory is not None:
+            value = self._unwrap(self.memory, key, self.memory.get(key))
+            if value is not None:
+                self.memory_hits += 1
+                return value
+        
+        if self.disk is not None:
+            stored = self.disk.get(key)
+            value = self._unwrap(self.disk, key, stored)
+            if value is not None:
+                self.disk_hits += 1
+                if self.memory is not None:
+                    self.memory.put(key, stored)
+                return value
+        
+        self.misses += 1
+        return None
+    
+    def put(self, key: str, value: str):
+        if self.ttl > 0:
+            value = f"{time.time() + self.ttl:.3f}\n{value}"
+        
+        if self.memory is not None:
+            self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+    
+    def _unwrap(self, tier, key: str, stored: Optional[str]) -> Optional[str]:
+        """Value of a stored entry, or None if it is missing or has expired"""
+        if stored is None or self.ttl <= 0:
+            return stored
+        
+        expires_at, _, value = stored.partition("\n")
+        if float(expires_at) < time.time():
+            tier.delete(key)
+            self.expirations += 1
+            return None
+        return value
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes"""
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "memory_entries": len(self.memory) if self.memory is not None else 0,
+            "memory_bytes": self.memory.bytes if self.memory is not None else 0,
+            "memory_evictions": self.memory.evictions if self.memory is not None else 0,
+            "disk_evictions": self.disk.evictions if self.disk is not None else 0
+        }
@@ -0,0 +1,39 @@
+import importlib.util
+import zlib
+
+# Leading bytes of a zstd frame and of a zlib stream (32K window, any level)
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ZLIB_MAGIC = b"\x78"
+
+
+def zstd_available() -> bool:
+    """zstd needs the optional zstandard package (pip install zstandard)"""
+    return importlib.util.find_spec("zstandard") is not None
+
+
+def compress(data: bytes, codec: str = "auto", min_bytes: int = 0) -> bytes:
+    """Compress ``data`` with zstd or zlib ("auto" = zstd when installed, "none" = as is).
+    
+    Data under ``min_bytes``, or that does not shrink, is returned unchanged.
+    ``decompress`` tells the formats apart by their leading bytes, so the
+    data must not start with them itself, which holds for JSON objects.
+    """
+    if codec == "none" or len(data) < min_bytes:
+        return data
+    
+    if codec == "zstd" or (codec == "auto" and zstd_available()):
+        import zstandard
+        packed = zstandard.ZstdCompressor(level=3).compress(data)
+    else:
+        packed = zlib.compress(data, 6)
+    return packed if len(packed) < len(data) else data
+
+
+def decompress(data: bytes) -> bytes:
+    """Inverse of ``compress``: data that is not compressed is returned as is"""
+    if data.startswith(ZSTD_MAGIC):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    if data.startswith(ZLIB_MAGIC):
+        return zlib.decompress(data)
+    return data
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+from fastapi import HTTPException
+from app.core.config import settings
+from app.utils.metrics import metrics
+
+
+class BoundedExecutor:
+    """Thread pool with a bounded queue for work that must not run on the event loop.
+    
+    Calls beyond ``max_workers`` running plus ``max_queue`` waiting are rejected
+    with a 503 instead of piling up behind a slow stage.
+    """
+    
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+        
+        metrics.register_gauge(f"executor.{name}", self.stats)
+    
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a blocking callable in the pool and await its result"""
+        with self._lock:
+            if self.active + self.queued >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="El servidor está ocupado procesando otras solicitudes. Intente de nuevo en unos segundos."
+                )
+            self.queued += 1
+        
+        future = self._executor.submit(self._call, func, args, kwargs)
+        future.add_done_callback(self._release_cancelled)
+        return await asyncio.wrap_future(future)
+    
+    def _call(self, func: Callable, args: tuple, kwargs: dict) -> Any:
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+    
+    def _release_cancelled(self, future: Future):
+        # A call cancelled while still queued never reaches _call
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and saturation of the pool"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": self.active,
+                "queue_depth": self.queued,
+                "utilization": self.active / self.max_workers,
+                "saturation": (self.active + self.queued) / (self.max_workers + self.max_queue),
+                "completed": self.completed,
+                "rejected": self.rejected
+            }
+    
+    def shutdown(self):
+        """Stop accepting work and wait for running calls"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Executor for CPU-bound Excel parsing
+parse_executor = BoundedExecutor(
+    "parse",
+    max_workers=settings.PARSE_EXECUTOR_WORKERS,
+    max_queue=settings.PARSE_EXECUTOR_QUEUE
+)
@@ -0,0 +1,53 @@
+import threading
+from typing import Any, Callable, Dict
+
+
+class MetricsRegistry:
+    """In-process metrics of a worker: counters plus gauges read on demand"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._summaries: Dict[str, Dict[str, float]] = {}
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+    
+    def increment(self, name: str, value: float = 1):
+        """Increase a counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+    
+    def observe(self, name: str, value: float):
+        """Record a sample (e.g. a latency) in a count/sum/min/max summary"""
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = self._summaries[name] = {"count": 0, "sum": 0.0, "min": value, "max": value}
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["min"] = min(summary["min"], value)
+            summary["max"] = max(summary["max"], value)
+    
+    def register_gauge(self, name: str, read: Callable[[], Any]):
+        """Register a callable evaluated every time a snapshot is taken"""
+        with self._lock:
+            self._gauges[name] = read
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Current value of every metric"""
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = {
+                name: {**summary, "avg": summary["sum"] / summary["count"]}
+                for name, summary in self._summaries.items()
+            }
+            gauges = dict(self._gauges)
+        
+        return {
+            "counters": counters,
+            "summaries": summaries,
+            "gauges": {name: read() for name, read in gauges.items()}
+        }
+
+
+# Global metrics registry instance
+metrics = MetricsRegistry()
@@ -0,0 +1,123 @@
+import os
+import socket
+import threading
+from typing import Any, List, Optional, Sequence
+from urllib.parse import unquote, urlparse
+
+
+class RespError(Exception):
+    """Error reply of the server"""
+
+
+class RespClient:
+    """Minimal client of the Redis protocol (RESP2).
+    
+    Each process and thread gets its own connection, opened on first use, so
+    the client survives gunicorn's fork. A command that fails because the
+    connection dropped is retried once on a new connection.
+    """
+    
+    def __init__(self, url: str, timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.timeout = timeout
+        self._local = threading.local()
+    
+    def command(self, *args: Any) -> Any:
+        """Send one command and return its reply"""
+        return self.pipeline([args])[0]
+    
+    def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """Send several commands in one write and return their replies in order"""
+        payload = b"".join(_encode(args) for args in commands)
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection[0].sendall(payload)
+                # Read every reply before raising an error so the connection stays in sync
+                replies = [_read_reply_or_error(connection[1]) for _ in commands]
+                break
+            except (OSError, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+        
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+    
+    def close(self):
+        """Close this thread's connection"""
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+    
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = (sock, sock.makefile("rb"))
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        for args in setup:
+            sock.sendall(_encode(args))
+            _read_reply(connection[1])
+        return connection
+
+
+def _encode(args: Sequence[Any]) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(stream) -> Any:
+    line = stream.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by the server")
+    
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode("utf-8")
+    if kind == b"-":
+        raise RespError(rest.decode("utf-8"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        if len(data) < length + 2:
+            raise ConnectionError("Connection closed by the server")
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        return None if length < 0 else [_read_reply_or_error(stream) for _ in range(length)]
+    raise ConnectionError(f"Unexpected reply from the server: {line[:32]!r}")
+
+
+def _read_reply_or_error(stream) -> Optional[Any]:
+    """A reply, with error replies returned instead of raised"""
+    try:
+        return _read_reply(stream)
+    except RespError as e:
+        return e
@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+from app.utils.metrics import metrics
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one in-flight computation.
+    
+    The first caller starts the computation as a task; callers arriving while it
+    runs await the same task and share its result or exception. A caller that is
+    cancelled does not cancel the computation for the others.
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.started = 0
+        self.coalesced = 0
+        self._calls: Dict[str, asyncio.Task] = {}
+        
+        metrics.register_gauge(f"singleflight.{name}", self.stats)
+    
+    async def do(self, key: str, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Await func(*args, **kwargs), or the identical call already in flight"""
+        task = self._calls.get(key)
+        if task is None or task.done():
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        
+        return await asyncio.shield(task)
+    
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieve the exception so it is not reported when every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Computations started, callers coalesced onto them and calls in flight"""
+        return {
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls)
+        }
+
+
+# Concurrent parses of the same uploads and analyses of the same data
+parse_flight = SingleFlight("parse")
+analysis_flight = SingleFlight("analysis")
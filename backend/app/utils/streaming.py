@@ -0,0 +1,18 @@
+import json
+from typing import Any, Dict
+
+# Headers for streamed responses; X-Accel-Buffering stops nginx from buffering them
+STREAM_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format a server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def ndjson_event(event: str, data: Dict[str, Any]) -> str:
+    """Format an event as one line of newline-delimited JSON"""
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False, default=str) + "\n"
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark: ExcelProcessor.process_multiple_files, sequential vs process pool
+
+Prints the wall time and speedup for every combination of number of files
+and pool size, which gives the scaling curve against files and cores.
+
+Usage:
+    python -m benchmarks.bench_parallel_parsing --files 2 10 20 --workers 1 2 4
+"""
+
+import argparse
+import os
+import time
+from unittest.mock import patch
+
+from app.core.config import settings
+from app.services import excel_service
+from app.services.excel_service import ExcelProcessor
+from app.utils.cache import TieredCache
+from benchmarks.bench_row_formatting import build_ledger
+
+
+def run(files_data, pool_size: int) -> float:
+    """Time one batch with the given pool size (0 = sequential)"""
+    # Every run starts with a fresh pool, and the parent's extraction cache is disabled
+    with patch.object(settings, "EXCEL_PROCESS_POOL_SIZE", pool_size), \
+            patch.object(excel_service, "extraction_cache", TieredCache("bench", memory_bytes=0)):
+        # Pool start-up is paid once per gunicorn worker, not per request
+        excel_service.warm_up_process_pool()
+        try:
+            start = time.perf_counter()
+            ExcelProcessor().process_multiple_files(files_data)
+            return time.perf_counter() - start
+        finally:
+            excel_service.shutdown_process_pool()
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, nargs="+", default=[2, 5, 10, 20])
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, cpus}))
+    parser.add_argument("--rows", type=int, default=5000, help="Filas por archivo")
+    args = parser.parse_args()
+    
+    # Distinct files so that no upload is served from the extraction cache
+    contents = [build_ledger(args.rows, seed=i) for i in range(max(args.files))]
+    print(f"CPUs: {cpus}, filas por archivo: {args.rows}")
+    print(f"{'archivos':>8} {'procesos':>8} {'tiempo (s)':>11} {'speedup':>8}")
+    
+    for file_count in args.files:
+        files_data = [{'filename': f"libro_{i}.xlsx", 'content': contents[i]} for i in range(file_count)]
+        baseline = run(files_data, 0)
+        print(f"{file_count:>8} {'-':>8} {baseline:>11.3f} {1.0:>7.1f}x")
+        
+        for workers in args.workers:
+            elapsed = run(files_data, workers)
+            print(f"{file_count:>8} {workers:>8} {elapsed:>11.3f} {baseline / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
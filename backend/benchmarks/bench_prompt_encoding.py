@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark: prompt tokens and analysis quality of the rows vs compact encodings
+
+For sample double-entry ledgers with a few unbalanced entries injected, prints
+the tokens of the extracted text in each encoding and checks that every cell
+can be read back from both (fidelity). With --llm (needs OPENAI_API_KEY) it
+also runs the real analysis on both and reports how many of the injected
+entries each encoding lets the model find (recall).
+
+Usage:
+    python -m benchmarks.bench_prompt_encoding --rows 200 1000 5000
+    python -m benchmarks.bench_prompt_encoding --rows 200 --llm
+"""
+
+import argparse
+import io
+import re
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.services.ai.tokens import count_tokens, tokenizer_name
+from app.services.excel_service import ExcelProcessor
+
+ENCODINGS = ("rows", "compact")
+
+
+def build_journal(rows: int, errors: int, seed: int = 0) -> Tuple[pd.DataFrame, Set[int]]:
+    """Journal of two-line entries (debit, credit) with ``errors`` unbalanced entries"""
+    rng = np.random.default_rng(seed)
+    entries = rows // 2
+    amounts = rng.integers(100, 1_000_000, entries) / 100
+    accounts = rng.choice(["Caja", "Bancos", "Ventas", "Gastos", "IVA", "Proveedores"], (entries, 2))
+    wrong = set(rng.choice(entries, errors, replace=False).tolist()) if errors else set()
+    
+    records = []
+    for entry in range(entries):
+        credit = amounts[entry] + (rng.integers(1, 500) if entry in wrong else 0)
+        date = pd.Timestamp("2024-01-01") + pd.Timedelta(days=entry % 365)
+        records.append((date, entry + 1, accounts[entry][0], f"Asiento {entry + 1}", amounts[entry], np.nan))
+        records.append((date, entry + 1, accounts[entry][1], f"Asiento {entry + 1}", np.nan, credit))
+    
+    df = pd.DataFrame(records, columns=["Fecha", "Asiento", "Cuenta", "Concepto", "Debe", "Haber"])
+    return df, {entry + 1 for entry in wrong}
+
+
+def to_workbook(df: pd.DataFrame) -> bytes:
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False, sheet_name="Diario")
+    return buffer.getvalue()
+
+
+def read_back(text: str, encoding: str) -> Dict[int, List[str]]:
+    """Cells of each sheet row as they appear in the extracted text"""
+    rows = {}
+    for line in text.split("\n"):
+        if encoding == "rows":
+            match = re.match(r"Fila (\d+): (.*)", line)
+            if match:
+                rows[int(match.group(1))] = [cell.split(": ", 1)[1] for cell in match.group(2).split(" | ")]
+        elif re.match(r"\d+\|", line):
+            number, *cells = line.split("|")
+            rows[int(number)] = [cell for cell in cells if cell != ""]
+    return rows
+
+
+def same_value(expected, cell: str) -> bool:
+    if isinstance(expected, pd.Timestamp):
+        return cell.startswith(expected.strftime("%Y-%m-%d"))
+    if isinstance(expected, (int, float, np.integer, np.floating)):
+        try:
+            return abs(float(cell.replace(",", "")) - float(expected)) < 0.006
+        except ValueError:
+            return False
+    return cell == str(expected)
+
+
+def fidelity(df: pd.DataFrame, text: str, encoding: str) -> float:
+    """Share of the data cells whose value is found, in order, on its sheet row"""
+    rows = read_back(text, encoding)
+    found = total = 0
+    for position, values in enumerate(df.itertuples(index=False)):
+        # Sheet row 1 is the header, so data row 0 is sheet row 2
+        cells = rows.get(position + 2, [])
+        expected = [value for value in values if pd.notna(value)]
+        total += len(expected)
+        found += sum(1 for value, cell in zip(expected, cells) if same_value(value, cell))
+    return found / total
+
+
+def llm_recall(text: str, wrong: Set[int]) -> Tuple[float, int]:
+    """Share of the injected entries mentioned by the model's findings, and the findings count"""
+    from app.services.ai.openai_service import OpenAIService
+    
+    result = OpenAIService().analyze_accounting_data(text, use_cache=False)
+    reported = " ".join(
+        f"{finding.title} {finding.description} {finding.location}" for finding in result.findings
+    )
+    mentioned = {entry for entry in wrong if re.search(rf"\b{entry}\b", reported)}
+    return len(mentioned) / len(wrong) if wrong else 1.0, len(result.findings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[200, 1000, 5000])
+    parser.add_argument("--errors", type=int, default=5, help="unbalanced entries injected per ledger")
+    parser.add_argument("--llm", action="store_true", help="also run the real analysis (costs tokens)")
+    args = parser.parse_args()
+    
+    if args.llm and not settings.OPENAI_API_KEY:
+        raise SystemExit("--llm necesita OPENAI_API_KEY")
+    
+    processor = ExcelProcessor()
+    print(f"tokenizer: {tokenizer_name()}, modelo: {settings.OPENAI_MODEL}")
+    header = f"{'filas':>7} {'tokens rows':>12} {'tokens compact':>15} {'reducción':>10} {'fidelidad r/c':>14}"
+    print(header + (f" {'recall r/c':>11}" if args.llm else ""))
+    
+    for rows in args.rows:
+        df, wrong = build_journal(rows, args.errors, seed=rows)
+        content = to_workbook(df)
+        texts = {encoding: processor._extract(content, "diario.xlsx", encoding)[0] for encoding in ENCODINGS}
+        tokens = {encoding: count_tokens(text, settings.OPENAI_MODEL) for encoding, text in texts.items()}
+        kept = {encoding: fidelity(df, texts[encoding], encoding) for encoding in ENCODINGS}
+        
+        line = (
+            f"{rows:>7} {tokens['rows']:>12} {tokens['compact']:>15} "
+            f"{1 - tokens['compact'] / tokens['rows']:>9.1%} "
+            f"{kept['rows']:>6.1%}/{kept['compact']:.1%}"
+        )
+        if args.llm:
+            recall = {encoding: llm_recall(texts[encoding], wrong)[0] for encoding in ENCODINGS}
+            line += f" {recall['rows']:>5.0%}/{recall['compact']:.0%}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
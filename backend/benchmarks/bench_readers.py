@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark: parse throughput and peak memory of each spreadsheet reader backend
+
+Generates ledgers of several sizes as .xlsx and .csv (comma and semicolon
+with decimal comma) and reads them with every installed backend that reads
+the format. Each read runs in a fresh process so its peak RSS is not mixed
+with the others'. Existing .xls or .xlsb files, which pandas cannot write,
+can be added with --file.
+
+Usage:
+    python -m benchmarks.bench_readers --rows 10000 100000 --repeat 3
+    python -m benchmarks.bench_readers --file libro.xlsb
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import pandas as pd
+
+from app.services.readers import READERS
+from benchmarks.bench_row_formatting import build_ledger
+
+
+def memory_kb(field: str) -> int:
+    """A memory figure of this process from /proc/self/status (VmRSS, VmHWM), in KB"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise ValueError(field)
+
+
+def reset_peak() -> bool:
+    """Reset the peak RSS to the current one, where Linux allows it"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(reader_name: str, path: str) -> Tuple[float, int, float]:
+    """Read every sheet of a file in this process: (seconds, rows, peak RSS growth in MB)"""
+    reader = READERS[reader_name]()
+    # Without a resettable peak the growth over the start-up peak is reported
+    exact = reset_peak()
+    before = memory_kb("VmRSS") if exact else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    rows = 0
+    for _, frame in reader.read(path, path):
+        if isinstance(frame, Exception):
+            raise frame
+        rows += len(frame)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux
+    after = memory_kb("VmHWM") if exact else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, rows, max(after - before, 0) / 1024
+
+
+def run(reader_name: str, path: str, repeat: int) -> Tuple[float, int, float]:
+    """Best time and lowest peak of several reads, each in a new process"""
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results.append(pool.submit(measure, reader_name, path).result())
+    elapsed = min(result[0] for result in results)
+    return elapsed, results[0][1], min(result[2] for result in results)
+
+
+def write_inputs(rows: int, directory: str) -> List[str]:
+    """Write the same ledger as .xlsx, comma CSV and semicolon CSV"""
+    content = build_ledger(rows)
+    xlsx = os.path.join(directory, f"libro_{rows}.xlsx")
+    with open(xlsx, "wb") as f:
+        f.write(content)
+    
+    df = pd.read_excel(io.BytesIO(content))
+    comma = os.path.join(directory, f"libro_{rows}.csv")
+    df.to_csv(comma, index=False)
+    semicolon = os.path.join(directory, f"libro_{rows}_pyc.csv")
+    df.to_csv(semicolon, index=False, sep=";", decimal=",")
+    return [xlsx, comma, semicolon]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--file", nargs="*", default=[], help="Archivos existentes a leer además de los generados")
+    args = parser.parse_args()
+    
+    installed = [name for name, reader in READERS.items() if reader.available()]
+    missing = [name for name, reader in READERS.items() if not reader.available()]
+    print(f"Lectores instalados: {', '.join(installed)}")
+    if missing:
+        print(f"Lectores no instalados: {', '.join(missing)}")
+    print(f"{'archivo':>24} {'lector':>10} {'filas':>8} {'tiempo (s)':>11} {'filas/s':>11} {'pico (MB)':>10}")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [path for rows in args.rows for path in write_inputs(rows, directory)] + args.file
+        for path in paths:
+            extension = os.path.splitext(path)[1].lower()
+            for name in installed:
+                if extension not in READERS[name].extensions:
+                    continue
+                elapsed, rows, peak = run(name, path, args.repeat)
+                print(
+                    f"{os.path.basename(path):>24} {name:>10} {rows:>8} {elapsed:>11.3f} "
+                    f"{rows / elapsed:>11,.0f} {peak:>10.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
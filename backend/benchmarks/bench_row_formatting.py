@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark: row formatting of ExcelProcessor (iterrows vs column-wise)
+
+Usage:
+    python -m benchmarks.bench_row_formatting --rows 1000 10000 50000
+"""
+
+import argparse
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.services.excel_service import ExcelProcessor
+
+
+def iterrows_format(df: pd.DataFrame) -> list:
+    """Previous row formatting loop, kept as the baseline"""
+    rows = []
+    for idx, row in df.iterrows():
+        row_data = []
+        for col_idx, value in enumerate(row):
+            if pd.notna(value):
+                if isinstance(value, (int, float)):
+                    if isinstance(value, float) and value.is_integer():
+                        formatted_value = f"{int(value)}"
+                    else:
+                        formatted_value = f"{value:,.2f}"
+                else:
+                    formatted_value = str(value)
+                row_data.append(f"Col{col_idx+1}: {formatted_value}")
+        if row_data:
+            rows.append(f"Fila {idx+1}: {' | '.join(row_data)}")
+    return rows
+
+
+def build_ledger(rows: int, seed: int = 0) -> bytes:
+    """Build a synthetic ledger workbook with a header row and mixed columns"""
+    rng = np.random.default_rng(seed)
+    debit = rng.integers(0, 100000, rows) / 100
+    credit = np.where(rng.random(rows) < 0.1, np.nan, rng.integers(0, 100000, rows))
+    df = pd.DataFrame({
+        "Fecha": pd.date_range("2024-01-01", periods=rows, freq="h"),
+        "Cuenta": rng.choice(["Caja", "Bancos", "Ventas", "Gastos", "IVA"], rows),
+        "Descripcion": [f"Asiento {i}" for i in range(rows)],
+        "Debe": debit,
+        "Haber": credit,
+        "Centro": rng.integers(100, 999, rows),
+    })
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False, sheet_name="Diario")
+    return buffer.getvalue()
+
+
+def timed(func, *args, repeat: int = 3):
+    """Return the best wall time of several runs and the last result"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    
+    processor = ExcelProcessor()
+    print(f"{'filas':>8} {'iterrows (s)':>14} {'columnas (s)':>14} {'speedup':>9} {'extract (s)':>12}")
+    
+    for rows in args.rows:
+        content = build_ledger(rows)
+        df = pd.read_excel(io.BytesIO(content), header=None)
+        df = df.dropna(how='all').dropna(axis=1, how='all')
+        
+        baseline_time, baseline = timed(iterrows_format, df, repeat=args.repeat)
+        vectorized_time, vectorized = timed(processor._format_rows, df, repeat=args.repeat)
+        if baseline != vectorized:
+            raise SystemExit(f"Resultados distintos con {rows} filas")
+        
+        extract_time, _ = timed(processor._extract, content, "ledger.xlsx", repeat=1)
+        print(
+            f"{rows:>8} {baseline_time:>14.3f} {vectorized_time:>14.3f} "
+            f"{baseline_time / vectorized_time:>8.1f}x {extract_time:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark: create_session and get_session latency against the number of live sessions
+
+Fills a store with N sessions and times creating and reading sessions on top
+of them, then times the reaper expiring them all. With expiry kept off the
+request path the latencies stay flat as N grows.
+
+Usage:
+    python -m benchmarks.bench_sessions --sessions 1000 10000 100000 --stores memory sqlite
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from unittest.mock import patch
+
+from app.services.session_service import SessionReaper, SessionService
+from app.services.session_store import MemorySessionStore, SQLiteSessionStore
+
+ANALYSIS = {"summary": "Resumen del análisis", "findings": [{"title": "Total no cuadra", "description": "x" * 200}]}
+EXCEL_DATA = {"data": "Fila 1: Col1: Caja | Col2: 100\n" * 30, "files": ["libro.xlsx"]}
+
+
+def make_store(kind: str, directory: str, ttl: float):
+    if kind == "sqlite":
+        return SQLiteSessionStore(os.path.join(directory, f"sessions_{time.monotonic_ns()}.sqlite3"), ttl)
+    return MemorySessionStore(ttl)
+
+
+def percentiles(samples):
+    """Mean, p50 and p99 in microseconds"""
+    samples = sorted(samples)
+    return (
+        statistics.fmean(samples) * 1e6,
+        samples[len(samples) // 2] * 1e6,
+        samples[int(len(samples) * 0.99)] * 1e6
+    )
+
+
+def run(kind: str, sessions: int, operations: int, directory: str):
+    service = SessionService(make_store(kind, directory, ttl=3600))
+    ids = [service.create_session(ANALYSIS, EXCEL_DATA, ["libro.xlsx"]) for _ in range(sessions)]
+    
+    create = []
+    for _ in range(operations):
+        start = time.perf_counter()
+        ids.append(service.create_session(ANALYSIS, EXCEL_DATA, ["libro.xlsx"]))
+        create.append(time.perf_counter() - start)
+    
+    get = []
+    for session_id in random.sample(ids, operations):
+        start = time.perf_counter()
+        service.get_session(session_id)
+        get.append(time.perf_counter() - start)
+    
+    # Every session has expired two hours later
+    later = time.time() + 7200
+    start = time.perf_counter()
+    with patch("time.time", return_value=later):
+        removed = asyncio.run(SessionReaper(service, interval=60, batch=1000).reap())
+    reap = time.perf_counter() - start
+    assert removed == len(ids)
+    return percentiles(create), percentiles(get), reap
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--stores", nargs="+", default=["memory", "sqlite"], choices=["memory", "sqlite"])
+    parser.add_argument("--operations", type=int, default=2000, help="Sesiones creadas y leídas por medición")
+    args = parser.parse_args()
+    
+    print(f"{'almacén':>8} {'sesiones':>9} {'crear media/p50/p99 (µs)':>27} {'leer media/p50/p99 (µs)':>26} {'expirar todo (s)':>17}")
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in args.stores:
+            for sessions in args.sessions:
+                create, get, reap = run(kind, sessions, args.operations, directory)
+                print(
+                    f"{kind:>8} {sessions:>9} "
+                    f"{create[0]:>9.1f}/{create[1]:>7.1f}/{create[2]:>8.1f} "
+                    f"{get[0]:>9.1f}/{get[1]:>6.1f}/{get[2]:>8.1f} {reap:>17.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
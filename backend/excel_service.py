@@ -1,6 +1,7 @@
+import numpy as np
 import pandas as pd
 import openpyxl
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import io
 import os
 from fastapi import HTTPException
@@ -58,23 +59,8 @@ class ExcelProcessor:
                     # Convert to string representation
                     formatted_data.append("\nDatos:")
                     
-                    # Process each row with row numbers
-                    for idx, row in df.iterrows():
-                        row_data = []
-                        for col_idx, value in enumerate(row):
-                            if pd.notna(value):
-                                # Format numbers appropriately
-                                if isinstance(value, (int, float)):
-                                    if isinstance(value, float) and value.is_integer():
-                                        formatted_value = f"{int(value)}"
-                                    else:
-                                        formatted_value = f"{value:,.2f}"
-                                else:
-                                    formatted_value = str(value)
-                                row_data.append(f"Col{col_idx+1}: {formatted_value}")
-                        
-                        if row_data:
-                            formatted_data.append(f"Fila {idx+1}: {' | '.join(row_data)}")
+                    # Format rows column by column instead of iterating row objects
+                    formatted_data.extend(self._format_rows(df))
                     
                     # Add summary statistics for numeric columns
                     numeric_columns = df.select_dtypes(include=['number']).columns
@@ -102,6 +88,44 @@ class ExcelProcessor:
                 detail=f"Error al procesar el archivo Excel: {str(e)}"
             )
     
+    def _format_rows(self, df: pd.DataFrame) -> List[str]:
+        """Render every row as 'Fila N: ColK: v | ...' working one column at a time"""
+        columns = self._format_columns(df)
+        row_numbers = (df.index + 1).tolist()
+        
+        rows = []
+        for row_number, cells in zip(row_numbers, zip(*columns)):
+            row_data = [cell for cell in cells if cell is not None]
+            if row_data:
+                rows.append(f"Fila {row_number}: {' | '.join(row_data)}")
+        return rows
+    
+    def _format_columns(self, df: pd.DataFrame) -> List[List[Optional[str]]]:
+        """Format each column into 'ColK: v' cells, with None for empty cells.
+        
+        Values are formatted exactly as a row-wise ``iterrows`` walk would see
+        them, including the dtype the frame is interleaved to: in an all-numeric
+        frame with a float column, integer columns are upcast to float.
+        """
+        common_dtype = _interleaved_dtype(df.dtypes)
+        columns = []
+        
+        for position, (_, series) in enumerate(df.items()):
+            label = f"Col{position+1}: "
+            dtype = common_dtype if common_dtype is not None else series.dtype
+            
+            if isinstance(dtype, np.dtype) and dtype.kind == 'f':
+                columns.append(_format_float_column(series.to_numpy(dtype=np.float64), label))
+            elif isinstance(dtype, np.dtype) and dtype.kind in 'iub':
+                columns.append([f"{label}{value:,.2f}" for value in series.to_numpy().tolist()])
+            else:
+                columns.append([
+                    f"{label}{_format_value(value)}" if pd.notna(value) else None
+                    for value in series.tolist()
+                ])
+        
+        return columns
+    
     def process_multiple_files(self, files_data: List[Dict[str, Any]]) -> str:
         """Process multiple Excel files and combine their data"""
         all_data = []
@@ -118,4 +142,42 @@ class ExcelProcessor:
                 all_data.append(f"Error procesando {filename}: {str(e)}")
                 all_data.append("\n" + "="*80 + "\n")
         
-        return "\n".join(all_data) 
\ No newline at end of file
+        return "\n".join(all_data) 
+
+
+def _interleaved_dtype(dtypes: pd.Series) -> Optional[np.dtype]:
+    """Return the dtype pandas uses for ``df.values``, or None when it is object"""
+    if not all(isinstance(dtype, np.dtype) for dtype in dtypes):
+        return None
+    kinds = {dtype.kind for dtype in dtypes}
+    if kinds == {'b'}:
+        return np.dtype(bool)
+    if kinds <= {'i', 'u', 'f'}:
+        return np.result_type(*dtypes)
+    return None
+
+
+def _format_value(value: Any) -> str:
+    """Format a single non-empty cell value"""
+    # Format numbers appropriately
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and value.is_integer():
+            return f"{int(value)}"
+        return f"{value:,.2f}"
+    return str(value)
+
+
+def _format_float_column(values: np.ndarray, label: str) -> List[Optional[str]]:
+    """Format a float column, printing integral values without decimals"""
+    cells = np.full(len(values), None, dtype=object)
+    present = ~np.isnan(values)
+    integral = present & np.isfinite(values) & (values == np.trunc(values))
+    
+    # Integral values that fit in int64 are converted in a single numpy pass
+    fits = integral & (np.abs(values) < 2**63)
+    cells[fits] = [label + text for text in values[fits].astype(np.int64).astype(str).tolist()]
+    
+    remaining = present & ~fits
+    cells[remaining] = [f"{label}{_format_value(value)}" for value in values[remaining].tolist()]
+    
+    return cells.tolist()
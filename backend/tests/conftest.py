@@ -0,0 +1,36 @@
+"""
+Shared fixtures
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+from app.services.ai import openai_service, resilience
+from app.services.session_service import ParsedSessions, session_service
+from app.services.session_store import MemorySessionStore
+from app.utils.cache import TieredCache
+
+
+@pytest.fixture(autouse=True)
+def fresh_response_cache():
+    """Give every test an empty completion cache so responses never leak between tests"""
+    cache = TieredCache("openai-test", memory_bytes=1 << 20, ttl=60)
+    with patch.object(openai_service, "response_cache", cache):
+        yield cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_circuit_breaker():
+    """Start every test with a closed circuit"""
+    breaker = resilience.CircuitBreaker("openai-test", failure_threshold=5, recovery_timeout=30)
+    with patch.object(resilience, "openai_breaker", breaker):
+        yield breaker
+
+
+@pytest.fixture(autouse=True)
+def fresh_session_store():
+    """Keep each test's sessions in memory instead of the node's shared store"""
+    store = MemorySessionStore(ttl=3600)
+    with patch.object(session_service, "store", store), patch.object(session_service, "_parsed", ParsedSessions(1 << 24)):
+        yield store
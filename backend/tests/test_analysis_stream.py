@@ -0,0 +1,130 @@
+"""
+Tests for incremental analysis streaming
+"""
+
+import asyncio
+import io
+import json
+from unittest.mock import patch
+
+import httpx
+import pandas as pd
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.dependencies import get_ai_service
+from app.main import app
+from app.models.analysis import AnalysisResponse, Finding, Recommendation
+from app.services.ai import http_client
+from app.services.ai.openai_service import OpenAIService
+from app.services.ai.stream_parser import IncrementalAnalysisParser
+from app.services.session_service import session_service
+
+FINDING = {
+    "type": "error", "title": "Descuadre {1}", "description": "Debe \"≠\" haber [x]",
+    "location": "Hoja1!B2", "severity": "high", "suggested_fix": "Revisar"
+}
+RECOMMENDATION = {"title": "Conciliar", "description": "Mensual", "priority": "medium", "category": "process"}
+ANALYSIS = json.dumps({
+    "success": True,
+    "summary": "Un error",
+    "findings": [FINDING, dict(FINDING, title="Otro")],
+    "recommendations": [RECOMMENDATION]
+}, ensure_ascii=False)
+
+
+def test_parser_emits_items_at_any_split():
+    for size in (1, 3, 17):
+        parser = IncrementalAnalysisParser()
+        items = []
+        for start in range(0, len(ANALYSIS), size):
+            items.extend(parser.feed(ANALYSIS[start:start + size]))
+        
+        assert items == [
+            ("finding", FINDING),
+            ("finding", dict(FINDING, title="Otro")),
+            ("recommendation", RECOMMENDATION),
+        ]
+        assert parser.buffer == ANALYSIS
+
+
+def test_service_yields_items_before_result():
+    chunks = [
+        {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "m",
+         "choices": [{"index": 0, "delta": {"content": ANALYSIS[start:start + 20]}, "finish_reason": None}]}
+        for start in range(0, len(ANALYSIS), 20)
+    ]
+    body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+    )
+    
+    async def collect():
+        with patch.object(http_client, "_http_client", httpx.AsyncClient(transport=transport)):
+            return [item async for item in OpenAIService().stream_accounting_analysis("Fila 1: Col1: Caja")]
+    
+    with patch.object(settings, "OPENAI_API_KEY", "test"):
+        items = asyncio.run(collect())
+    
+    assert [kind for kind, _ in items] == ["finding", "finding", "recommendation", "result"]
+    result = items[-1][1]
+    assert result.summary == "Un error"
+    assert [finding.title for finding in result.findings] == ["Descuadre {1}", "Otro"]
+
+
+class StreamingAIService(OpenAIService):
+    def __init__(self):
+        self.model = settings.OPENAI_MODEL
+    
+    async def stream_accounting_analysis(self, excel_data, custom_prompt="", use_cache=True):
+        finding = Finding(**FINDING)
+        recommendation = Recommendation(**RECOMMENDATION)
+        yield "finding", finding
+        await asyncio.sleep(0)
+        yield "recommendation", recommendation
+        yield "result", AnalysisResponse(
+            success=True, summary="Un error", findings=[finding], recommendations=[recommendation]
+        )
+
+
+def build_workbook() -> bytes:
+    buffer = io.BytesIO()
+    pd.DataFrame({"Cuenta": ["Caja"], "Monto": [10]}).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def post_stream(stream_format: str):
+    app.dependency_overrides[get_ai_service] = lambda: StreamingAIService()
+    try:
+        return TestClient(app).post(
+            "/analyze/stream",
+            files={"files": ("libro.xlsx", build_workbook())},
+            data={"stream_format": stream_format}
+        )
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_endpoint_streams_ndjson_and_creates_session():
+    response = post_stream("ndjson")
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == ["finding", "recommendation", "summary"]
+    assert events[0]["data"]["title"] == "Descuadre {1}"
+    
+    summary = events[-1]["data"]
+    assert summary["summary"] == "Un error"
+    session = session_service.get_session(summary["session_id"])
+    assert session.file_names == ["libro.xlsx"]
+    assert session.analysis_result["findings"][0]["title"] == "Descuadre {1}"
+
+
+def test_endpoint_streams_sse_and_rejects_unknown_format():
+    response = post_stream("sse")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text.startswith("event: finding\n")
+    
+    assert post_stream("xml").status_code == 400
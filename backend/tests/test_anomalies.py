@@ -0,0 +1,82 @@
+"""
+Tests for the anomaly scoring that narrows large sheets to their suspicious rows
+"""
+
+import io
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.services.checks import CheckEngine, SheetData
+from app.services.checks.anomalies import score_rows
+from app.services.excel_service import ExcelProcessor
+
+
+def ledger(rows: int, seed: int = 7) -> pd.DataFrame:
+    """Amounts spread over several orders of magnitude, as Benford's law expects"""
+    rng = np.random.default_rng(seed)
+    amounts = np.round(10 ** rng.uniform(1, 5, rows) + rng.uniform(0, 1, rows), 2)
+    return pd.DataFrame({"Concepto": [f"Movimiento {i}" for i in range(rows)], "Importe": amounts})
+
+
+def as_sheet(frame: pd.DataFrame) -> SheetData:
+    raw = pd.DataFrame([frame.columns.tolist()] + frame.values.tolist())
+    return SheetData("libro.xlsx", "Mayor", raw)
+
+
+def test_injected_anomalies_score_highest():
+    frame = ledger(600)
+    frame.loc[100, "Importe"] = 9_000_000.0  # outlier
+    frame.loc[200, "Importe"] = 5000.0  # round amount
+    sheet = as_sheet(frame)
+    
+    scores, statistics = score_rows(sheet)
+    ranked = sheet.rows[np.argsort(-scores, kind="stable")].tolist()
+    
+    assert ranked[0] == 102  # data row 100 is sheet row 102, below the header
+    assert scores[200] > np.median(scores) + 0.4
+    assert "Importe: n=600" in statistics[0]
+    assert "Benford MAD=" in statistics[0]
+
+
+def test_benford_conformity_of_digit_distributions():
+    conforming = score_rows(as_sheet(ledger(2000)))[1][0]
+    rng = np.random.default_rng(3)
+    uniform = pd.DataFrame({"Concepto": ["x"] * 2000, "Importe": rng.integers(1, 10, 2000) * 111.0 + 0.5})
+    skewed = score_rows(as_sheet(uniform))[1][0]
+    
+    assert "(conformidad alta)" in conforming or "(aceptable)" in conforming
+    assert "(no conforme)" in skewed
+
+
+def test_small_sheets_are_not_scored():
+    with patch.object(settings, "ANOMALY_MIN_ROWS", 1000):
+        engine = CheckEngine(names=[])
+    _, sheet_check = engine.run(as_sheet(ledger(50)))
+    
+    assert sheet_check.sample == []
+
+
+def test_model_view_keeps_the_row_budget_and_statistics():
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        ledger(1500, seed=1).to_excel(writer, sheet_name="Mayor", index=False)
+        ledger(1200, seed=2).to_excel(writer, sheet_name="Caja", index=False)
+        ledger(20, seed=3).to_excel(writer, sheet_name="Notas", index=False)
+    content = buffer.getvalue()
+    
+    with patch.object(settings, "ANOMALY_MIN_ROWS", 1000), patch.object(settings, "ANOMALY_ROW_BUDGET", 50):
+        report = CheckEngine(names=[]).check_file(content, "libro.xlsx")
+        excel_data = ExcelProcessor(encoding="compact").extract_data_from_excel(content, "libro.xlsx")
+        view = report.model_view(excel_data)
+    
+    sheets = view.split("--- HOJA:")[1:]
+    row_lines = [[line for line in sheet.split("\n") if line[:1].isdigit()] for sheet in sheets]
+    
+    assert sum(len(lines) for lines in row_lines[:2]) == 50
+    assert len(row_lines[2]) == 20  # below the threshold, sent whole
+    assert view.count("Estadísticas agregadas de todas las filas:") == 2
+    assert "hoja de 1500 filas" in view
+    assert report.metadata()["sheets_sampled"] == 2
@@ -0,0 +1,62 @@
+"""
+Tests for the async OpenAI path and its shared connection pool
+"""
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+
+from app.core.config import settings
+from app.services.ai import http_client
+from app.services.ai.openai_service import OpenAIService
+
+
+def completion_payload(content: str) -> dict:
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    }
+
+
+def test_concurrent_calls_share_one_pool():
+    in_flight = 0
+    peak = 0
+    
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        
+        prompt = json.loads(request.content)["messages"][0]["content"]
+        if "DATOS DEL ARCHIVO" in prompt:
+            content = json.dumps({"success": True, "findings": [], "recommendations": [], "summary": "Sin errores"})
+        else:
+            content = "Respuesta del chat"
+        return httpx.Response(200, json=completion_payload(content))
+    
+    async def scenario():
+        shared = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with patch.object(http_client, "_http_client", shared):
+            service = OpenAIService()
+            results = await asyncio.gather(
+                *(service.analyze_accounting_data_async("Fila 1: Col1: Caja") for _ in range(50)),
+                service.chat_with_context_async("contexto", "¿Cuadra?")
+            )
+            assert service.async_client is service.async_client
+            await http_client.close_http_client()
+        return results
+    
+    with patch.object(settings, "OPENAI_API_KEY", "test"):
+        results = asyncio.run(scenario())
+    
+    assert all(result.summary == "Sin errores" for result in results[:-1])
+    assert results[-1] == "Respuesta del chat"
+    assert peak == 51
+    assert http_client._http_client is None
@@ -0,0 +1,80 @@
+"""
+Tests for the tiered cache and the extraction cache of ExcelProcessor
+"""
+
+import io
+from unittest.mock import patch
+
+import pandas as pd
+
+from app.services import excel_service
+from app.services.excel_service import ExcelProcessor
+from app.utils.cache import MemoryLRU, TieredCache
+
+
+def test_memory_tier_evicts_least_recently_used_by_size():
+    cache = MemoryLRU(max_bytes=10)
+    cache.put("a", "1234")
+    cache.put("b", "5678")
+    assert cache.get("a") == "1234"
+    cache.put("c", "90ab")
+    
+    assert cache.get("b") is None
+    assert cache.get("a") == "1234"
+    assert cache.bytes == 8
+    assert cache.evictions == 1
+
+
+def test_disk_tier_is_shared_between_workers(tmp_path):
+    worker_a = TieredCache("worker_a", memory_bytes=1024, disk_dir=str(tmp_path), disk_bytes=1024)
+    worker_b = TieredCache("worker_b", memory_bytes=1024, disk_dir=str(tmp_path), disk_bytes=1024)
+    
+    assert worker_b.get("clave") is None
+    worker_a.put("clave", "datos extraídos")
+    assert worker_b.get("clave") == "datos extraídos"
+    assert worker_b.get("clave") == "datos extraídos"
+    
+    assert worker_b.stats()["misses"] == 1
+    assert worker_b.stats()["disk_hits"] == 1
+    assert worker_b.stats()["memory_hits"] == 1
+
+
+def test_disk_tier_size_eviction(tmp_path):
+    cache = TieredCache("disk_only", memory_bytes=0, disk_dir=str(tmp_path), disk_bytes=10)
+    cache.put("a", "123456")
+    cache.put("b", "789012")
+    
+    assert cache.stats()["disk_evictions"] == 1
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_ttl_expires_entries_in_both_tiers(tmp_path):
+    cache = TieredCache("ttl", memory_bytes=1024, disk_dir=str(tmp_path), disk_bytes=1024, ttl=60)
+    with patch("app.utils.cache.time.time", return_value=1000.0):
+        cache.put("clave", "respuesta")
+    
+    with patch("app.utils.cache.time.time", return_value=1059.0):
+        assert cache.get("clave") == "respuesta"
+    with patch("app.utils.cache.time.time", return_value=1061.0):
+        assert cache.get("clave") is None
+    
+    assert cache.stats()["expirations"] == 2
+    assert len(cache.memory) == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_identical_upload_skips_parsing():
+    buffer = io.BytesIO()
+    pd.DataFrame({"Cuenta": ["Caja"], "Monto": [10]}).to_excel(buffer, index=False)
+    content = buffer.getvalue()
+    processor = ExcelProcessor()
+    cache = TieredCache("excel_test", memory_bytes=1024 * 1024)
+    
+    with patch.object(excel_service, "extraction_cache", cache):
+        first = processor.extract_data_from_excel(content, "enero.xlsx")
+        with patch.object(processor, "_extract") as extract:
+            second = processor.extract_data_from_excel(content, "copia.xlsx")
+        extract.assert_not_called()
+    
+    assert second == first.replace("enero.xlsx", "copia.xlsx")
+    assert cache.stats()["memory_hits"] == 1
@@ -0,0 +1,112 @@
+"""
+Tests for the chat endpoints, plain and server-sent events
+"""
+
+import asyncio
+import json
+from typing import Optional
+from unittest.mock import patch
+
+import httpx
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.dependencies import get_ai_service
+from app.main import app
+from app.services.ai import http_client
+from app.services.ai.openai_service import OpenAIService
+from app.services.session_service import session_service
+from app.utils.metrics import metrics
+
+
+class StreamingAIService:
+    async def stream_chat_with_context(self, conversation_context, user_message):
+        for delta in ["El ", "asiento ", "cuadra."]:
+            await asyncio.sleep(0)
+            yield delta
+
+
+class ExpiringAIService:
+    """Answers after the session ``expired`` has been removed, if any"""
+    
+    def __init__(self, expired: Optional[str] = None):
+        self.expired = expired
+    
+    async def chat_with_context_async(self, conversation_context, user_message):
+        if self.expired:
+            session_service.delete_session(self.expired)
+        return "El asiento cuadra."
+
+
+def parse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_forwards_tokens_and_commits_message():
+    session_id = session_service.create_session({"summary": "Sin errores", "findings": []}, {}, ["libro.xlsx"])
+    app.dependency_overrides[get_ai_service] = lambda: StreamingAIService()
+    try:
+        response = TestClient(app).post("/chat/stream", json={"session_id": session_id, "message": "¿Cuadra?"})
+    finally:
+        app.dependency_overrides.clear()
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_events(response.text)
+    assert [data["content"] for event, data in events if event == "delta"] == ["El ", "asiento ", "cuadra."]
+    assert events[-1] == ("done", {"session_id": session_id, "response": "El asiento cuadra."})
+    
+    history = session_service.get_session(session_id).conversation_history
+    assert [(msg.role, msg.content) for msg in history] == [("user", "¿Cuadra?"), ("assistant", "El asiento cuadra.")]
+    assert metrics.snapshot()["summaries"]["chat.time_to_first_token_seconds"]["count"] >= 1
+
+
+def test_stream_unknown_session():
+    app.dependency_overrides[get_ai_service] = lambda: StreamingAIService()
+    try:
+        response = TestClient(app).post("/chat/stream", json={"session_id": "no-existe", "message": "Hola"})
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 404
+
+
+def test_chat_returns_the_history_it_wrote():
+    session_id = session_service.create_session({"summary": "Sin errores", "findings": []}, {}, ["libro.xlsx"])
+    try:
+        app.dependency_overrides[get_ai_service] = lambda: ExpiringAIService()
+        with patch.object(session_service, "get_session", wraps=session_service.get_session) as get_session:
+            response = TestClient(app).post("/chat/", json={"session_id": session_id, "message": "¿Cuadra?"})
+        assert response.status_code == 200
+        assert [message["content"] for message in response.json()["conversation_history"]] == ["¿Cuadra?", "El asiento cuadra."]
+        # The response has the history just written, without reading the session again
+        assert get_session.call_count == 1
+        
+        # A session that expires while the model answers is reported as gone
+        app.dependency_overrides[get_ai_service] = lambda: ExpiringAIService(session_id)
+        response = TestClient(app).post("/chat/", json={"session_id": session_id, "message": "¿Sigue?"})
+        assert response.status_code == 404
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_service_yields_openai_stream_deltas():
+    chunks = [
+        {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "m",
+         "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+        for text in ["Hola", " mundo"]
+    ]
+    body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+    )
+    
+    async def collect():
+        with patch.object(http_client, "_http_client", httpx.AsyncClient(transport=transport)):
+            return [delta async for delta in OpenAIService().stream_chat_with_context("contexto", "hola")]
+    
+    with patch.object(settings, "OPENAI_API_KEY", "test"):
+        assert asyncio.run(collect()) == ["Hola", " mundo"]
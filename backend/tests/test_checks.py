@@ -0,0 +1,314 @@
+"""
+Tests for the deterministic accounting checks and how they narrow the analysis
+"""
+
+import io
+import uuid
+from typing import List
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+
+from app.api.endpoints import analysis
+from app.core.config import settings
+from app.dependencies import get_ai_service
+from app.main import app
+from app.models.analysis import AnalysisResponse, Finding
+from app.services.ai.chunking import focus_excel_data
+from app.services.ai.openai_service import OpenAIService
+from app.services.checks import Check, CheckEngine, SheetData, register_check
+from app.services.checks.base import CHECKS
+from app.services import excel_service
+from app.services.excel_service import ExcelProcessor
+
+
+def sheet_frame(rows: List[list]) -> pd.DataFrame:
+    """A sheet as ExcelProcessor reads it: no header, one frame row per sheet row"""
+    return pd.DataFrame(rows).dropna(how='all').dropna(axis=1, how='all')
+
+
+def run_checks(rows: List[list], names=None):
+    engine = CheckEngine(names=names, tolerance=0.01, max_findings=20)
+    return engine.run(SheetData("libro.xlsx", "Diario", sheet_frame(rows)))
+
+
+JOURNAL = [
+    ["Asiento", "Cuenta", "Debe", "Haber"],
+    [1, "Caja", 100.0, None],
+    [None, "Ventas", None, 100.0],
+    [2, "Gastos", 50.0, None],
+    [None, "Caja", None, 50.0],
+    [3, "Bancos", 30.0, None],
+    [None, "Caja", None, 30.0],
+]
+
+
+def test_balanced_journal_is_verified():
+    findings, sheet = run_checks(JOURNAL)
+    
+    assert findings == []
+    assert sheet.covered
+    assert sheet.rows == []
+    assert "journal_balance" in sheet.checks
+
+
+def test_unbalanced_entry_flags_all_its_rows():
+    rows = [row[:] for row in JOURNAL]
+    rows[4][3] = 45.0
+    findings, sheet = run_checks(rows)
+    
+    assert len(findings) == 1
+    assert findings[0].title == "Asiento 2 descuadrado"
+    assert (findings[0].sheet, findings[0].row) == ("Diario", 4)
+    assert "diferencia 5.00" in findings[0].description
+    assert sheet.rows == [1, 4, 5]  # header plus both lines of the entry
+
+
+def test_lines_before_the_first_entry_are_checked():
+    rows = [["Asiento", "Cuenta", "Debe", "Haber"], [None, "Caja", 500.0, None], [None, "Ventas", None, 10.0], *JOURNAL[1:]]
+    findings, sheet = run_checks(rows)
+    
+    assert [finding.title for finding in findings] == ["Líneas sin número de asiento descuadradas"]
+    assert findings[0].row == 2
+    assert "diferencia 490.00" in findings[0].description
+    assert sheet.rows == [1, 2, 3]
+
+
+def test_journal_without_entry_column_is_checked_as_a_whole():
+    findings, sheet = run_checks([["Cuenta", "Débito", "Crédito"], ["Caja", 10, None], ["Ventas", None, 9]])
+    
+    assert len(findings) == 1
+    assert findings[0].row is None
+    assert sheet.whole_sheet
+
+
+def test_running_balance():
+    rows = [
+        ["Fecha", "Concepto", "Cargo", "Abono", "Saldo"],
+        ["2024-01-01", "Apertura", None, None, 1000],
+        ["2024-01-02", "Pago", 200, None, 800],
+        ["2024-01-03", "Depósito", None, 500, 1300],
+        ["2024-01-04", "Pago", 100, None, 1250],
+    ]
+    findings, sheet = run_checks(rows, names=["running_balance"])
+    
+    assert sheet.covered
+    assert [finding.row for finding in findings] == [5]
+    assert "1,200.00" in findings[0].description
+
+
+def test_stated_totals_and_grand_total():
+    rows = [
+        ["Concepto", "Importe"],
+        ["Venta A", 100],
+        ["Venta B", 50],
+        ["Subtotal", 150],
+        ["Venta C", 25],
+        ["Subtotal", 30],
+        ["Total general", 175],
+    ]
+    findings, sheet = run_checks(rows, names=["stated_totals"])
+    
+    assert [finding.row for finding in findings] == [6]
+    assert "suman 25.00" in findings[0].description
+    assert not sheet.covered
+
+
+def test_duplicate_rows_and_negative_amounts():
+    rows = [
+        ["Asiento", "Cuenta", "Debe", "Haber"],
+        [1, "Caja", 100, None],
+        [1, "Ventas", None, 100],
+        [1, "Caja", 100, None],
+        [1, "Ventas", None, 100],
+        [2, "Caja", -20, None],
+        [2, "Ventas", None, -20],
+    ]
+    findings, _ = run_checks(rows, names=["duplicate_rows", "negative_amounts"])
+    
+    duplicates = [finding for finding in findings if finding.title == "Fila duplicada"]
+    negatives = [finding for finding in findings if finding.title == "Importe negativo"]
+    assert [finding.row for finding in duplicates] == [4, 5]
+    assert "repite exactamente la fila 2" in duplicates[0].description
+    assert [finding.row for finding in negatives] == [6, 7]
+
+
+def test_plugin_checks_register_and_run():
+    @register_check
+    class LargeAmountsCheck(Check):
+        name = "test_large_amounts"
+        
+        def run(self, sheet: SheetData) -> List[Finding]:
+            rows = sheet.rows[np.nanmax(np.nan_to_num(sheet.values), axis=1) > 75]
+            return [
+                sheet.finding(row, type="info", title="Importe alto", description="", severity="low", suggested_fix="")
+                for row in rows.tolist()
+            ]
+    
+    try:
+        findings, sheet = run_checks(JOURNAL, names=["test_large_amounts"])
+    finally:
+        CHECKS.pop("test_large_amounts")
+    
+    assert [finding.row for finding in findings] == [2, 3]
+    assert sheet.checks == ["test_large_amounts"]
+
+
+def test_focus_keeps_flagged_rows_of_verified_sheets():
+    excel_data = "\n".join([
+        "=== ANÁLISIS DE ARCHIVO: libro.xlsx ===",
+        "",
+        "--- HOJA: Diario ---",
+        "Dimensiones: 4 filas x 2 columnas",
+        "Columnas: Fila|Cuenta|Debe",
+        "1|Cuenta|Debe",
+        "2|Caja|100",
+        "3|Ventas|50",
+        "Resumen estadístico para columnas numéricas:",
+        "--- HOJA: Notas ---",
+        "Fila 1: Col1: texto",
+        "--- HOJA: Mayor ---",
+        "Fila 1: Col1: Caja",
+    ])
+    
+    focused = focus_excel_data(excel_data, {("libro.xlsx", "Diario"): {1, 3}, ("libro.xlsx", "Mayor"): set()})
+    
+    assert "3|Ventas|50" in focused and "2|Caja|100" not in focused
+    assert "Resumen estadístico" in focused and "Dimensiones: 4 filas" in focused
+    assert "Fila 1: Col1: texto" in focused  # not verified, kept whole
+    assert "Fila 1: Col1: Caja" not in focused
+    assert focused.count("Nota:") == 2
+
+
+class RecordingAIService(OpenAIService):
+    def __init__(self):
+        self.model = "gpt-4o-mini"
+        self.calls = []
+    
+    def estimate_analysis(self, excel_data, custom_prompt=""):
+        return super().estimate_analysis(excel_data, custom_prompt)
+    
+    async def analyze_accounting_data_async(self, excel_data, custom_prompt="", use_cache=True):
+        self.calls.append((excel_data, custom_prompt))
+        return AnalysisResponse(
+            success=True,
+            summary="Revisado",
+            findings=[Finding(type="info", title="Causa probable", description="", location="", severity="low", suggested_fix="")],
+            recommendations=[],
+            metadata={"provider": "openai"}
+        )
+
+
+def build_workbook(rows: List[list]) -> bytes:
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        pd.DataFrame(rows).to_excel(writer, sheet_name="Diario", index=False, header=False)
+    return buffer.getvalue()
+
+
+def analyze(rows: List[list], ai_svc: RecordingAIService):
+    app.dependency_overrides[get_ai_service] = lambda: ai_svc
+    try:
+        return TestClient(app).post("/analyze/", files={"files": ("libro.xlsx", build_workbook(rows))})
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_settled_analysis_skips_the_model():
+    ai_svc = RecordingAIService()
+    response = analyze(JOURNAL, ai_svc)
+    
+    assert response.status_code == 200
+    assert ai_svc.calls == []
+    assert response.json()["metadata"]["settled_locally"] is True
+    assert response.json()["session_id"]
+
+
+def test_model_sees_only_flagged_rows_and_findings_are_merged():
+    rows = [row[:] for row in JOURNAL]
+    rows[4][3] = 45.0
+    ai_svc = RecordingAIService()
+    response = analyze(rows, ai_svc)
+    
+    assert response.status_code == 200
+    [(excel_data, prompt)] = ai_svc.calls
+    assert "Fila 4:" in excel_data and "Fila 5:" in excel_data
+    assert "Fila 2:" not in excel_data and "Fila 6:" not in excel_data
+    assert "VERIFICACIÓN LOCAL" in prompt and "Asiento 2" not in excel_data.split("Nota:")[0]
+    
+    body = response.json()
+    assert [finding["title"] for finding in body["findings"]] == ["Asiento 2 descuadrado", "Causa probable"]
+    assert body["findings"][0]["row"] == 4
+    assert body["metadata"]["local_findings"] == 1
+
+
+def test_read_sheets_matches_extracted_rows():
+    content = build_workbook(JOURNAL)
+    [(name, frame)] = list(ExcelProcessor().read_sheets(content, "libro.xlsx"))
+    text = ExcelProcessor(encoding="rows").extract_data_from_excel(content, "libro.xlsx")
+    
+    assert name == "Diario"
+    assert all(f"Fila {row}:" in text for row in (frame.index + 1))
+
+
+def test_extraction_and_checks_read_each_file_once():
+    rows = [row[:] for row in JOURNAL] + [[4, str(uuid.uuid4()), 1.0, 1.0]]
+    files = [{"filename": name, "content": build_workbook(rows)} for name in ("enero.xlsx", "febrero.xlsx")]
+    read_sheets = ExcelProcessor.read_sheets
+    reads = []
+    
+    def counting_read(self, file_content, filename):
+        reads.append(filename)
+        return read_sheets(self, file_content, filename)
+    
+    with patch.object(ExcelProcessor, "read_sheets", counting_read):
+        excel_data, report = analysis._extract_and_check(files[:1], "rows")
+        assert reads == ["enero.xlsx"]
+        assert "Fila 2:" in excel_data and report.sheets[0].covered
+        
+        reads.clear()
+        with patch("app.services.excel_service.get_process_pool", return_value=None):
+            excel_data, report = analysis._extract_and_check(files, "compact")
+        assert reads == ["enero.xlsx", "febrero.xlsx"]
+        assert [sheet.file for sheet in report.sheets] == ["enero.xlsx", "febrero.xlsx"]
+
+
+def test_pooled_files_are_checked_where_they_are_parsed():
+    rows = [row[:] for row in JOURNAL] + [[4, str(uuid.uuid4()), 1.0, 1.0]]
+    unbalanced = [row[:] for row in rows]
+    unbalanced[4][3] = 45.0
+    files = [
+        {"filename": "enero.xlsx", "content": build_workbook(rows)},
+        {"filename": "roto.xlsx", "content": b"no es un excel"},
+        {"filename": "febrero.xlsx", "content": build_workbook(unbalanced)},
+    ]
+    
+    with patch.object(settings, "EXCEL_PROCESS_POOL_SIZE", 2):
+        try:
+            excel_service.warm_up_process_pool()
+            with patch.object(ExcelProcessor, "read_sheets", side_effect=AssertionError("read in the server")):
+                excel_data, report = analysis._extract_and_check(files, "rows")
+        finally:
+            excel_service.shutdown_process_pool()
+    
+    assert "Error procesando roto.xlsx" in excel_data
+    assert [sheet.file for sheet in report.sheets] == ["enero.xlsx", "febrero.xlsx"]
+    assert [finding.title for finding in report.findings] == ["Asiento 2 descuadrado"]
+    # The file that could not be read leaves the report incomplete
+    assert not report.complete
+
+
+def test_streamed_files_are_not_loaded_for_the_checks():
+    content = build_workbook(JOURNAL)
+    engine = CheckEngine()
+    engine.processor.ingestion_mode = "streaming"
+    
+    with patch.object(ExcelProcessor, "read_sheets", side_effect=AssertionError("loaded whole")):
+        report = engine.check_file(content, "libro.xlsx")
+    assert not report.complete and not report.sheets
+    
+    # Sheets the extraction already read are still checked
+    report = engine.check_file(content, "libro.xlsx", list(ExcelProcessor().read_sheets(content, "libro.xlsx")))
+    assert report.complete and report.sheets[0].covered
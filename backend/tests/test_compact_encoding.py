@@ -0,0 +1,82 @@
+"""
+Tests for the compact tabular prompt encoding
+"""
+
+import io
+
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+
+from app.services.ai.chunking import split_excel_data
+from app.services.excel_service import ExcelProcessor
+
+
+def build_workbook(df: pd.DataFrame, header: bool = True) -> bytes:
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False, header=header, sheet_name="Diario")
+    return buffer.getvalue()
+
+
+LEDGER = pd.DataFrame({
+    "Fecha": pd.to_datetime(["2024-01-31", "2024-02-29", "2024-03-31"]),
+    "Cuenta": ["Caja | chica", "Bancos", None],
+    "Debe": [100, 2500.5, 3],
+    "Haber": [None, 50, 7.0],
+})
+
+
+def test_header_row_becomes_one_column_line():
+    text = ExcelProcessor().extract_data_from_excel(build_workbook(LEDGER), "diario.xlsx", "compact")
+    lines = text.split("\n")
+    
+    assert "Dimensiones: 3 filas x 4 columnas" in lines
+    assert "Columnas: Fila|Fecha|Cuenta|Debe|Haber" in lines
+    # One number format per column, dates without midnight times, delimiter escaped
+    assert "2|2024-01-31|Caja / chica|100.00|" in lines
+    assert "3|2024-02-29|Bancos|2500.50|50" in lines
+    assert "4|2024-03-31||3.00|7" in lines
+    assert "  Debe: Suma=2603.50, Promedio=867.83, Min=3.00, Max=2500.50" in lines
+    assert "Col1:" not in text
+
+
+def test_without_header_columns_keep_positional_names():
+    df = pd.DataFrame([[1, 2.5], [3, 4.25]])
+    text = ExcelProcessor(encoding="compact").extract_data_from_excel(build_workbook(df, header=False), "montos.xlsx")
+    
+    assert "Columnas: Fila|Col1|Col2" in text
+    assert "1|1|2.50" in text
+    assert "2|3|4.25" in text
+
+
+def test_compact_is_shorter_and_cached_separately():
+    rows = pd.DataFrame({
+        "Cuenta": ["Caja", "Bancos", "Ventas"] * 100,
+        "Debe": range(300),
+        "Haber": [1.5] * 300,
+    })
+    content = build_workbook(rows)
+    processor = ExcelProcessor()
+    
+    verbose = processor.extract_data_from_excel(content, "libro.xlsx", "rows")
+    compact = processor.extract_data_from_excel(content, "libro.xlsx", "compact")
+    
+    assert "Fila 2: Col1: Caja" in verbose
+    assert len(compact) < len(verbose) / 2
+    assert processor.cache_key(content, "libro.xlsx", "rows") != processor.cache_key(content, "libro.xlsx", "compact")
+
+
+def test_chunks_repeat_the_column_line():
+    rows = pd.DataFrame({"Cuenta": [f"Cuenta {i}" for i in range(200)], "Debe": range(200)})
+    text = ExcelProcessor().extract_data_from_excel(build_workbook(rows), "libro.xlsx", "compact")
+    
+    chunks = split_excel_data(text, 300)
+    assert len(chunks) > 1
+    assert all("Columnas: Fila|Cuenta|Debe" in chunk for chunk in chunks)
+
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        ExcelProcessor().validate_encoding("xml")
+    assert error.value.status_code == 400
+    assert ExcelProcessor().validate_encoding(None) == "rows"
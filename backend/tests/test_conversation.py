@@ -0,0 +1,178 @@
+"""
+Tests for the incremental chat context of a session
+"""
+
+import asyncio
+from unittest.mock import patch
+
+from app.core.config import settings
+from app.services.ai.openai_service import CHAT_INSTRUCTIONS, OpenAIService
+from app.services.conversation import ConversationContext
+from app.services.session_service import ConversationCompactor, SessionService, session_service
+from app.utils.metrics import metrics
+
+ANALYSIS = {
+    "summary": "El balance no cuadra",
+    "findings": [{"title": f"Hallazgo {i}", "description": "Diferencia"} for i in range(7)],
+    "recommendations": [{"title": "Revisar", "description": "Conciliar la caja"}]
+}
+
+
+class SummarizingAIService:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls = []
+    
+    async def summarize_conversation_async(self, summary, messages):
+        self.calls.append((summary, [message["content"] for message in messages]))
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("sin conexión")
+        return f"{summary} Resumen de {len(messages)} mensajes.".strip()
+
+
+def chat(session_id: str, turns: int):
+    """Messages sent to the model on each of ``turns`` turns"""
+    sent = []
+    for turn in range(turns):
+        context = session_service.context(session_service.get_session(session_id))
+        sent.append(context.messages(CHAT_INSTRUCTIONS, f"Pregunta {turn}"))
+        session_service.add_message_to_session(session_id, f"Pregunta {turn}", f"Respuesta {turn}")
+    return sent
+
+
+def test_consecutive_turns_share_their_prefix():
+    session_id = session_service.create_session(ANALYSIS, {}, ["libro.xlsx"])
+    with patch.object(settings, "CHAT_HISTORY_MESSAGES", 4):
+        sent = chat(session_id, 12)
+    
+    jumps = 0
+    for previous, current in zip(sent, sent[1:]):
+        assert current[0] == previous[0]
+        if current[:len(previous) - 1] != previous[:-1]:
+            jumps += 1
+        # The history never grows past twice the window
+        assert len(current) - 2 <= 8
+    # The start of the history moves a window at a time, not on every turn
+    assert 0 < jumps <= 4
+    assert "... y 2 hallazgos más." in sent[0][0]["content"]
+
+
+def test_incremental_context_matches_a_rebuild():
+    session_id = session_service.create_session(ANALYSIS, {}, ["libro.xlsx"])
+    with patch.object(settings, "CHAT_HISTORY_MESSAGES", 3):
+        chat(session_id, 9)
+        session = session_service.get_session(session_id)
+        rebuilt = ConversationContext(session)
+    
+    incremental = session_service.context(session)
+    assert incremental.recent() == rebuilt.recent()
+    assert incremental.text() == rebuilt.text()
+    assert incremental.recent()[0]["role"] == "user"
+    assert session_service.get_conversation_context(session_id) == rebuilt.text()
+
+
+def test_new_analysis_only_re_renders_the_analysis():
+    session_id = session_service.create_session(ANALYSIS, {}, ["libro.xlsx"])
+    chat(session_id, 2)
+    context = session_service.context(session_service.get_session(session_id))
+    history = context.recent()
+    
+    with patch("app.services.conversation.count_tokens", side_effect=AssertionError("history re-rendered")):
+        assert session_service.update_analysis(session_id, {"summary": "Ahora cuadra"})
+        updated = session_service.context(session_service.get_session(session_id))
+    assert "Ahora cuadra" in updated.analysis and "El balance no cuadra" not in updated.analysis
+    assert updated.recent() == history
+    # The context read before the update is left as it was
+    assert "El balance no cuadra" in context.analysis
+    assert not session_service.update_analysis("missing", {})
+
+
+def test_chat_request_sends_history_as_messages():
+    session_id = session_service.create_session(ANALYSIS, {}, ["libro.xlsx"])
+    chat(session_id, 1)
+    context = session_service.context(session_service.get_session(session_id))
+    
+    with patch.object(settings, "OPENAI_API_KEY", "test"):
+        request = OpenAIService()._chat_request(context, "¿Y ahora?")
+    roles = [message["role"] for message in request["messages"]]
+    assert roles == ["system", "user", "assistant", "user"]
+    assert request["messages"][0]["content"].startswith(CHAT_INSTRUCTIONS)
+    assert request["messages"][-1]["content"] == "¿Y ahora?"
+    
+    # A plain text context still works
+    with patch.object(settings, "OPENAI_API_KEY", "test"):
+        request = OpenAIService()._chat_request("contexto", "hola")
+    assert [message["role"] for message in request["messages"]] == ["system", "user"]
+
+
+def test_long_histories_are_folded_into_a_summary():
+    session_id = session_service.create_session(ANALYSIS, {}, ["libro.xlsx"])
+    ai_service = SummarizingAIService()
+    compactor = ConversationCompactor(session_service)
+    
+    async def scenario():
+        tokens = []
+        for turn in range(20):
+            context = session_service.context(session_service.get_session(session_id))
+            tokens.append(context.history_tokens())
+            session = session_service.add_message_to_session(session_id, f"Pregunta {turn}", f"Respuesta {turn} " + "detalle " * 100)
+            compactor.schedule(session, ai_service)
+            # The compaction runs while the user reads the answer
+            await asyncio.gather(*compactor._tasks.values())
+        return tokens
+    
+    with patch.object(settings, "CHAT_HISTORY_TOKENS", 1000), patch.object(settings, "CHAT_HISTORY_MESSAGES", 100):
+        tokens = asyncio.run(scenario())
+    
+    # The prompt stays bounded while every message is either sent or summarized
+    assert max(tokens) <= 1000 + 250
+    session = session_service.get_session(session_id)
+    context = session_service.context(session)
+    assert session.summarized_messages == context.summarized > 0
+    assert context.recent() == context.history[session.summarized_messages:]
+    assert context.recent()[0]["role"] == "user"
+    folded = [content for _, contents in ai_service.calls for content in contents]
+    assert folded == [message.content for message in session.conversation_history[:session.summarized_messages]]
+    
+    # Each call extends the previous summary
+    assert ai_service.calls[1][0] == "Resumen de %d mensajes." % len(ai_service.calls[0][1])
+    assert session.conversation_summary in context.messages(CHAT_INSTRUCTIONS, "¿Y?")[0]["content"]
+    # Another worker gets the summary from the store
+    other = SessionService(session_service.store)
+    assert other.get_conversation_context(session_id) == context.text()
+
+
+def test_messages_dropped_by_the_window_are_summarized():
+    session_id = session_service.create_session(ANALYSIS, {}, ["libro.xlsx"])
+    with patch.object(settings, "CHAT_HISTORY_TOKENS", 100000), patch.object(settings, "CHAT_HISTORY_MESSAGES", 2):
+        chat(session_id, 3)
+        context = session_service.context(session_service.get_session(session_id))
+    assert context.start == 4
+    assert context.pending() == 4
+
+
+def test_failed_or_stale_compactions_keep_the_history():
+    session_id = session_service.create_session(ANALYSIS, {}, ["libro.xlsx"])
+    compactor = ConversationCompactor(session_service)
+    
+    async def scenario(ai_service):
+        session = session_service.get_session(session_id)
+        assert compactor.schedule(session, ai_service)
+        # One compaction per session at a time
+        assert not compactor.schedule(session, ai_service)
+        await asyncio.gather(*compactor._tasks.values())
+    
+    with patch.object(settings, "CHAT_HISTORY_TOKENS", 50):
+        session_service.add_message_to_session(session_id, "Pregunta", "Respuesta " + "detalle " * 100)
+        session_service.add_message_to_session(session_id, "Otra pregunta", "Otra respuesta")
+        errors = metrics.snapshot()["counters"].get("chat.compaction_errors", 0)
+        asyncio.run(scenario(SummarizingAIService(fail=True)))
+        assert metrics.snapshot()["counters"]["chat.compaction_errors"] == errors + 1
+        assert session_service.get_session(session_id).summarized_messages == 0
+        
+        # The next turn retries
+        asyncio.run(scenario(SummarizingAIService()))
+    assert session_service.get_session(session_id).summarized_messages == 2
+    # A summary computed from an outdated state is dropped
+    assert not session_service.update_summary(session_id, "Viejo", 0, 2)
@@ -0,0 +1,87 @@
+"""
+Tests for pre-flight token estimates and the /analyze/estimate endpoint
+"""
+
+import io
+from unittest.mock import patch
+
+import pandas as pd
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.dependencies import get_ai_service
+from app.main import app
+from app.services.ai.openai_service import OpenAIService
+from app.services.ai.tokens import model_spec, projected_cost
+
+EXCEL_DATA = "=== ANÁLISIS DE ARCHIVO: libro.xlsx ===\n--- HOJA: Diario ---\n" + "\n".join(
+    f"Fila {i}: Cuenta: Caja | Debe: {i * 10} | Haber: 0" for i in range(1, 400)
+)
+
+
+class CountingAIService(OpenAIService):
+    def __init__(self):
+        self.model = "gpt-4o-mini"
+        self.calls = 0
+    
+    async def analyze_accounting_data_async(self, excel_data, custom_prompt="", use_cache=True):
+        self.calls += 1
+        raise AssertionError("OpenAI must not be called")
+
+
+def test_model_specs_match_dated_versions():
+    assert model_spec("gpt-4o-mini-2024-07-18")["input_price"] == 0.15
+    assert model_spec("gpt-4o-2024-08-06")["input_price"] == 2.50
+    assert projected_cost(1_000_000, 1_000_000, "gpt-4o-mini") == 0.75
+    
+    with patch.object(settings, "OPENAI_INPUT_PRICE", 1.0):
+        assert model_spec("gpt-4o-mini")["input_price"] == 1.0
+
+
+def test_single_call_estimate():
+    estimate = CountingAIService().estimate_analysis(EXCEL_DATA, "revisar")
+    
+    assert estimate.strategy == "single"
+    assert estimate.calls == 1
+    assert estimate.chunk_tokens == [estimate.input_tokens]
+    assert estimate.max_output_tokens == 2048
+    assert estimate.projected_cost_usd == round(projected_cost(estimate.input_tokens, 2048, "gpt-4o-mini"), 6)
+    assert estimate.allowed
+
+
+def test_small_context_window_switches_to_chunks():
+    with patch.object(settings, "OPENAI_CONTEXT_WINDOW", 6000):
+        estimate = CountingAIService().estimate_analysis(EXCEL_DATA)
+    
+    assert estimate.strategy == "chunked"
+    assert estimate.calls == len(estimate.chunk_tokens) + 1
+    assert all(tokens + 2048 <= 6000 for tokens in estimate.chunk_tokens)
+
+
+def build_workbook() -> bytes:
+    buffer = io.BytesIO()
+    pd.DataFrame({"Cuenta": ["Caja"] * 50, "Debe": range(50)}).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def test_endpoints_estimate_and_reject_over_budget():
+    ai_svc = CountingAIService()
+    app.dependency_overrides[get_ai_service] = lambda: ai_svc
+    try:
+        client = TestClient(app)
+        files = {"files": ("libro.xlsx", build_workbook())}
+        
+        estimate = client.post("/analyze/estimate", files=files)
+        with patch.object(settings, "ANALYSIS_MAX_COST_USD", 0.000001):
+            rejected_estimate = client.post("/analyze/estimate", files=files)
+            rejected = client.post("/analyze/", files=files)
+    finally:
+        app.dependency_overrides.clear()
+    
+    assert estimate.status_code == 200
+    assert estimate.json()["allowed"] is True
+    assert estimate.json()["input_tokens"] > 0
+    assert rejected_estimate.json()["allowed"] is False
+    assert rejected.status_code == 413
+    assert "costo estimado" in rejected.json()["error"]
+    assert ai_svc.calls == 0
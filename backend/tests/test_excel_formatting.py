@@ -0,0 +1,136 @@
+"""
+Tests for the column-wise row formatter of ExcelProcessor
+"""
+
+import asyncio
+import io
+import os
+from datetime import datetime
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from app.core.config import settings
+from app.services.excel_service import ExcelProcessor
+
+
+def iterrows_reference(df):
+    """Row formatting as it was done with df.iterrows()"""
+    rows = []
+    for idx, row in df.iterrows():
+        row_data = []
+        for col_idx, value in enumerate(row):
+            if pd.notna(value):
+                if isinstance(value, (int, float)):
+                    if isinstance(value, float) and value.is_integer():
+                        formatted_value = f"{int(value)}"
+                    else:
+                        formatted_value = f"{value:,.2f}"
+                else:
+                    formatted_value = str(value)
+                row_data.append(f"Col{col_idx+1}: {formatted_value}")
+        if row_data:
+            rows.append(f"Fila {idx+1}: {' | '.join(row_data)}")
+    return rows
+
+
+def assert_same_rows(df):
+    df = df.dropna(how='all').dropna(axis=1, how='all')
+    assert ExcelProcessor()._format_rows(df) == iterrows_reference(df)
+
+
+def test_mixed_text_and_numbers():
+    assert_same_rows(pd.DataFrame({
+        0: ["Concepto", "Ventas", "Caja", None, "Total"],
+        1: ["Debe", 0, 1000, None, 1234567.891],
+        2: [np.nan, 1000.5, -0.0, None, 1e20],
+    }))
+
+
+def test_numeric_only_frames():
+    # Integer columns are upcast when a float column is present
+    assert_same_rows(pd.DataFrame({0: [1, 2, 3000], 1: [1.5, np.nan, 2.0]}))
+    assert_same_rows(pd.DataFrame({0: [1, 2, 3000], 1: [10, 20, 30]}))
+    assert_same_rows(pd.DataFrame({0: [np.inf, -np.inf, 2.0**70], 1: [0.004, -12.5, np.nan]}))
+
+
+def test_bool_and_dates():
+    assert_same_rows(pd.DataFrame({0: [True, False], 1: [True, True]}))
+    assert_same_rows(pd.DataFrame({
+        0: [True, False],
+        1: [datetime(2024, 1, 31), pd.NaT],
+        2: [1, 2],
+    }))
+
+
+def test_extract_data_from_workbook():
+    df = pd.DataFrame({
+        "Cuenta": ["Caja", "Bancos", None],
+        "Debe": [100, 2500.75, 3],
+        "Haber": [None, 50, 7.0],
+    })
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False, sheet_name="Balance")
+    
+    text = ExcelProcessor().extract_data_from_excel(buffer.getvalue(), "balance.xlsx")
+    
+    assert "--- HOJA: Balance ---" in text
+    assert "Fila 1: Col1: Cuenta | Col2: Debe | Col3: Haber" in text
+    assert "Fila 3: Col1: Bancos | Col2: 2,500.75 | Col3: 50.00" in text
+
+
+def test_streaming_mode_yields_rows_and_statistics():
+    df = pd.DataFrame({
+        "Cuenta": ["Caja", "Bancos", None],
+        "Debe": [100, 2500.75, 3],
+        "Haber": [None, 50, 7.0],
+    })
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        df.to_excel(writer, index=False, sheet_name="Balance")
+        pd.DataFrame().to_excel(writer, index=False, sheet_name="Vacia")
+        pd.DataFrame({0: [1, 2.5]}).to_excel(writer, index=False, header=False, sheet_name="Montos")
+    
+    processor = ExcelProcessor(ingestion_mode="streaming")
+    lines = processor.iter_excel_lines(buffer.getvalue(), "balance.xlsx")
+    assert next(lines) == "=== ANÁLISIS DE ARCHIVO: balance.xlsx ===\n"
+    
+    text = "\n".join(lines)
+    assert "Fila 1: Col1: Cuenta | Col2: Debe | Col3: Haber" in text
+    assert "Fila 3: Col1: Bancos | Col2: 2,500.75 | Col3: 50.00" in text
+    assert "Fila 4: Col2: 3.00 | Col3: 7" in text
+    assert "Dimensiones: 4 filas x 3 columnas" in text
+    assert "--- HOJA: Vacia ---\nEsta hoja está vacía o no contiene datos válidos." in text
+    # Header cells make the columns non-numeric, as with pandas dtypes
+    assert text.count("Resumen estadístico") == 1
+    assert "Columna 1: Suma=3.50, Promedio=1.75, Min=1.00, Max=2.50" in text
+
+
+def test_read_upload_spools_large_files_and_rejects_early():
+    buffer = io.BytesIO()
+    pd.DataFrame({"Cuenta": ["Caja"] * 200, "Monto": range(200)}).to_excel(buffer, index=False)
+    content = buffer.getvalue()
+    processor = ExcelProcessor()
+    
+    with patch.object(settings, "UPLOAD_CHUNK_SIZE", 1024), patch.object(settings, "UPLOAD_SPOOL_THRESHOLD", 2048):
+        upload = asyncio.run(processor.read_upload(UploadFile(io.BytesIO(content), filename="libro.xlsx"), len(content)))
+        try:
+            assert upload.size == len(content)
+            assert os.path.getsize(upload.source) == len(content)
+            assert processor.extract_data_from_excel(upload.source, "libro.xlsx") == \
+                processor.extract_data_from_excel(content, "libro.xlsx")
+        finally:
+            upload.cleanup()
+        assert not os.path.exists(upload.path)
+        
+        # Size is checked while reading, magic bytes on the first chunk
+        with pytest.raises(HTTPException) as too_large:
+            asyncio.run(processor.read_upload(UploadFile(io.BytesIO(content), filename="libro.xlsx"), 4096))
+        assert "demasiado grande" in too_large.value.detail
+        
+        with pytest.raises(HTTPException) as not_excel:
+            asyncio.run(processor.read_upload(UploadFile(io.BytesIO(b"a,b\n1,2"), filename="libro.xlsx"), 4096))
+        assert "no corresponde" in not_excel.value.detail
@@ -0,0 +1,42 @@
+"""
+Tests for the bounded executor used for blocking stages
+"""
+
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.utils.executor import BoundedExecutor
+from app.utils.metrics import metrics
+
+
+def test_event_loop_keeps_running_and_queue_is_bounded():
+    executor = BoundedExecutor("test", max_workers=1, max_queue=1)
+    release = threading.Event()
+    
+    async def scenario():
+        running = asyncio.ensure_future(executor.run(release.wait, 5))
+        queued = asyncio.ensure_future(executor.run(lambda: "listo"))
+        await asyncio.sleep(0.05)
+        
+        # The loop is free while the pool is busy
+        stats = metrics.snapshot()["gauges"]["executor.test"]
+        assert stats["active"] == 1
+        assert stats["queue_depth"] == 1
+        assert stats["saturation"] == 1.0
+        
+        with pytest.raises(HTTPException) as exc_info:
+            await executor.run(lambda: None)
+        assert exc_info.value.status_code == 503
+        
+        release.set()
+        return await running, await queued
+    
+    assert asyncio.run(scenario()) == (True, "listo")
+    stats = executor.stats()
+    assert stats["completed"] == 2
+    assert stats["rejected"] == 1
+    assert stats["queue_depth"] == 0
+    executor.shutdown()
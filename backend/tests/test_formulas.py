@@ -0,0 +1,171 @@
+"""
+Tests for reading formulas and recomputing them locally
+"""
+
+import io
+import re
+import zipfile
+from datetime import datetime
+from unittest.mock import patch
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from app.services.checks import CheckEngine
+from app.services.checks.formulas import evaluate_formulas, parse_formula
+from app.services.excel_service import ExcelProcessor, FormulaSheet
+
+
+def workbook(values: dict, formulas: dict) -> bytes:
+    """An .xlsx whose formulas carry the given cached results, as if Excel had saved it"""
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = "Balance"
+    for reference, value in values.items():
+        sheet[reference] = value
+    for reference, (formula, _) in formulas.items():
+        sheet[reference] = formula
+    buffer = io.BytesIO()
+    book.save(buffer)
+    
+    # openpyxl writes formulas without a cached value, so add one to the sheet XML
+    source = zipfile.ZipFile(io.BytesIO(buffer.getvalue()))
+    xml = source.read("xl/worksheets/sheet1.xml").decode()
+    for reference, (_, cached) in formulas.items():
+        kind = ' t="e"' if isinstance(cached, str) else ""
+        xml = re.sub(
+            rf'<c r="{reference}"><f>(.*?)</f><v ?/>',
+            lambda match: f'<c r="{reference}"{kind}><f>{match.group(1)}</f><v>{cached}</v>',
+            xml
+        )
+    
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as target:
+        for item in source.infolist():
+            data = xml.encode() if item.filename == "xl/worksheets/sheet1.xml" else source.read(item.filename)
+            target.writestr(item, data)
+    return output.getvalue()
+
+
+def test_parse_formula_templates():
+    assert parse_formula("=SUM(B2:B5)")[0] == "v0"
+    template, terms = parse_formula("=B2-C2*1.16")
+    assert template == "v0 - v1 * 1.16"
+    assert [term.kind for term in terms] == ["cell", "cell"]
+    template, terms = parse_formula("=SUBTOTAL(9,$B$2:$B$5)+10%")
+    assert template == "v0 + (10/100)" and terms[0].subtotal
+    
+    assert parse_formula("=IF(A1>0,1,2)") is None
+    assert parse_formula("=Otra!A1+1") is None
+    assert parse_formula("=SUM(B2:B5,VLOOKUP(A1,C:D,2))") is None
+    assert parse_formula("=B2:B5") is None
+
+
+def test_evaluation_matches_excel_semantics():
+    values = np.array([
+        [10.0, 1.0],
+        [20.0, 2.0],
+        [30.0, np.nan],  # SUBTOTAL cell, excluded by the grand subtotal
+        [5.0, 4.0],
+        [np.nan, np.nan],
+    ])
+    formulas = [
+        parse_formula("=SUBTOTAL(9,A1:A2)"),
+        parse_formula("=SUBTOTAL(9,A1:A4)"),
+        parse_formula("=SUM(A1:B2)/COUNT(B1:B4)"),
+        parse_formula("=AVERAGE(B1:B9)"),
+        parse_formula("=(A1+A2)^2-B5"),
+    ]
+    subtotal_cells = np.zeros(values.shape, dtype=bool)
+    subtotal_cells[2, 0] = True
+    
+    computed = evaluate_formulas(values, formulas, subtotal_cells)
+    
+    np.testing.assert_allclose(computed, [30.0, 35.0, 11.0, 7 / 3, 900.0])
+
+
+def test_stale_values_short_ranges_and_errors_are_findings():
+    content = workbook(
+        {
+            "A1": "Concepto", "B1": "Importe", "C1": "IVA",
+            "A2": "Venta A", "B2": 100, "A3": "Venta B", "B3": 200,
+            "A4": "Venta C", "B4": 50, "A5": "Total",
+        },
+        {
+            "C2": ("=B2*0.16", 16),
+            "C3": ("=B3*0.16", 30),  # stale: 200 * 0.16 is 32
+            "C4": ("=B4/0", "#DIV/0!"),
+            "B5": ("=SUM(B2:B3)", 300),  # leaves B4 out
+        }
+    )
+    
+    report = CheckEngine(names=["formulas"]).check_file(content, "libro.xlsx")
+    by_title = {finding.title: finding for finding in report.findings}
+    
+    assert set(by_title) == {"Valor de fórmula no coincide", "Fórmula con error", "Rango de suma incompleto"}
+    assert by_title["Valor de fórmula no coincide"].row == 3
+    assert "celda C3" in by_title["Valor de fórmula no coincide"].location
+    assert "32.00" in by_title["Valor de fórmula no coincide"].description
+    assert "#DIV/0!" in by_title["Fórmula con error"].description
+    assert by_title["Rango de suma incompleto"].row == 5
+    assert report.sheets[0].rows == [1, 3, 4, 5]
+
+
+def test_consistent_workbook_has_no_findings():
+    content = workbook(
+        {"A1": "Importe", "A2": 1.5, "A3": 2.5},
+        {"A4": ("=SUM(A2:A3)", 4), "B2": ("=A2*2", 3)}
+    )
+    
+    report = CheckEngine(names=["formulas"]).check_file(content, "libro.xlsx")
+    
+    assert report.findings == []
+    assert report.sheets[0].checks == ["formulas"]
+
+
+def test_date_arithmetic_uses_excel_serial_numbers():
+    content = workbook(
+        {"A1": "Emisión", "B1": "Vencimiento", "A2": datetime(2024, 1, 1), "B2": datetime(2024, 1, 31, 12)},
+        {"C2": ("=B2-A2", 30.5), "D2": ("=A2+30", 45322)}
+    )
+    
+    sheet = ExcelProcessor().read_formulas(content, "libro.xlsx")["Balance"]
+    assert sheet.values[1, 0] == 45292
+    
+    report = CheckEngine(names=["formulas"]).check_file(content, "libro.xlsx")
+    assert report.findings == []
+
+
+def test_read_formulas_aligns_with_sheet_coordinates():
+    content = workbook({"C3": 7, "C4": 8}, {"C6": ("=SUM(C3:C4)", 15)})
+    
+    [(name, sheet)] = ExcelProcessor().read_formulas(content, "libro.xlsx").items()
+    
+    assert name == "Balance"
+    assert isinstance(sheet, FormulaSheet)
+    assert sheet.formulas == [(6, 3, "=SUM(C3:C4)")]
+    assert sheet.values[2, 2] == 7 and sheet.values[5, 2] == 15
+    assert ExcelProcessor().read_formulas(content, "libro.xls") == {}
+    
+    frame = pd.read_excel(io.BytesIO(content), header=None)
+    assert frame.iloc[5, 2] == 15  # pandas uses the same coordinates
+
+
+def test_only_sheets_with_formulas_are_read_for_them():
+    book = openpyxl.Workbook()
+    book.active.title = "Datos"
+    book.active["A1"] = 5
+    book.create_sheet("Totales")["A1"] = "=Datos!A1*2"
+    buffer = io.BytesIO()
+    book.save(buffer)
+    
+    sheets = ExcelProcessor().read_formulas(buffer.getvalue(), "libro.xlsx")
+    assert list(sheets) == ["Totales"]
+    assert sheets["Totales"].formulas == [(1, 1, "=Datos!A1*2")]
+    
+    # A workbook without formulas is not opened by openpyxl at all
+    plain = workbook({"A1": "Importe", "A2": 3}, {})
+    with patch("app.services.excel_service.openpyxl.load_workbook") as load:
+        assert ExcelProcessor().read_formulas(plain, "libro.xlsx") == {}
+    load.assert_not_called()
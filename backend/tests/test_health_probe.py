@@ -0,0 +1,90 @@
+"""
+Tests for the cached background health probe and the health endpoints
+"""
+
+import asyncio
+from unittest.mock import patch
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.api.endpoints import health
+from app.main import app
+from app.services.ai.health_probe import AIHealthProbe
+
+
+class PingService:
+    def __init__(self, error=None, delay=0):
+        self.error = error
+        self.delay = delay
+        self.pings = 0
+    
+    async def ping_async(self):
+        self.pings += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+
+
+def checked_probe(service) -> AIHealthProbe:
+    probe = AIHealthProbe(interval=30, timeout=0.05)
+    probe._get_service = lambda: service
+    asyncio.run(probe.check())
+    return probe
+
+
+def test_health_reads_cached_status_without_calling_upstream():
+    service = PingService()
+    probe = checked_probe(service)
+    
+    with patch.object(health, "ai_health_probe", probe):
+        client = TestClient(app)
+        responses = [client.get("/health") for _ in range(3)]
+        ready = client.get("/health/ready")
+    
+    assert service.pings == 1
+    assert all(response.json()["services"]["ai_service"] == "available" for response in responses)
+    assert responses[0].json()["status"] == "healthy"
+    assert ready.status_code == 200
+
+
+def test_unavailable_upstream_is_degraded_but_alive():
+    probe = checked_probe(PingService(error=RuntimeError("Connection refused")))
+    
+    with patch.object(health, "ai_health_probe", probe):
+        client = TestClient(app)
+        data = client.get("/health").json()
+        ready = client.get("/health/ready")
+        live = client.get("/health/live")
+    
+    assert data["status"] == "degraded"
+    assert data["ai_service"]["error"] == "Connection refused"
+    assert ready.status_code == 503
+    assert live.status_code == 200
+
+
+def test_probe_reports_timeouts_and_missing_configuration():
+    assert checked_probe(PingService(delay=1)).status["status"] == "unavailable"
+    
+    def missing_key():
+        raise HTTPException(status_code=503, detail="OPENAI_API_KEY no está configurada")
+    
+    probe = AIHealthProbe(interval=30, timeout=1)
+    probe._get_service = missing_key
+    asyncio.run(probe.check())
+    assert probe.status["status"] == "error"
+    assert "OPENAI_API_KEY" in probe.status["error"]
+
+
+def test_background_probe_refreshes_on_interval():
+    service = PingService()
+    probe = AIHealthProbe(interval=0.02, timeout=1)
+    
+    async def scenario():
+        probe.start(lambda: service)
+        await asyncio.sleep(0.1)
+        await probe.stop()
+    
+    asyncio.run(scenario())
+    assert service.pings >= 3
+    assert probe.available
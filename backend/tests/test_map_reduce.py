@@ -0,0 +1,82 @@
+"""
+Tests for the chunked (map-reduce) analysis of OpenAIService
+"""
+
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from app.core.config import settings
+from app.services.ai.chunking import split_excel_data
+from app.services.ai.openai_service import OpenAIService
+
+
+EXCEL_DATA = "\n".join(
+    ["=== ANÁLISIS DE ARCHIVO: libro.xlsx ===", "", "", "--- HOJA: Diario ---", "Dimensiones: 60 filas x 2 columnas", "", "Datos:"]
+    + [f"Fila {i}: Col1: Asiento {i} | Col2: {i * 100}" for i in range(1, 61)]
+)
+
+
+def completion(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def fake_create(**kwargs):
+    prompt = kwargs["messages"][0]["content"]
+    if "DATOS DEL ARCHIVO" not in prompt:
+        return completion("Resumen integrado")
+    
+    first_row = prompt.split("Fila ")[1].split(":")[0]
+    return completion(json.dumps({
+        "success": True,
+        "findings": [
+            {"type": "error", "title": "Descuadre en Diario", "location": "Hoja Diario", "severity": "high"},
+            {"type": "warning", "title": f"Revisar fila {first_row}", "location": f"Fila {first_row}"},
+        ],
+        "recommendations": [{"title": "Conciliar el diario", "description": "..."}],
+        "summary": f"Parte desde la fila {first_row}"
+    }))
+
+
+def test_split_keeps_rows_whole_and_repeats_headers():
+    chunks = split_excel_data(EXCEL_DATA, 200)
+    
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.startswith("=== ANÁLISIS DE ARCHIVO: libro.xlsx ===")
+        assert "--- HOJA: Diario ---" in chunk
+    rows = [line for chunk in chunks for line in chunk.split("\n") if line.startswith("Fila ")]
+    assert rows == [line for line in EXCEL_DATA.split("\n") if line.startswith("Fila ")]
+    assert split_excel_data(EXCEL_DATA, 100000) == [EXCEL_DATA]
+
+
+def test_large_data_is_analyzed_in_chunks_and_merged():
+    with patch.object(settings, "OPENAI_API_KEY", "test"), patch.object(settings, "ANALYSIS_CHUNK_TOKENS", 200):
+        service = OpenAIService()
+        service._complete_async = AsyncMock(side_effect=lambda request: fake_create(**request))
+        
+        result = service.analyze_accounting_data(EXCEL_DATA)
+    
+    chunks = result.metadata["chunks"]
+    assert chunks > 1
+    assert result.success
+    assert result.summary == "Resumen integrado"
+    # The repeated finding and recommendation appear once
+    assert [f.title for f in result.findings].count("Descuadre en Diario") == 1
+    assert len(result.findings) == chunks + 1
+    assert len(result.recommendations) == 1
+    assert result.metadata["critical_issues"] == 1
+
+
+def test_chunks_are_sized_with_the_model_tokenizer():
+    # A tokenizer that counts every character as a token fits far fewer rows per chunk
+    with patch.object(settings, "OPENAI_API_KEY", "test"), patch.object(settings, "ANALYSIS_CHUNK_TOKENS", 800):
+        service = OpenAIService()
+        heuristic = service._split(EXCEL_DATA, "")
+        with patch("app.services.ai.openai_service.count_tokens", side_effect=lambda text, model: len(text)):
+            exact = service._split(EXCEL_DATA, "")
+            estimate = service.estimate_analysis(EXCEL_DATA)
+    
+    assert len(exact) > len(heuristic)
+    assert all(sum(len(line) for line in chunk.split("\n")) <= 800 for chunk in exact)
+    assert len(estimate.chunk_tokens) == len(exact)
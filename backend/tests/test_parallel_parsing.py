@@ -0,0 +1,65 @@
+"""
+Tests for parallel parsing of several uploads in ExcelProcessor
+"""
+
+import io
+import uuid
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+
+from app.core.config import settings
+from app.services import excel_service
+from app.services.checks import CheckEngine
+from app.services.excel_service import ExcelProcessor
+
+
+def build_workbook(label: str) -> bytes:
+    buffer = io.BytesIO()
+    pd.DataFrame({"Cuenta": [label, "Caja"], "Monto": [1.5, 20]}).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def test_process_pool_keeps_upload_order_and_errors():
+    files_data = [
+        {'filename': "enero.xlsx", 'content': build_workbook("Enero")},
+        {'filename': "roto.xlsx", 'content': b"no es un excel"},
+        {'filename': "febrero.xlsx", 'content': build_workbook("Febrero")},
+    ]
+    processor = ExcelProcessor()
+    sequential = processor.process_multiple_files(files_data)
+    
+    with patch.object(settings, "EXCEL_PROCESS_POOL_SIZE", 2):
+        try:
+            excel_service.warm_up_process_pool()
+            parallel = processor.process_multiple_files(files_data)
+        finally:
+            excel_service.shutdown_process_pool()
+    
+    assert parallel == sequential
+    assert parallel.index("enero.xlsx") < parallel.index("Error procesando roto.xlsx") < parallel.index("febrero.xlsx")
+
+
+def test_pooled_results_are_cached_in_the_server():
+    files_data = [
+        {'filename': "enero.xlsx", 'content': build_workbook(str(uuid.uuid4()))},
+        {'filename': "febrero.xlsx", 'content': build_workbook(str(uuid.uuid4()))},
+    ]
+    processor = ExcelProcessor()
+    
+    with patch.object(settings, "EXCEL_PROCESS_POOL_SIZE", 2):
+        try:
+            excel_service.warm_up_process_pool()
+            text, reports = processor.extract_files(files_data, checks=CheckEngine())
+        finally:
+            excel_service.shutdown_process_pool()
+    assert [report.complete for report in reports] == [True, True]
+    
+    # A repeated upload is answered from this process' cache without using the pool
+    pool = MagicMock()
+    pool.map.side_effect = lambda function, jobs: [function(job) for job in jobs]
+    with patch("app.services.excel_service.get_process_pool", return_value=pool):
+        with patch.object(excel_service, "_extract_in_worker", side_effect=AssertionError("parsed again")):
+            cached_text, cached_reports = processor.extract_files(files_data, checks=CheckEngine())
+    assert cached_text == text
+    assert cached_reports == reports
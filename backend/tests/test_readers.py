@@ -0,0 +1,225 @@
+"""
+Tests for the spreadsheet reader backends and their selection
+"""
+
+import io
+import struct
+import zipfile
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.services.excel_service import ExcelProcessor
+from app.services.readers import CalamineReader, CsvReader, OpenpyxlReader, XlrdReader, choose_reader
+
+RELATIONSHIP = '<Relationship Id="{}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/{}" Target="{}"/>'
+RELATIONSHIPS = '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{}</Relationships>'
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="bin" ContentType="application/vnd.ms-excel.sheet.binary.macroEnabled.main"/>'
+    '<Override PartName="/xl/worksheets/sheet1.bin" ContentType="application/vnd.ms-excel.worksheet"/>'
+    '<Override PartName="/xl/sharedStrings.bin" ContentType="application/vnd.ms-excel.sharedStrings"/></Types>'
+)
+
+
+def _record(record_id: int, data: bytes = b"") -> bytes:
+    """A BIFF12 record: its id as raw little-endian bytes, its size as a 7-bit varint"""
+    header = bytes([record_id & 0xFF]) + (bytes([record_id >> 8]) if record_id > 0xFF else b"")
+    size = len(data)
+    while True:
+        byte = size & 0x7F
+        size >>= 7
+        header += bytes([byte | (0x80 if size else 0)])
+        if not size:
+            return header + data
+
+
+def _wide(text: str) -> bytes:
+    return struct.pack("<I", len(text)) + text.encode("utf-16-le")
+
+
+def xlsb_workbook(sheet_name: str, rows: list) -> bytes:
+    """A one-sheet .xlsb with the records the readers need, as no writer produces the format"""
+    strings, cells = [], b""
+    for row_index, row in enumerate(rows):
+        cells += _record(0x0000, struct.pack("<I", row_index) + bytes(13))
+        for column_index, value in enumerate(row):
+            head = struct.pack("<II", column_index, 0)
+            if isinstance(value, str):
+                if value not in strings:
+                    strings.append(value)
+                cells += _record(0x0007, head + struct.pack("<I", strings.index(value)))
+            elif value is not None:
+                cells += _record(0x0005, head + struct.pack("<d", value))
+    
+    width = max(len(row) for row in rows)
+    sheet = (
+        _record(0x0181) + _record(0x0194, struct.pack("<IIII", 0, len(rows) - 1, 0, width - 1))
+        + _record(0x0191) + cells + _record(0x0192) + _record(0x0182)
+    )
+    book = (
+        _record(0x0183) + _record(0x018F)
+        + _record(0x019C, struct.pack("<II", 0, 1) + _wide("rId1") + _wide(sheet_name))
+        + _record(0x0190) + _record(0x0184)
+    )
+    shared = (
+        _record(0x019F, struct.pack("<II", len(strings), len(strings)))
+        + b"".join(_record(0x0013, b"\x00" + _wide(text)) for text in strings) + _record(0x01A0)
+    )
+    
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("[Content_Types].xml", CONTENT_TYPES)
+        archive.writestr("_rels/.rels", RELATIONSHIPS.format(RELATIONSHIP.format("rId1", "officeDocument", "xl/workbook.bin")))
+        archive.writestr("xl/workbook.bin", book)
+        archive.writestr("xl/_rels/workbook.bin.rels", RELATIONSHIPS.format(
+            RELATIONSHIP.format("rId1", "worksheet", "worksheets/sheet1.bin")
+            + RELATIONSHIP.format("rId2", "sharedStrings", "sharedStrings.bin")
+        ))
+        archive.writestr("xl/worksheets/sheet1.bin", sheet)
+        archive.writestr("xl/sharedStrings.bin", shared)
+    return buffer.getvalue()
+
+
+def test_csv_with_semicolons_reads_decimal_commas():
+    content = "Cuenta;Debe;Haber\nCaja;1.234,50;\n\nBancos;;99,5\n".encode("utf-8")
+    [(name, frame)] = list(CsvReader().read(content, "diario.csv"))
+    
+    assert name == "diario"
+    # Blank lines are kept so positions match the file's line numbers
+    assert frame.shape == (4, 3)
+    # The header row does not keep the amounts below it as text
+    assert frame.iloc[1, 1] == 1234.5
+    assert frame.iloc[1, 0] == "Caja"
+    assert frame.iloc[3, 2] == 99.5
+    assert frame.iloc[0, 1] == "Debe"
+
+
+def test_csv_with_semicolons_keeps_dot_decimals_and_dotted_dates():
+    content = "Cuenta;Importe;Fecha\nCaja;3.14;01.02.2024\nBancos;1250.50;\nVentas;1.250;\n".encode("utf-8")
+    [(_, frame)] = list(CsvReader().read(content, "diario.csv"))
+    
+    assert frame.iloc[1, 1] == 3.14
+    assert frame.iloc[1, 2] == "01.02.2024"
+    assert frame.iloc[2, 1] == 1250.5
+    # Without a decimal comma anywhere in the file the dot is a decimal point
+    assert frame.iloc[3, 1] == 1.25
+
+
+def test_csv_decimal_comma_is_decided_for_the_whole_file():
+    content = "Cuenta;Debe;Haber\nCaja;1.250;\nBancos;1.25;\nVentas;;99,5\nIVA;3.14;\n".encode("utf-8")
+    [(_, frame)] = list(CsvReader().read(content, "diario.csv"))
+    
+    # With a decimal comma elsewhere in the file, dots group thousands
+    assert frame.iloc[1, 1] == 1250
+    assert frame.iloc[3, 2] == 99.5
+    # Cells that do not fit the 1.234,56 pattern keep their dot
+    assert frame.iloc[2, 1] == 1.25
+    assert frame.iloc[4, 1] == 3.14
+
+
+def test_csv_extraction_numbers_rows_like_the_file():
+    content = "Cuenta,Monto\nCaja,10.5\n\nBancos,20\n".encode("latin-1")
+    text = ExcelProcessor().extract_data_from_excel(content, "saldos.csv")
+    
+    assert "--- HOJA: saldos ---" in text
+    assert "Fila 2: Col1: Caja | Col2: 10.50" in text
+    assert "Fila 4: Col1: Bancos | Col2: 20" in text
+
+
+def test_csv_latin1_text_is_decoded():
+    content = "Cuenta;Descripción\nCaja;Depósito año\n".encode("latin-1")
+    [(_, frame)] = list(CsvReader().read(content, "cuentas.csv"))
+    assert frame.iloc[1, 1] == "Depósito año"
+
+
+def test_choose_reader_prefers_the_setting_and_falls_back():
+    assert isinstance(choose_reader("libro.xlsx", "openpyxl"), OpenpyxlReader)
+    # A backend that does not read the format is ignored
+    assert isinstance(choose_reader("datos.csv", "openpyxl"), CsvReader)
+    
+    with patch.object(XlrdReader, "available", classmethod(lambda cls: False)):
+        with patch("importlib.util.find_spec", return_value=None):
+            with pytest.raises(HTTPException) as error:
+                choose_reader("antiguo.xls")
+    assert error.value.status_code == 400
+
+
+def test_unreadable_formats_are_not_accepted():
+    with patch("app.services.excel_service.readable_extensions", return_value={".xlsx", ".csv"}):
+        processor = ExcelProcessor()
+    assert processor.supported_extensions == {".xlsx", ".csv"} & settings.ALLOWED_EXTENSIONS
+    
+    with pytest.raises(HTTPException) as error:
+        processor.validate_file("antiguo.xls", 10, 100)
+    assert error.value.status_code == 400
+
+
+def test_backends_agree_on_sheet_positions():
+    buffer = io.BytesIO()
+    df = pd.DataFrame({"Cuenta": ["Caja", "Bancos"], "Debe": [100, 250.5]})
+    with pd.ExcelWriter(buffer) as writer:
+        df.to_excel(writer, index=False, sheet_name="Diario", startrow=2, startcol=1)
+    
+    processor = ExcelProcessor(reader="openpyxl")
+    [(name, frame)] = list(processor.read_sheets(buffer.getvalue(), "libro.xlsx"))
+    assert name == "Diario"
+    # Index and columns are the 0-based sheet row and column
+    assert frame.index.tolist() == [2, 3, 4]
+    assert frame.columns.tolist() == [1, 2]
+    assert frame.loc[4, 2] == 250.5
+
+
+def test_auto_ingestion_streams_only_large_files():
+    processor = ExcelProcessor(ingestion_mode="auto")
+    with patch.object(settings, "EXCEL_STREAMING_MIN_BYTES", 100):
+        assert processor._use_streaming("libro.xlsx", "rows", b"x" * 100)
+        assert not processor._use_streaming("libro.xlsx", "rows", b"x" * 99)
+        assert not processor._use_streaming("libro.xls", "rows", b"x" * 1000)
+        assert not processor._use_streaming("libro.xlsx", "compact", b"x" * 1000)
+
+
+def test_xlsb_workbook_is_read():
+    pytest.importorskip("pyxlsb")
+    content = xlsb_workbook("Diario", [["Cuenta", "Debe"], ["Caja", 100.0], [None, None], ["Bancos", 250.5]])
+    processor = ExcelProcessor(reader="pyxlsb")
+    assert ".xlsb" in processor.supported_extensions
+    
+    [(name, frame)] = list(processor.read_sheets(content, "libro.xlsb"))
+    assert name == "Diario"
+    assert frame.index.tolist() == [0, 1, 3]
+    assert frame.loc[3, 1] == 250.5
+    
+    text = processor.extract_data_from_excel(content, "libro.xlsb")
+    assert "Fila 2: Col1: Caja | Col2: 100.00" in text
+    assert "Fila 4: Col1: Bancos | Col2: 250.50" in text
+
+
+def test_calamine_reads_like_the_other_backends():
+    pytest.importorskip("python_calamine")
+    buffer = io.BytesIO()
+    df = pd.DataFrame({"Cuenta": ["Caja", "Bancos"], "Debe": [100, 250.5]})
+    with pd.ExcelWriter(buffer) as writer:
+        df.to_excel(writer, index=False, sheet_name="Diario", startrow=2, startcol=1)
+    
+    processor = ExcelProcessor(reader="calamine")
+    assert isinstance(choose_reader("libro.xlsx", "calamine"), CalamineReader)
+    [(_, frame)] = list(processor.read_sheets(buffer.getvalue(), "libro.xlsx"))
+    [(_, expected)] = list(ExcelProcessor(reader="openpyxl").read_sheets(buffer.getvalue(), "libro.xlsx"))
+    assert frame.index.tolist() == expected.index.tolist()
+    assert frame.columns.tolist() == expected.columns.tolist()
+    assert frame.loc[4, 2] == 250.5
+    assert frame.loc[3, 1] == "Caja"
+    # Whole numbers come back as ints, so the prompt text does not depend on the backend
+    assert processor.extract_data_from_excel(buffer.getvalue(), "libro.xlsx") == \
+        ExcelProcessor(reader="openpyxl").extract_data_from_excel(buffer.getvalue(), "libro.xlsx")
+
+    content = xlsb_workbook("Diario", [["Cuenta", "Debe"], [None, None], ["Bancos", 250.5]])
+    [(name, frame)] = list(processor.read_sheets(content, "libro.xlsb"))
+    assert name == "Diario"
+    assert frame.index.tolist() == [0, 2]
+    assert frame.loc[2, 1] == 250.5
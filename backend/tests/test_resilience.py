@@ -0,0 +1,148 @@
+"""
+Tests for retries, hedging and the circuit breaker, against a local fake OpenAI server
+"""
+
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from app.core.config import settings
+from app.services.ai import http_client
+from app.services.ai.openai_service import OpenAIService
+
+ANALYSIS = json.dumps({"success": True, "summary": "Sin errores", "findings": [], "recommendations": []})
+
+
+class FakeOpenAI:
+    """Serves scripted (status, headers, delay) replies, then 200s with an analysis"""
+    
+    def __init__(self, script):
+        self.script = list(script)
+        self.requests = 0
+        self.lock = threading.Lock()
+    
+    def next_reply(self):
+        with self.lock:
+            self.requests += 1
+            return self.script.pop(0) if self.script else (200, {}, 0)
+
+
+@contextmanager
+def fake_openai(*script, **overrides):
+    fake = FakeOpenAI(script)
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            status, headers, delay = fake.next_reply()
+            time.sleep(delay)
+            
+            if status == 200:
+                body = {
+                    "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": ANALYSIS}}]
+                }
+            else:
+                body = {"error": {"message": f"fallo {status}", "type": "server_error"}}
+            payload = json.dumps(body).encode("utf-8")
+            
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    values = {
+        "OPENAI_API_KEY": "test",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}/v1",
+        "OPENAI_RETRY_BASE_DELAY": 0.01,
+        **overrides
+    }
+    try:
+        with patch.multiple(settings, **values):
+            yield fake
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_async(coroutine_factory):
+    async def run():
+        try:
+            return await coroutine_factory()
+        finally:
+            await http_client.close_http_client()
+    return asyncio.run(run())
+
+
+def test_transient_errors_are_retried():
+    with fake_openai((503, {}, 0), (502, {}, 0)) as fake:
+        result = OpenAIService().analyze_accounting_data("Fila 1: Caja: 10")
+    
+    assert result.success
+    assert fake.requests == 3
+
+
+def test_retry_after_is_honored():
+    with fake_openai((429, {"Retry-After": "0.3"}, 0)) as fake:
+        started = time.perf_counter()
+        answer = run_async(lambda: OpenAIService().chat_with_context_async("contexto", "¿Cuadra?"))
+        elapsed = time.perf_counter() - started
+    
+    assert answer == ANALYSIS
+    assert fake.requests == 2
+    assert elapsed >= 0.3
+
+
+def test_client_errors_are_not_retried():
+    with fake_openai((400, {}, 0)) as fake:
+        result = run_async(lambda: OpenAIService().analyze_accounting_data_async("Fila 1: Caja: 10"))
+    
+    assert not result.success
+    assert fake.requests == 1
+
+
+def test_slow_request_is_hedged():
+    with fake_openai((200, {}, 1.0), OPENAI_HEDGE_DELAY=0.05) as fake:
+        started = time.perf_counter()
+        result = run_async(lambda: OpenAIService().analyze_accounting_data_async("Fila 1: Caja: 10"))
+        elapsed = time.perf_counter() - started
+    
+    assert result.success
+    assert fake.requests == 2
+    assert elapsed < 0.8
+
+
+def test_circuit_opens_fails_fast_and_recovers(fresh_circuit_breaker):
+    breaker = fresh_circuit_breaker
+    breaker.failure_threshold = 2
+    breaker.recovery_timeout = 0.2
+    
+    with fake_openai((500, {}, 0), (500, {}, 0), OPENAI_MAX_RETRIES=0) as fake:
+        service = OpenAIService()
+        assert not service.analyze_accounting_data("Fila 1: Caja: 10").success
+        assert not service.analyze_accounting_data("Fila 2: Caja: 10").success
+        assert breaker.state == "open"
+        
+        rejected = service.analyze_accounting_data("Fila 3: Caja: 10")
+        assert "no está disponible" in rejected.error
+        assert fake.requests == 2
+        
+        time.sleep(0.25)
+        assert service.analyze_accounting_data("Fila 4: Caja: 10").success
+        assert breaker.state == "closed"
+        assert fake.requests == 3
@@ -0,0 +1,98 @@
+"""
+Tests for the cache of analysis completions
+"""
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+
+from app.core.config import settings
+from app.services.ai import http_client
+from app.services.ai.openai_service import OpenAIService
+
+ANALYSIS = json.dumps({
+    "success": True,
+    "summary": "Sin errores",
+    "findings": [{"type": "info", "title": "Cuadre correcto", "description": "", "location": "Hoja1",
+                  "severity": "low", "suggested_fix": ""}],
+    "recommendations": []
+})
+
+
+def completion_payload(content: str) -> dict:
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    }
+
+
+def run_with_fake_openai(scenario, content: str = ANALYSIS):
+    requests = []
+    
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        if request.content and json.loads(request.content).get("stream"):
+            chunk = {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "m",
+                     "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]}
+            body = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+            return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json=completion_payload(content))
+    
+    async def run():
+        with patch.object(http_client, "_http_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            return await scenario(OpenAIService())
+    
+    with patch.object(settings, "OPENAI_API_KEY", "test"):
+        return asyncio.run(run()), requests
+
+
+def test_identical_analysis_is_served_from_cache():
+    async def scenario(service):
+        first = await service.analyze_accounting_data_async("Fila 1: Caja: 10", "revisar")
+        second = await service.analyze_accounting_data_async("Fila 1: Caja: 10", "revisar")
+        other_prompt = await service.analyze_accounting_data_async("Fila 1: Caja: 10", "otro")
+        return first, second, other_prompt
+    
+    (first, second, other_prompt), requests = run_with_fake_openai(scenario)
+    
+    assert len(requests) == 2
+    assert first.metadata["cache_hits"] == 0
+    assert second.metadata["cache_hits"] == 1
+    assert other_prompt.metadata["cache_hits"] == 0
+    assert second.findings == first.findings
+
+
+def test_bypass_flag_skips_cache():
+    async def scenario(service):
+        await service.analyze_accounting_data_async("Fila 1: Caja: 10")
+        return await service.analyze_accounting_data_async("Fila 1: Caja: 10", use_cache=False)
+    
+    result, requests = run_with_fake_openai(scenario)
+    assert len(requests) == 2
+    assert result.metadata["cache_hits"] == 0
+
+
+def test_failed_analyses_are_not_cached():
+    async def invalid_twice(service):
+        await service.analyze_accounting_data_async("Fila 1: Caja: 10")
+        return await service.analyze_accounting_data_async("Fila 1: Caja: 10")
+    
+    result, requests = run_with_fake_openai(invalid_twice, content="no es JSON")
+    assert len(requests) == 2
+    assert not result.success
+
+
+def test_stream_shares_cache_with_plain_analysis():
+    async def scenario(service):
+        await service.analyze_accounting_data_async("Fila 1: Caja: 10")
+        return [item async for item in service.stream_accounting_analysis("Fila 1: Caja: 10")]
+    
+    items, requests = run_with_fake_openai(scenario)
+    assert len(requests) == 1
+    assert [kind for kind, _ in items] == ["finding", "result"]
+    assert items[-1][1].metadata["cache_hits"] == 1
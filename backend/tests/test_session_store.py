@@ -0,0 +1,413 @@
+"""
+Tests for the session stores shared by the workers
+"""
+
+import asyncio
+import socketserver
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from app.models.chat import AnalysisSession
+from app.core.config import settings
+from app.services.conversation import ConversationContext
+from app.services.session_service import ParsedSessions, SessionReaper, SessionService
+from app.services.session_store import MemorySessionStore, RedisSessionStore, SessionConflict, SQLiteSessionStore
+from app.utils.compression import compress, decompress
+from app.utils.resp import RespClient, RespError
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    """Local stand-in for Redis speaking the subset of RESP2 the session store uses"""
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RespHandler)
+        self.hashes = {}
+        self.expiry = {}
+        self.writes = {}  # key -> number of writes, for WATCH
+        self.lock = threading.Lock()
+    
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+    
+    def live(self, key):
+        if key in self.expiry and self.expiry[key] <= time.time():
+            self.hashes.pop(key, None)
+            self.expiry.pop(key, None)
+        return self.hashes.get(key)
+    
+    def run(self, name, args):
+        if name in ("HSET", "HINCRBY", "PEXPIRE", "DEL"):
+            for key in args[:1] if name != "DEL" else args:
+                self.writes[key] = self.writes.get(key, 0) + 1
+        if name == "HSET":
+            fields = self.hashes.setdefault(args[0], {})
+            added = sum(field not in fields for field in args[1::2])
+            fields.update(zip(args[1::2], args[2::2]))
+            return added
+        if name == "HGET":
+            return (self.live(args[0]) or {}).get(args[1])
+        if name == "HMGET":
+            fields = self.live(args[0]) or {}
+            return [fields.get(field) for field in args[1:]]
+        if name == "HINCRBY":
+            fields = self.hashes.setdefault(args[0], {})
+            value = int(fields.get(args[1], b"0")) + int(args[2])
+            fields[args[1]] = str(value).encode()
+            return value
+        if name == "PEXPIRE":
+            if self.live(args[0]) is None:
+                return 0
+            self.expiry[args[0]] = time.time() + int(args[1]) / 1000
+            return 1
+        if name == "DEL":
+            return sum(self.hashes.pop(key, None) is not None for key in args)
+        if name == "SCAN":
+            prefix = args[args.index(b"MATCH") + 1].rstrip(b"*")
+            return [b"0", [key for key in list(self.hashes) if key.startswith(prefix) and self.live(key) is not None]]
+        return RespError(f"ERR unknown command '{name}'")
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        queued = None
+        watched = {}
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = [self.rfile.read(int(self.rfile.readline()[1:]) + 2)[:-2] for _ in range(int(line[1:]))]
+            name, args = args[0].decode().upper(), args[1:]
+            
+            if name == "MULTI":
+                queued = []
+                reply = "OK"
+            elif name == "WATCH":
+                with self.server.lock:
+                    watched.update((key, self.server.writes.get(key, 0)) for key in args)
+                reply = "OK"
+            elif name == "UNWATCH":
+                watched = {}
+                reply = "OK"
+            elif name == "EXEC":
+                with self.server.lock:
+                    if any(self.server.writes.get(key, 0) != writes for key, writes in watched.items()):
+                        # A watched key changed: the transaction is discarded
+                        reply = None
+                    else:
+                        reply = [self.server.run(command, command_args) for command, command_args in queued]
+                queued = None
+                watched = {}
+            elif queued is not None:
+                queued.append((name, args))
+                reply = "QUEUED"
+            else:
+                with self.server.lock:
+                    reply = self.server.run(name, args)
+            self.wfile.write(encode(reply))
+
+
+def encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, RespError):
+        return f"-{reply}\r\n".encode()
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+
+
+@pytest.fixture(scope="module")
+def resp_server():
+    server = RespStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def make_store(request, tmp_path, resp_server):
+    """Factory of stores of one backend that share their data, like two workers"""
+    prefix = f"test-{request.node.name}:"
+    
+    def make(ttl=3600):
+        if request.param == "memory":
+            return shared.setdefault("memory", MemorySessionStore(ttl))
+        if request.param == "sqlite":
+            return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), ttl)
+        return RedisSessionStore(resp_server.url, ttl, prefix)
+    
+    shared = {}
+    return make
+
+
+def test_store_versions_and_skips_known_data(make_store):
+    store = make_store()
+    assert store.get("a") is None
+    assert store.put("a", b"uno", 100.0 + time.time(), b"libro") == (1, 1)
+    assert store.put("a", b"dos", time.time()) == (2, 1)
+    
+    stored = store.get("a")
+    assert (stored.data, stored.payload, stored.version, stored.payload_version) == (b"dos", b"libro", 2, 1)
+    # A worker that already has version 2 does not get the data again
+    assert store.get("a", known_version=2).data is None
+    assert store.get("a", known_version=1).data == b"dos"
+    # Nor the payload, which a chat turn does not rewrite
+    assert store.get("a", known_version=1, known_payload_version=1).payload is None
+    assert store.put("a", b"tres", time.time(), b"otro libro") == (3, 2)
+    assert store.get("a", 2, 1).payload == b"otro libro"
+
+
+def test_store_only_updates_existing_sessions_without_payload(make_store):
+    store = make_store()
+    assert store.put("a", b"uno", time.time()) is None
+    assert store.get("a") is None
+    assert list(store.items()) == []
+
+
+def test_store_writes_only_over_the_version_read(make_store):
+    store = make_store()
+    now = time.time()
+    assert store.put("a", b"uno", now, b"libro") == (1, 1)
+    assert store.put("a", b"dos", now, version=1) == (2, 1)
+    
+    # A writer that read version 1 does not overwrite version 2
+    with pytest.raises(SessionConflict):
+        store.put("a", b"tres", now, version=1)
+    with pytest.raises(SessionConflict):
+        store.put("a", b"tres", now, b"otro libro", version=1)
+    assert store.get("a")[:2] == (b"dos", b"libro")
+    
+    assert store.put("a", b"tres", now, b"otro libro", version=2) == (3, 2)
+    assert store.get("a")[:2] == (b"tres", b"otro libro")
+    # A conditional write never creates a session
+    assert store.put("b", b"uno", now, b"libro", version=1) is None
+    assert store.get("b") is None
+
+
+def test_store_touch_delete_and_items(make_store):
+    store = make_store()
+    now = time.time()
+    store.put("a", b"uno", now, b"libro")
+    store.put("b", b"dos", now, b"libro")
+    
+    assert store.touch("a", now + 5)
+    assert store.get("a").last_activity == pytest.approx(now + 5)
+    assert not store.touch("missing", now)
+    
+    assert sorted((session_id, data) for session_id, data, _ in store.items()) == [("a", b"uno"), ("b", b"dos")]
+    assert store.delete("b")
+    assert not store.delete("b")
+    assert [session_id for session_id, _, _ in store.items()] == ["a"]
+
+
+def test_store_expires_inactive_sessions(make_store):
+    store = make_store(ttl=0.2)
+    store.put("a", b"uno", time.time(), b"libro")
+    assert store.get("a") is not None
+    
+    time.sleep(0.3)
+    store.purge(time.time())
+    assert store.get("a") is None
+    assert list(store.items()) == []
+
+
+def test_purge_keeps_touched_sessions_and_honours_the_limit(make_store):
+    store = make_store(ttl=10)
+    now = time.time()
+    for i in range(5):
+        store.put(f"s{i}", b"x", now - 20, b"libro")
+    # Touched after it was written: its old expiry must not remove it
+    store.touch("s0", now)
+    store.delete("s1")
+    
+    if store.name == "redis":
+        # Redis expires keys by itself
+        assert store.purge(now) == 0
+        return
+    assert store.purge(now, limit=2) == 2
+    assert store.purge(now) == 1
+    assert [session_id for session_id, _, _ in store.items()] == ["s0"]
+
+
+def test_reaper_expires_sessions_off_the_request_path():
+    store = MemorySessionStore(ttl=0.3)
+    service = SessionService(store)
+    old = [service.create_session({}, {}, ["libro.xlsx"]) for _ in range(5)]
+    time.sleep(0.4)
+    recent = service.create_session({}, {}, ["libro.xlsx"])
+    
+    # Creating and listing sessions leaves expired ones to the reaper
+    with patch.object(store, "purge", side_effect=AssertionError("purge on the request path")):
+        service.create_session({}, {}, ["libro.xlsx"])
+        service.list_sessions()
+    
+    removed = asyncio.run(SessionReaper(service, interval=60, batch=2).reap())
+    assert removed == 5
+    assert list(service._parsed)[0] == recent
+    assert all(service.get_session(session_id) is None for session_id in old)
+
+
+def test_sessions_are_shared_between_workers(make_store):
+    first, second = SessionService(make_store()), SessionService(make_store())
+    
+    session_id = first.create_session({"summary": "Cuadra"}, {"data": "Fila 1"}, ["libro.xlsx"])
+    # The chat lands on the other worker
+    assert second.get_session(session_id).analysis_result == {"summary": "Cuadra"}
+    assert second.add_message_to_session(session_id, "¿Cuadra?", "Sí")
+    
+    # The first worker re-reads the session because its version changed
+    history = first.get_session(session_id).conversation_history
+    assert [message.content for message in history] == ["¿Cuadra?", "Sí"]
+    assert [listed["session_id"] for listed in second.list_sessions()] == [session_id]
+    
+    assert first.delete_session(session_id)
+    assert second.get_session(session_id) is None
+
+
+def test_unchanged_sessions_are_not_parsed_again(tmp_path):
+    service = SessionService(SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), 3600))
+    session_id = service.create_session({"summary": "Cuadra"}, {}, ["libro.xlsx"])
+    
+    with patch.object(AnalysisSession, "model_validate") as parse:
+        session = service.get_session(session_id)
+    parse.assert_not_called()
+    assert session.session_id == session_id
+
+
+def test_chat_turn_writes_only_the_conversation_once(make_store):
+    first, second = SessionService(make_store()), SessionService(make_store())
+    session_id = first.create_session({"summary": "Cuadra"}, {"data": "Fila 1: Col1: Caja\n" * 2000}, ["libro.xlsx"])
+    assert second.get_session(session_id).excel_data["data"].count("Caja") == 2000
+    
+    with patch.object(first.store, "put", wraps=first.store.put) as put:
+        assert first.add_message_to_session(session_id, "¿Cuadra?", "Sí")
+    [call] = put.call_args_list
+    assert call.args[3] is None and b"Caja" not in call.args[1]
+    
+    # The other worker re-reads the conversation and keeps the payload it parsed
+    read, get = [], second.store.get
+    with patch.object(second.store, "get", lambda *args: read.append(get(*args)) or read[-1]):
+        session = second.get_session(session_id)
+    assert read[0].payload is None and read[0].data is not None
+    assert [message.content for message in session.conversation_history] == ["¿Cuadra?", "Sí"]
+    assert session.excel_data["data"].count("Caja") == 2000
+    
+    if first.store.name == "sqlite":
+        # Deleting the session removes its payload too
+        assert first.delete_session(session_id)
+        assert first.store._connection().execute("SELECT COUNT(*) FROM chat_session_payloads").fetchone()[0] == 0
+    
+    # Messages for a session that is gone are not written
+    first.delete_session(session_id)
+    assert not first.add_message_to_session(session_id, "¿Sigue?", "No")
+
+
+def test_concurrent_turns_from_two_workers_are_both_kept(make_store):
+    first, second = SessionService(make_store()), SessionService(make_store())
+    session_id = first.create_session({"summary": "Cuadra"}, {"data": "Fila 1: Col1: Caja"}, ["libro.xlsx"])
+    first.context(first.get_session(session_id))
+    put, raced = first.store.put, []
+    
+    def put_after_the_other_worker(*args):
+        # The other worker writes its turn after this one has read the session
+        if not raced:
+            raced.append(True)
+            assert second.add_message_to_session(session_id, "¿Y el banco?", "Concilia")
+            assert second.update_summary(session_id, "Se habló del banco", 0, 2)
+        return put(*args)
+    
+    with patch.object(first.store, "put", put_after_the_other_worker):
+        session = first.add_message_to_session(session_id, "¿Cuadra?", "Sí")
+    
+    expected = ["¿Y el banco?", "Concilia", "¿Cuadra?", "Sí"]
+    assert [message.content for message in session.conversation_history] == expected
+    assert [message.content for message in second.get_session(session_id).conversation_history] == expected
+    assert second.get_session(session_id).conversation_summary == "Se habló del banco"
+    # The context is the one of the session written, not of the one first read
+    assert first.context(session).text() == ConversationContext(session).text()
+    
+    # A summary computed before the turn still lands, re-applied over it
+    assert first.update_summary(session_id, "Se habló del banco y la caja", 2, 4)
+    assert [message.content for message in second.get_session(session_id).conversation_history] == expected
+
+
+def test_resp_client_reports_errors_and_keeps_the_connection(resp_server):
+    client = RespClient(resp_server.url)
+    with pytest.raises(RespError):
+        client.command("NOPE")
+    assert client.command("HSET", "clave", "campo", "valor") == 1
+    assert client.command("HGET", "clave", "campo") == b"valor"
+
+
+def test_large_session_data_is_compressed_transparently():
+    data = b'{"data": "' + b"Fila 1: Col1: Caja | Col2: 100\n" * 500 + b'"}'
+    assert decompress(compress(data, "zlib")) == data
+    assert len(compress(data, "zlib")) < len(data) // 10
+    # Small or incompressible data is stored as is
+    assert compress(b'{"a": 1}', "zlib", min_bytes=4096) == b'{"a": 1}'
+    assert compress(data, "none") == data
+    
+    store = MemorySessionStore(ttl=3600)
+    service = SessionService(store)
+    with patch.object(settings, "SESSION_COMPRESSION", "zlib"), patch.object(settings, "SESSION_COMPRESS_MIN_BYTES", 1024):
+        session_id = service.create_session({"summary": "Cuadra"}, {"data": "Fila 1: Col1: Caja\n" * 2000}, ["libro.xlsx"])
+    
+    stored = store.get(session_id).payload
+    assert not stored.startswith(b"{") and len(stored) < 4000
+    # Another worker reads it back
+    assert SessionService(store).get_session(session_id).excel_data["data"].count("Caja") == 2000
+    assert SessionService(store).list_sessions()[0]["session_id"] == session_id
+
+
+def test_excel_data_is_compressed_once_per_session():
+    service = SessionService(MemorySessionStore(ttl=3600))
+    excel_data = {"data": "Fila 1: Col1: Caja | Col2: 100\n" * 5000}
+    with patch("app.services.session_service.compress", wraps=compress) as packed:
+        session_id = service.create_session({"summary": "Cuadra"}, excel_data, ["libro.xlsx"])
+        for turn in range(3):
+            service.add_message_to_session(session_id, f"Pregunta {turn}", "Respuesta")
+    
+    sizes = [len(call.args[0]) for call in packed.call_args_list]
+    assert sum(size > 100000 for size in sizes) == 1
+    assert len(sizes) == 2 + 3
+
+
+def test_parsed_sessions_stay_within_their_byte_budget():
+    store = MemorySessionStore(ttl=3600)
+    service = SessionService(store)
+    # About 1KB of JSON each: three fit
+    service._parsed = ParsedSessions(max_bytes=3300)
+    ids = [service.create_session({}, {"data": "x" * 800}, ["libro.xlsx"]) for _ in range(5)]
+    
+    stats = service.stats()["parsed"]
+    assert stats["bytes"] <= 3300 and stats["evictions"] == 2
+    assert list(service._parsed) == ids[2:]
+    # Evicted sessions are parsed again from the store
+    assert service.get_session(ids[0]).session_id == ids[0]
+    assert list(service._parsed)[-1] == ids[0]
+
+
+def test_memory_store_evicts_least_recently_used_over_budget():
+    store = MemorySessionStore(ttl=3600, max_bytes=250)
+    now = time.time()
+    for name in "abc":
+        store.put(name, b"x" * 60, now, b"x" * 40)
+    assert store.get("a") is None
+    
+    store.get("b")
+    store.put("d", b"x" * 60, now, b"x" * 40)
+    assert store.get("c") is None and store.get("b") is not None
+    assert store.stats() == {"backend": "memory", "entries": 2, "bytes": 200, "evictions": 2}
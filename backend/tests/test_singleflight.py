@@ -0,0 +1,108 @@
+"""
+Tests for single-flight coalescing of identical concurrent work
+"""
+
+import asyncio
+import io
+from unittest.mock import patch
+
+import httpx
+import pandas as pd
+import pytest
+
+from app.api.endpoints import analysis
+from app.core.config import settings
+from app.dependencies import get_ai_service
+from app.main import app
+from app.models.analysis import AnalysisResponse
+from app.services.ai.openai_service import OpenAIService
+from app.utils.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_result_and_errors():
+    flight = SingleFlight("test")
+    calls = []
+    
+    async def compute(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if value == "falla":
+            raise ValueError("sin datos")
+        return value.upper()
+    
+    async def scenario():
+        results = await asyncio.gather(*(flight.do("a", compute, "caja") for _ in range(5)))
+        errors = await asyncio.gather(*(flight.do("b", compute, "falla") for _ in range(3)), return_exceptions=True)
+        again = await flight.do("a", compute, "caja")
+        return results, errors, again
+    
+    results, errors, again = asyncio.run(scenario())
+    
+    assert results == ["CAJA"] * 5
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert again == "CAJA"
+    assert calls == ["caja", "falla", "caja"]
+    assert flight.stats() == {"started": 3, "coalesced": 6, "in_flight": 0}
+
+
+def test_cancelled_caller_does_not_cancel_shared_work():
+    flight = SingleFlight("test")
+    
+    async def compute():
+        await asyncio.sleep(0.02)
+        return "listo"
+    
+    async def scenario():
+        first = asyncio.ensure_future(flight.do("a", compute))
+        second = asyncio.ensure_future(flight.do("a", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+    
+    assert asyncio.run(scenario()) == "listo"
+
+
+class SlowAIService(OpenAIService):
+    def __init__(self):
+        self.model = settings.OPENAI_MODEL
+        self.calls = 0
+    
+    async def analyze_accounting_data_async(self, excel_data, custom_prompt="", use_cache=True):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return AnalysisResponse(success=True, summary="Sin errores", findings=[], recommendations=[])
+
+
+def test_identical_uploads_share_parse_and_analysis():
+    buffer = io.BytesIO()
+    pd.DataFrame({"Cuenta": ["Caja", "Bancos"], "Monto": [10, 20]}).to_excel(buffer, index=False)
+    workbook = buffer.getvalue()
+    ai_svc = SlowAIService()
+    parses = []
+    extract = analysis.excel_processor.extract_sheets
+    
+    def counting_extract(file_content, filename, encoding=None):
+        parses.append(filename)
+        return extract(file_content, filename, encoding)
+    
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(
+                client.post("/analyze/", files={"files": ("cierre.xlsx", workbook)}, data={"prompt": "revisar"})
+                for _ in range(4)
+            ))
+    
+    app.dependency_overrides[get_ai_service] = lambda: ai_svc
+    try:
+        with patch.object(analysis.excel_processor, "extract_sheets", counting_extract):
+            responses = asyncio.run(scenario())
+    finally:
+        app.dependency_overrides.clear()
+    
+    assert [response.status_code for response in responses] == [200] * 4
+    assert parses == ["cierre.xlsx"]
+    assert ai_svc.calls == 1
+    assert len({response.json()["session_id"] for response in responses}) == 4
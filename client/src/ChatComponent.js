@@ -5,6 +5,7 @@ const ChatComponent = ({ sessionId, onClose }) => {
   const [messages, setMessages] = useState([]);
   const [inputMessage, setInputMessage] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  const [streamingText, setStreamingText] = useState(null);
   const [error, setError] = useState(null);
   const messagesEndRef = useRef(null);
 
@@ -14,7 +15,7 @@ const ChatComponent = ({ sessionId, onClose }) => {
 
   useEffect(() => {
     scrollToBottom();
-  }, [messages]);
+  }, [messages, streamingText]);
 
   const handleSendMessage = async (e) => {
     e.preventDefault();
@@ -36,7 +37,10 @@ const ChatComponent = ({ sessionId, onClose }) => {
     setMessages(prev => [...prev, newUserMessage]);
 
     try {
-      const response = await apiService.sendChatMessage(sessionId, userMessage);
+      // Show the answer while it is being generated
+      const response = await apiService.streamChatMessage(sessionId, userMessage, (delta) => {
+        setStreamingText(prev => (prev || '') + delta);
+      });
       
       // Add AI response to chat
       const aiMessage = {
@@ -49,6 +53,7 @@ const ChatComponent = ({ sessionId, onClose }) => {
     } catch (err) {
       setError(err.message);
     } finally {
+      setStreamingText(null);
       setIsLoading(false);
     }
   };
@@ -77,7 +82,7 @@ const ChatComponent = ({ sessionId, onClose }) => {
           <div className="message assistant">
             <div className="message-content">
               <strong>Asistente IA:</strong>
-              <p>Escribiendo...</p>
+              <p>{streamingText || 'Escribiendo...'}</p>
             </div>
           </div>
         )}
@@ -7,6 +7,21 @@ const api = axios.create({
   timeout: 60000, // 60 segundos para archivos grandes
 });
 
+/**
+ * Convertir un bloque "event: ...\ndata: ..." en { type, data }
+ */
+const parseServerSentEvent = (block) => {
+  const event = { type: 'message', data: null };
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event: ')) {
+      event.type = line.slice(7);
+    } else if (line.startsWith('data: ')) {
+      event.data = JSON.parse(line.slice(6));
+    }
+  }
+  return event;
+};
+
 export const apiService = {
   /**
    * Verificar el estado del servidor
@@ -109,6 +124,62 @@ export const apiService = {
     }
   },
 
+  /**
+   * Enviar mensaje de chat recibiendo la respuesta a medida que se genera
+   * @param {string} sessionId - ID de la sesión del análisis
+   * @param {string} message - Mensaje del usuario
+   * @param {function} onDelta - Recibe cada fragmento de texto de la respuesta
+   */
+  async streamChatMessage(sessionId, message, onDelta) {
+    let response;
+    try {
+      response = await fetch(`${API_BASE_URL}/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          session_id: sessionId,
+          message: message
+        })
+      });
+    } catch (error) {
+      console.error('Error sending chat message:', error);
+      throw new Error('No se pudo conectar con el servidor');
+    }
+
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.detail || errorData.error || 'Error del servidor');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      buffer += decoder.decode(value, { stream: true });
+
+      // Los eventos SSE terminan con una línea en blanco
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const event = parseServerSentEvent(buffer.slice(0, boundary));
+        buffer = buffer.slice(boundary + 2);
+
+        if (event.type === 'delta') {
+          onDelta(event.data.content);
+        } else if (event.type === 'done') {
+          return event.data;
+        } else if (event.type === 'error') {
+          throw new Error(event.data.error);
+        }
+      }
+    }
+
+    throw new Error('La respuesta del servidor se interrumpió');
+  },
+
   /**
    * Obtener lista de sesiones
    */